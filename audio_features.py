@@ -0,0 +1,482 @@
+#
+# Copyright (C) 2023 Texas Instruments Incorporated - http://www.ti.com/
+#
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#    Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+#    Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the
+#    distribution.
+#
+#    Neither the name of Texas Instruments Incorporated nor the names of
+#    its contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''
+Feature extraction helpers for the keyword spotting model in kws_matchbox.py
+
+MFCCEngine computes the same MFCCs as librosa (melspectrogram with htk=True, norm=None; log; ortho DCT-II) using only NumPy, with the window, mel filterbank and DCT basis built once up front.
+The streaming extractor avoids recomputing the overlapping part of the 1 second window every time a new chunk of audio arrives from the microphone
+
+PolyphaseDecimator replaces librosa.resample when the capture rate is an integer multiple of the processing rate.
+
+Run this file directly to check parity against librosa and of the streaming path against whole windows, and benchmark per-chunk feature and resampling time, e.g. 
+    python3 audio_features.py down_0c40e715_nohash_0.wav
+'''
+
+import time
+import argparse
+import numpy as np
+
+
+def hz_to_mel_htk(freq):
+    return 2595.0 * np.log10(1.0 + freq / 700.0)
+
+def mel_to_hz_htk(mel):
+    return 700.0 * (10.0 ** (mel / 2595.0) - 1.0)
+
+def mel_filterbank(sr, n_fft, n_mels, fmin=0.0, fmax=None):
+    '''
+    Triangular HTK mel filterbank with no area normalization, equivalent to librosa.filters.mel(htk=True, norm=None)
+
+    :return: (n_mels, 1 + n_fft//2) float32 array
+    '''
+    fmax = sr / 2 if fmax is None else fmax
+    fft_freqs = np.linspace(0, sr / 2, 1 + n_fft // 2)
+    mel_freqs = mel_to_hz_htk(np.linspace(hz_to_mel_htk(fmin), hz_to_mel_htk(fmax), n_mels + 2))
+
+    fdiff = np.diff(mel_freqs)
+    ramps = mel_freqs[:, None] - fft_freqs[None, :]
+    lower = -ramps[:-2] / fdiff[:-1, None]
+    upper = ramps[2:] / fdiff[1:, None]
+    return np.maximum(0, np.minimum(lower, upper)).astype(np.float32)
+
+def dct_matrix(n_out, n_in):
+    '''
+    Orthonormal DCT-II basis, such that dct_matrix(n_out, n_in) @ x == scipy.fft.dct(x, type=2, norm='ortho', axis=0)[:n_out]
+    '''
+    n = np.arange(n_in)
+    k = np.arange(n_out)[:, None]
+    basis = np.cos(np.pi * k * (2 * n + 1) / (2 * n_in)) * np.sqrt(2.0 / n_in)
+    basis[0] *= np.sqrt(0.5)
+    return basis.astype(np.float32)
+
+
+class MFCCEngine():
+    '''
+    NumPy-only MFCC computation with all constant matrices precomputed.
+
+    Each frame is a win_length Hann window centered in an n_fft span, as librosa pads the window to n_fft. 
+    Only the win_length samples under the window are framed and the rFFT zero-pads them to n_fft; that shifts the frame in time, which changes the phase but not the power spectrum
+    '''
+    def __init__(self, sr=16000, n_fft=512, win_length=400, hop_length=160, n_mels=64, n_mfcc=64, log_offset=1e-6):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.win_length = win_length
+        self.hop_length = hop_length
+        self.n_mels = n_mels
+        self.n_mfcc = n_mfcc
+        self.log_offset = log_offset
+
+        # periodic Hann, same as scipy.signal.get_window('hann', win_length, fftbins=True)
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(win_length) / win_length)).astype(np.float32)
+        self.window_offset = (n_fft - win_length) // 2
+        self.mel_basis = mel_filterbank(sr, n_fft, n_mels)
+        self.dct_basis = dct_matrix(n_mfcc, n_mels)
+
+    def melspectrogram(self, y, center=True):
+        '''
+        Mel power spectrogram of y. With center=True, y is zero padded by n_fft//2 on both sides like librosa's default
+
+        :return: (n_mels, num_frames) float32 array
+        '''
+        y = np.asarray(y, dtype=np.float32)
+        if center:
+            y = np.pad(y, self.n_fft // 2)
+        num_frames = 1 + (len(y) - self.n_fft) // self.hop_length
+        if num_frames <= 0:
+            return np.zeros((self.n_mels, 0), dtype=np.float32)
+
+        frames = np.lib.stride_tricks.sliding_window_view(y[self.window_offset:], self.win_length)[:num_frames * self.hop_length:self.hop_length]
+        spectrum = np.fft.rfft(frames * self.window, n=self.n_fft, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        return (self.mel_basis @ power.astype(np.float32).T)
+
+    def mfcc_from_mel(self, melspec, scale=1.0):
+        '''
+        Log and DCT of a mel power spectrogram. scale is an amplitude scaling of the source audio, so the mel power is multiplied by scale**2
+        '''
+        S = np.log(melspec * np.float32(scale ** 2) + np.float32(self.log_offset))
+        return self.dct_basis @ S
+
+    def mfcc(self, y):
+        '''
+        MFCCs of y with center=True, matching AudioInference.calculate_features. Returns (n_mfcc, num_frames)
+        '''
+        return self.mfcc_from_mel(self.melspectrogram(y))
+
+
+class StreamingFeatureExtractor():
+    '''
+    Compute MFCC features for a sliding window over a continuous stream of audio samples.
+
+    Mel-spectrogram frames are computed once as samples arrive and held in a ring buffer, so each new chunk only costs the frames that chunk completes. 
+    Frames are kept as (un-normalized) mel power rather than MFCC so the per-window peak normalization done in AudioInference.convert_audio_for_features can still be applied when the window is assembled. 
+    The log and DCT are then a cheap pass over the assembled window.
+
+    Frame layout matches librosa with center=True: frame k is centered on sample k*hop_length, and the stream is zero-padded by n_fft//2 samples at the start.
+    The last frames of a window reach past the newest sample; these are zero-padded like librosa does at the end of a clip and are recomputed on every call rather than cached.
+    The first frames of a window reach before its start. The full-window features zero-pad there, so these are recomputed too rather than taken from the stream history
+    '''
+    def __init__(self, sr=16000, n_frames=101, n_fft=512, win_length=400, hop_length=160, n_mels=64, n_mfcc=64):
+        self.sr = sr
+        self.n_frames = n_frames
+        self.n_fft = n_fft
+        self.win_length = win_length
+        self.hop_length = hop_length
+        self.n_mels = n_mels
+        self.n_mfcc = n_mfcc
+        self.engine = MFCCEngine(sr=sr, n_fft=n_fft, win_length=win_length, hop_length=hop_length, n_mels=n_mels, n_mfcc=n_mfcc)
+        self.reset()
+
+    def reset(self):
+        '''
+        Drop all buffered samples and frames, e.g. when the input stream restarts
+        '''
+        half_fft = self.n_fft // 2
+        # recent samples, starting from absolute sample index self.buffer_start. Index 0 is the first sample pushed; negative indices are the zero padding
+        self.buffer = np.zeros(half_fft, dtype=np.float32)
+        self.buffer_start = -half_fft
+        self.num_samples = 0
+        # ring buffer of mel power frames. Frame k lives in column k % n_frames
+        self.mel_frames = np.zeros((self.n_mels, self.n_frames), dtype=np.float32)
+        self.next_frame = 0
+
+    def push(self, samples):
+        '''
+        Add newly arrived samples (already at self.sr) and compute every frame they complete. The samples of the latest window are kept for its first frames
+
+        :return: the number of new frames computed
+        '''
+        half_fft = self.n_fft // 2
+        self.buffer = np.concatenate([self.buffer, np.asarray(samples, dtype=np.float32)])
+        self.num_samples += len(samples)
+
+        # a frame is complete once every sample under its n_fft span has arrived
+        last_complete = (self.num_samples - half_fft) // self.hop_length
+        num_new = last_complete - self.next_frame + 1
+        if num_new > 0:
+            seg_start = self.next_frame * self.hop_length - half_fft - self.buffer_start
+            seg_end = last_complete * self.hop_length + half_fft - self.buffer_start
+            mel = self.engine.melspectrogram(self.buffer[seg_start:seg_end], center=False)
+
+            columns = np.arange(self.next_frame, last_complete + 1) % self.n_frames
+            self.mel_frames[:, columns] = mel
+            self.next_frame = last_complete + 1
+        else: 
+            num_new = 0
+
+        # keep the samples that the next uncached frame needs, and those of the earliest window a later get_features can ask for
+        keep_from = min(self.next_frame * self.hop_length - half_fft, (self.num_samples // self.hop_length - self.n_frames + 1) * self.hop_length)
+        if keep_from > self.buffer_start:
+            self.buffer = self.buffer[keep_from - self.buffer_start:]
+            self.buffer_start = keep_from
+
+        return num_new
+
+    def stream_segment(self, start, end, pending):
+        '''
+        Samples start to end of the stream (absolute indices) as a new array, with pending following the pushed samples and zeros where there are no samples
+        '''
+        segment = np.zeros(end - start, dtype=np.float32)
+        samples = np.concatenate([self.buffer, pending]) if len(pending) > 0 else self.buffer
+        low, high = max(start, self.buffer_start), min(end, self.buffer_start + len(samples))
+        if high > low:
+            segment[low - start:high - start] = samples[low - self.buffer_start:high - self.buffer_start]
+        return segment
+
+    def get_features(self, scale=1.0, pending=None, head=None):
+        '''
+        Assemble MFCCs for the n_frames-long window that ends at the newest sample
+
+        :param scale: amplitude scaling applied to the window before the log, e.g. 1/peak for peak normalization. Mel power is scaled by scale**2
+        :param pending: samples that follow the pushed ones but are not pushed yet, e.g. those a resampler still holds back (see PolyphaseDecimator.flush). The window ends after them
+        :param head: samples to use for the start of the window in place of the pushed ones, e.g. the window start as resampled on its own (see PolyphaseDecimator.clip_head). With it the first frames are built from the same samples as the full-window features
+        :return: (n_mfcc, n_frames) float32 array, the same layout as AudioInference.calculate_features 
+        '''
+        half_fft = self.n_fft // 2
+        pending = np.zeros(0, dtype=np.float32) if pending is None else np.asarray(pending, dtype=np.float32)
+        last_frame = (self.num_samples + len(pending)) // self.hop_length
+        first_frame = last_frame - self.n_frames + 1
+        window_start = first_frame * self.hop_length
+
+        # the first frames reach before the window start, where the full-window features are zero padded
+        num_head = 0
+        if window_start >= 0:
+            head_length = 0 if head is None else len(head)
+            num_head = min(self.n_frames, -(-(head_length + half_fft) // self.hop_length))
+            segment = self.stream_segment(window_start - half_fft, window_start + (num_head - 1) * self.hop_length + half_fft, pending)
+            segment[:half_fft] = 0
+            if head is not None: segment[half_fft:half_fft + head_length] = head
+            head_frames = self.engine.melspectrogram(segment, center=False)
+        else:
+            head_frames = np.zeros((self.n_mels, 0), dtype=np.float32)
+
+        # frames past self.next_frame are not complete yet; compute them with zero padding at the end of the stream
+        tail_start = max(self.next_frame, first_frame + num_head)
+        if tail_start <= last_frame:
+            segment = self.stream_segment(tail_start * self.hop_length - half_fft, last_frame * self.hop_length + half_fft, pending)
+            tail = self.engine.melspectrogram(segment, center=False)
+        else: 
+            tail = np.zeros((self.n_mels, 0), dtype=np.float32)
+
+        # frames before the start of the stream are all padding
+        cached = np.arange(first_frame + num_head, tail_start)
+        melspec = np.where(cached >= 0, self.mel_frames[:, cached % self.n_frames], 0)
+        melspec = np.concatenate([head_frames, melspec, tail], axis=1) 
+
+        return self.engine.mfcc_from_mel(melspec.astype(np.float32), scale=scale)
+
+
+class PolyphaseDecimator():
+    '''
+    Stateful low-pass FIR + downsample by an integer factor, e.g. 48 kHz -> 16 kHz capture with factor=3.
+
+    Only the retained output samples are computed. The taps are split into factor phases (rows of self.phase_taps), and the input is viewed as rows of factor consecutive samples. 
+    One matmul gives every sub-filter tap applied to every input row, and the outputs are the shifted sums of those partial products.
+    The most recent input samples and the decimation phase carry over between calls to process(), so consecutive chunks give the same result as one long signal with no overlap between them.
+
+    The filter is linear phase with a delay of (num_taps-1)/2 input samples (1 ms at 48 kHz with the defaults). process() removes it: output m lines up with input sample m*factor, like librosa.resample and decimate(). 
+    The output therefore trails the input by that delay; flush() gives the held back samples as if the input ended with zeros, which is how decimate() ends a clip
+    '''
+    def __init__(self, factor, num_taps=None, cutoff=None, kaiser_beta=8.0):
+        '''
+        :param factor: integer decimation factor
+        :param num_taps: filter length. Default keeps the group delay a whole number of output samples
+        :param cutoff: -6 dB point as a fraction of the input sample rate. Defaults to the output Nyquist
+        '''
+        self.factor = int(factor)
+        assert self.factor >= 1 and self.factor == factor, 'decimation factor must be a positive integer'
+        self.num_taps = 32 * self.factor + 1 if num_taps is None else num_taps
+        cutoff = 0.5 / self.factor if cutoff is None else cutoff
+
+        # Kaiser-windowed sinc, normalized for unity gain at DC. Reversed so a dot product with oldest->newest samples applies it as a convolution
+        n = np.arange(self.num_taps) - (self.num_taps - 1) / 2
+        taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(self.num_taps, kaiser_beta)
+        self.taps = (taps / np.sum(taps))[::-1].astype(np.float32)
+
+        # row q holds taps q*factor ... q*factor+factor-1. Zero taps are prepended on the oldest-sample side to fill whole rows, which leaves the delay unchanged
+        self.num_phase_taps = -(-self.num_taps // self.factor)
+        self.padded_taps = self.num_phase_taps * self.factor
+        phase_taps = np.zeros(self.padded_taps, dtype=np.float32)
+        phase_taps[self.padded_taps - self.num_taps:] = self.taps
+        self.phase_taps = phase_taps.reshape(self.num_phase_taps, self.factor)
+
+        self.delay = (self.num_taps - 1) // 2
+        # output samples at the start of a clip that the filter computes with zeros before the clip
+        self.edge_length = -(-self.delay // self.factor)
+        self.reset()
+
+    def reset(self):
+        self.history = np.zeros(self.padded_taps - 1, dtype=np.float32)
+        # index (in the next chunk) of the input sample that the next output is computed up to. Starting at the part of the delay that is less than a whole output sample...
+        self.phase = self.delay % self.factor
+        # ...and dropping the whole output samples of the delay lines output m up with input m*factor
+        self.skip = self.delay // self.factor
+
+    def process(self, samples):
+        '''
+        Filter and decimate the next chunk of samples. Returns float32 array of about len(samples)/factor samples, ending self.delay input samples before the end of the chunk
+        '''
+        samples = np.asarray(samples, dtype=np.float32)
+        if self.factor == 1:
+            return samples
+
+        extended = np.concatenate([self.history, samples])
+        num_out = max(0, (len(extended) - self.padded_taps - self.phase) // self.factor + 1)
+        output = np.zeros(num_out, dtype=np.float32)
+
+        if num_out > 0:
+            # output m is the dot product of the (padded) taps with extended[phase + m*factor:][:padded_taps]
+            num_rows = num_out + self.num_phase_taps - 1
+            rows = extended[self.phase:self.phase + num_rows * self.factor].reshape(num_rows, self.factor)
+            partial = self.phase_taps @ rows.T
+            for q in range(self.num_phase_taps):
+                output += partial[q, q:q + num_out]
+
+        self.phase = (self.phase - len(samples)) % self.factor
+        self.history = extended[len(extended) - (self.padded_taps - 1):]
+        skipped = min(self.skip, num_out)
+        self.skip -= skipped
+        return output[skipped:]
+
+    def flush(self):
+        '''
+        The output samples that the filter delay still holds back, computed as if the input ended here with zeros. The stream state is unchanged, so process() carries on afterwards as if flush() was never called
+        '''
+        if self.factor == 1:
+            return np.zeros(0, dtype=np.float32)
+        state = (self.history, self.phase, self.skip)
+        output = self.process(np.zeros(self.delay, dtype=np.float32))
+        self.history, self.phase, self.skip = state
+        return output
+
+    def process_clip(self, samples):
+        '''
+        Decimate a complete clip on its own, from zeros before it to zeros after it, without changing the stream state
+        '''
+        if self.factor == 1:
+            return np.asarray(samples, dtype=np.float32)
+        state = (self.history, self.phase, self.skip)
+        self.reset()
+        output = np.concatenate([self.process(samples), self.flush()])
+        self.history, self.phase, self.skip = state
+        return output
+
+    def clip_head(self, samples):
+        '''
+        The first edge_length output samples of samples decimated as a clip on its own. 
+        When samples is a window cut from a stream, process() gives different values there because its filter sees the audio before the window instead of zeros
+
+        :param samples: input at the start of the clip, at least edge_length*factor + delay samples of it
+        '''
+        return self.process_clip(samples[:self.edge_length * self.factor + self.delay])[:self.edge_length]
+
+    @classmethod
+    def decimate(cls, samples, factor, **kwargs):
+        '''
+        Stateless decimation of a complete clip, with the filter delay removed so the output lines up with the input like librosa.resample
+        '''
+        return cls(factor, **kwargs).process_clip(samples)
+
+
+def librosa_mfcc(audio_data, sr=16000, n_fft=512, win_length=400, hop_length=160, n_mels=64, n_mfcc=64):
+    '''
+    Reference implementation using librosa; this is how AudioInference.calculate_features computed features before MFCCEngine
+    '''
+    import librosa
+    melspec = librosa.feature.melspectrogram(y=audio_data, sr=sr, n_fft=n_fft, win_length=win_length, hop_length=hop_length, n_mels=n_mels, power=2, center=True, htk=True, norm=None)
+    S = np.log(melspec + 1e-6)
+    return librosa.feature.mfcc(S=S, norm='ortho', n_mfcc=n_mfcc)
+
+def check_parity(audio_data, engine=None, atol=1e-3):
+    '''
+    Compare MFCCEngine against the librosa reference on one clip of 16 kHz audio normalized to [-1,1]
+
+    :return: True if all coefficients are within atol, along with the max absolute error
+    '''
+    engine = MFCCEngine() if engine is None else engine
+    reference = librosa_mfcc(audio_data, sr=engine.sr, n_fft=engine.n_fft, win_length=engine.win_length, hop_length=engine.hop_length, n_mels=engine.n_mels, n_mfcc=engine.n_mfcc)
+    result = engine.mfcc(audio_data)
+
+    max_err = float(np.max(np.abs(reference - result)))
+    return reference.shape == result.shape and max_err <= atol, max_err
+
+def check_streaming_parity(capture_audio, capture_rate, sr=16000, hop_seconds=0.5, window_seconds=1.0, atol=1e-3):
+    '''
+    Compare the streaming path (PolyphaseDecimator.process feeding StreamingFeatureExtractor, as in AudioInference.calculate_features_streaming) against decimate() and MFCCEngine on each whole window, for every window of a stream at capture_rate
+
+    :return: True if the stream resamples like one clip and every window's features are within atol, along with the max absolute errors of the resampled stream and of the features
+    '''
+    capture_audio = np.asarray(capture_audio, dtype=np.float32)
+    decimator = PolyphaseDecimator(capture_rate // sr)
+    engine = MFCCEngine(sr=sr)
+    extractor = StreamingFeatureExtractor(sr=sr, n_frames=1 + int(sr * window_seconds) // engine.hop_length)
+    hop_size, window_size = int(capture_rate * hop_seconds), int(capture_rate * window_seconds)
+
+    streamed = []
+    feature_err = 0.0
+    for end in range(hop_size, len(capture_audio) + 1, hop_size):
+        streamed.append(decimator.process(capture_audio[end - hop_size:end]))
+        extractor.push(streamed[-1])
+        if end < window_size: continue
+        window_audio = capture_audio[end - window_size:end]
+        features = extractor.get_features(pending=decimator.flush(), head=decimator.clip_head(window_audio))
+        reference = engine.mfcc(PolyphaseDecimator.decimate(window_audio, decimator.factor))
+        feature_err = max(feature_err, float(np.max(np.abs(features - reference))))
+
+    streamed.append(decimator.flush())
+    resample_err = float(np.max(np.abs(np.concatenate(streamed) - PolyphaseDecimator.decimate(capture_audio[:end], decimator.factor))))
+    return resample_err <= atol and feature_err <= atol, resample_err, feature_err
+
+def benchmark(audio_data, engine=None, num_iters=100):
+    '''
+    Time MFCCEngine and the librosa reference on the same clip. Returns mean ms per call for each
+    '''
+    engine = MFCCEngine() if engine is None else engine
+    results = {}
+    for name, fn in [('librosa', librosa_mfcc), ('numpy', engine.mfcc)]:
+        fn(audio_data) #warmup; librosa takes a while the first time
+        t1 = time.perf_counter()
+        for _ in range(num_iters): 
+            fn(audio_data)
+        results[name] = (time.perf_counter() - t1) / num_iters * 1000
+    return results
+
+def benchmark_resampler(audio_data, input_rate, output_rate=16000, chunk_seconds=0.5, num_iters=100):
+    '''
+    Time the stateful decimator against librosa.resample for one chunk of audio at input_rate. Returns mean ms per chunk for each
+    '''
+    import librosa
+    chunk = np.resize(np.asarray(audio_data, dtype=np.float32), int(input_rate * chunk_seconds))
+    decimator = PolyphaseDecimator(input_rate // output_rate)
+
+    results = {}
+    for name, fn in [('librosa', lambda x: librosa.resample(x, orig_sr=input_rate, target_sr=output_rate)), ('polyphase', decimator.process)]:
+        fn(chunk)
+        t1 = time.perf_counter()
+        for _ in range(num_iters): 
+            fn(chunk)
+        results[name] = (time.perf_counter() - t1) / num_iters * 1000
+    return results
+
+
+if __name__ == '__main__':
+    import soundfile
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('wavfile', nargs='?', default='down_0c40e715_nohash_0.wav', help='16 kHz mono wav file, like those in Google Speech Commands')
+    parser.add_argument('-n', '--num-iters', default=100, type=int, help='number of feature calculations to time')
+    parser.add_argument('-r', '--capture-rate', default=48000, type=int, help='microphone sample rate to benchmark resampling from')
+    args = parser.parse_args()
+
+    audio_data, sr = soundfile.read(args.wavfile, dtype='float32')
+    audio_data = audio_data / np.max(np.abs(audio_data))
+    engine = MFCCEngine(sr=sr)
+
+    passed, max_err = check_parity(audio_data, engine)
+    print('parity with librosa: %s (max abs error %.2e)' % ('PASS' if passed else 'FAIL', max_err))
+    times = benchmark(audio_data, engine, num_iters=args.num_iters)
+    for name, ms in times.items():
+        print('---- %s features time per chunk (ms): %.3f' % (name, ms))
+
+    if args.capture_rate % sr == 0:
+        import librosa
+        capture_audio = librosa.resample(audio_data, orig_sr=sr, target_sr=args.capture_rate)
+        # the clip in a few seconds of quiet noise, streamed in hops like the microphone
+        noise = np.random.default_rng(0).normal(0, 0.01, args.capture_rate * 4).astype(np.float32)
+        stream = np.concatenate([noise[:int(0.7 * args.capture_rate)], capture_audio, noise[int(0.7 * args.capture_rate):]])
+        for hop_seconds in [0.5, 0.1]:
+            passed, resample_err, feature_err = check_streaming_parity(stream, args.capture_rate, sr, hop_seconds=hop_seconds)
+            print('streaming parity with whole windows, %.1fs hops: %s (max abs error: resampled %.2e, features %.2e)' % (hop_seconds, 'PASS' if passed else 'FAIL', resample_err, feature_err))
+        times = benchmark_resampler(capture_audio, args.capture_rate, sr, num_iters=args.num_iters)
+        for name, ms in times.items():
+            print('---- %s resample %d->%d time per 0.5s chunk (ms): %.3f' % (name, args.capture_rate, sr, ms))
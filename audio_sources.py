@@ -0,0 +1,223 @@
+#
+# Copyright (C) 2023 Texas Instruments Incorporated - http://www.ti.com/
+#
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#    Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+#    Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the
+#    distribution.
+#
+#    Neither the name of Texas Instruments Incorporated nor the names of
+#    its contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''
+Sources of audio for keyword spotting in kws_matchbox.py. 
+
+Each source delivers int16 samples to a callback in chunks of frames_per_buffer, like the PyAudio stream callback does:
+    callback(samples, overflowed=False, block=False)
+where block=True asks the receiver to wait for room instead of dropping samples. 
+
+MicrophoneSource captures live audio with PyAudio. FileSource replays a WAV or raw int16 file, and SyntheticSource generates audio, so the KWS pipeline can run on machines without audio hardware. 
+These two can be paced to real time or run as fast as the receiver takes samples, which is useful for measuring throughput and for long soak tests
+'''
+
+import os, time
+import threading
+import numpy as np
+
+
+class AudioSource(object):
+    '''
+    Base class for audio sources. Subclasses implement start() and stop()
+    '''
+    def __init__(self, rate, channels=1, frames_per_buffer=None):
+        self.rate = rate
+        self.channels = channels
+        self.frames_per_buffer = frames_per_buffer
+
+    def start(self, callback, frames_per_buffer=None):
+        raise NotImplementedError()
+
+    def stop(self):
+        raise NotImplementedError()
+
+    def is_active(self):
+        raise NotImplementedError()
+
+
+class MicrophoneSource(AudioSource):
+    '''
+    Live capture from a PyAudio input device. PyAudio (and its ALSA device enumeration) is only initialized when the stream is started
+    '''
+    def __init__(self, rate=48000, channels=1, device_index=1, frames_per_buffer=None):
+        super().__init__(rate, channels, frames_per_buffer)
+        self.device_index = device_index
+        self.pyaudio = None
+        self.stream = None
+
+    def start(self, callback, frames_per_buffer=None):
+        import pyaudio
+        self.frames_per_buffer = frames_per_buffer or self.frames_per_buffer
+        self.callback = callback
+
+        def stream_callback(audio_buffer, frame_count, time_info, flag):
+            self.callback(np.frombuffer(audio_buffer, dtype=np.int16), overflowed=bool(flag & pyaudio.paInputOverflow))
+            return None, pyaudio.paContinue
+
+        self.pyaudio = pyaudio.PyAudio()
+        self.stream = self.pyaudio.open(rate=self.rate, channels=self.channels, format=pyaudio.paInt16, input=True, input_device_index=self.device_index, output=False, stream_callback=stream_callback, frames_per_buffer=self.frames_per_buffer)
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.close()
+        if self.pyaudio is not None:
+            self.pyaudio.terminate()
+
+    def is_active(self):
+        return self.stream is not None and self.stream.is_active()
+
+
+class ThreadedSource(AudioSource):
+    '''
+    A source whose samples come from next_chunk() in a background thread, either paced to real time or as fast as the callback accepts them
+    '''
+    def __init__(self, rate, channels=1, frames_per_buffer=None, realtime=True):
+        super().__init__(rate, channels, frames_per_buffer)
+        self.realtime = realtime
+        self.thread = None
+        self.running = False
+
+    def next_chunk(self, num_frames):
+        '''
+        Return the next num_frames of int16 audio (interleaved if multiple channels), fewer at the end of the source, or None when finished
+        '''
+        raise NotImplementedError()
+
+    def start(self, callback, frames_per_buffer=None):
+        self.frames_per_buffer = frames_per_buffer or self.frames_per_buffer or int(self.rate * 0.1)
+        self.callback = callback
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        t_start = time.perf_counter()
+        frames_sent = 0
+        while self.running:
+            chunk = self.next_chunk(self.frames_per_buffer)
+            if chunk is None or len(chunk) == 0: break
+
+            if self.realtime:
+                # a real device delivers a buffer once it has been filled
+                frames_sent += len(chunk) // self.channels
+                delay = t_start + frames_sent / self.rate - time.perf_counter()
+                if delay > 0: time.sleep(delay)
+            self.callback(chunk, overflowed=False, block=not self.realtime)
+        self.running = False
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def is_active(self):
+        return self.running
+
+
+class FileSource(ThreadedSource):
+    '''
+    Replay a WAV file (any format soundfile reads, converted to int16) or a headerless file of int16 samples. 
+
+    :param file_rate: sample rate of a raw file. WAV files carry their own
+    :param loop: start again from the beginning at the end of the file, e.g. for soak tests
+    '''
+    def __init__(self, path, realtime=True, loop=False, file_rate=48000, channels=1, frames_per_buffer=None):
+        ext = os.path.splitext(path)[1].lower()
+        if ext in ('.raw', '.pcm', '.s16'):
+            samples = np.fromfile(path, dtype=np.int16)
+            rate = file_rate
+        else:
+            import soundfile
+            samples, rate = soundfile.read(path, dtype='int16', always_2d=True)
+            channels = samples.shape[1]
+            samples = samples.reshape(-1)
+
+        super().__init__(rate, channels, frames_per_buffer, realtime)
+        self.path = path
+        self.samples = samples
+        self.loop = loop
+        self.position = 0
+
+    def next_chunk(self, num_frames):
+        if self.position >= len(self.samples):
+            if not self.loop: return None
+            self.position = 0
+
+        chunk = self.samples[self.position:self.position + num_frames * self.channels]
+        self.position += len(chunk)
+        return chunk
+
+
+class SyntheticSource(ThreadedSource):
+    '''
+    Generate audio: background noise, plus an optional tone, plus an optional clip (e.g. a spoken command) repeated at a fixed interval.
+
+    Sample positions where each inserted clip ends are kept in clip_end_positions, so command latency can be measured end to end against the KWS results
+
+    :param duration: seconds of audio to generate, or None to run until stopped
+    :param noise_level: standard deviation of white noise, relative to full scale
+    :param tone_hz: frequency of a sine tone at tone_level, or None
+    :param clip: int16 samples at the source rate to insert
+    :param clip_every: seconds between clip insertions
+    '''
+    def __init__(self, rate=48000, duration=None, noise_level=0.01, tone_hz=None, tone_level=0.1, clip=None, clip_every=3.0, realtime=True, frames_per_buffer=None, seed=0):
+        super().__init__(rate, 1, frames_per_buffer, realtime)
+        self.duration = duration
+        self.noise_level = noise_level
+        self.tone_hz = tone_hz
+        self.tone_level = tone_level
+        self.clip = None if clip is None else np.asarray(clip, dtype=np.float32) / 32768
+        self.clip_every = int(clip_every * rate)
+        self.random = np.random.RandomState(seed)
+        self.position = 0
+        self.clip_end_positions = []
+
+    def next_chunk(self, num_frames):
+        if self.duration is not None:
+            num_frames = min(num_frames, int(self.duration * self.rate) - self.position)
+            if num_frames <= 0: return None
+
+        n = np.arange(self.position, self.position + num_frames)
+        audio = self.random.randn(num_frames).astype(np.float32) * self.noise_level
+        if self.tone_hz is not None:
+            audio += self.tone_level * np.sin(2 * np.pi * self.tone_hz * n / self.rate).astype(np.float32)
+
+        if self.clip is not None:
+            # clips start one interval in, so there is a full window of background before the first one
+            offset = (n - self.clip_every) % self.clip_every
+            in_clip = (n >= self.clip_every) & (offset < len(self.clip))
+            audio[in_clip] += self.clip[offset[in_clip]]
+            self.clip_end_positions += list(n[in_clip & (offset == len(self.clip) - 1)] + 1)
+
+        self.position += num_frames
+        return (np.clip(audio, -1, 1) * 32767).astype(np.int16)
@@ -55,6 +55,7 @@ import numpy as np
 import cv2 as cv
 import time
 import utils
+import gst_memory
 
 
 import gi
@@ -72,7 +73,23 @@ class DisplayDrawer():
     Performance stats should take up 20% of the image at the bottom, but have hard limit of height between 50 and 250 pixels. See tiperfoverlay gst plugin for source of this.
 
     '''
-    def __init__(self, display_width=1920, display_height=1080, image_scale=0.8, aspect_ratio=16/9):
+    # names for the interpolation setting, see set_quality
+    INTERPOLATIONS = {'area': cv.INTER_AREA, 'linear': cv.INTER_LINEAR, 'nearest': cv.INTER_NEAREST}
+
+    # define dimensions for how to place resized and cropped faces in the face pane
+    X_SPACING = 15
+    Y_SPACING = 20
+    FACE_SIZE = (150, 150) #x,y
+    MAX_NUM_FACES = 9
+    FACES_PER_ROW = 3
+    FACES_PER_COLUMN = 3
+    BOX_THICKNESS = 4
+
+    def __init__(self, display_width=1920, display_height=1080, image_scale=0.8, aspect_ratio=16/9, num_frame_buffers=3):
+        '''
+        :param num_frame_buffers: output frames to rotate through. make_frame writes into the next one, so a frame must be pushed (or copied) before this many more are made. 
+            Also the number of buffers the appsrc buffer pool starts with, see set_gst_info
+        '''
         self.display_width = display_width
         self.display_height = display_height
         self.image_scale = image_scale
@@ -86,26 +103,103 @@ class DisplayDrawer():
         self.perf_width = display_width
         self.perf_height = display_height - self.image_height
 
+        # track_id -> slot in the face pane, so each tracked person keeps their place
+        self.face_slots = {}
+
+        # quality settings that frame_scheduler.FrameScheduler may lower to hold the frame rate
+        self.face_pane_every = 1
+        self.interpolation = cv.INTER_AREA
+        self.face_pane = None
+        self.frame_count = 0
+
+        # the parts of the display that never change are drawn once, and every frame is composed in place in one of a few preallocated frames
+        self.face_pane_background, self.face_pane_labels = self.create_face_pane_layers()
+        self.face_pane_buffer = self.face_pane_background.copy()
+        self.num_frame_buffers = num_frame_buffers
+        self.frame_pool = [np.zeros((self.display_height, self.display_width, 3), dtype=np.uint8) for _ in range(num_frame_buffers)]
+        # which face pane each frame of self.frame_pool holds, so an unchanged pane is not copied again
+        self.frame_pane_versions = [-1] * num_frame_buffers
+        self.face_pane_version = 0
+        self.frame_index = 0
+
+        # with a buffer pool for the appsrc (see set_gst_info), frames are composed in mapped buffer memory; (buffer, map_info, frame) of the frame not pushed yet. 
+        # This is the only reference to the frame kept past make_frame, so it can be dropped before the buffer is unmapped
+        self.output_pool = None
+        self.pending_output = None
+        # buffer last pushed from the pool. Its memory is unmapped, so pushing it again re-sends the buffer
+        self.pushed_output = None
+
+    def set_quality(self, face_pane_every=1, interpolation='area', **kwargs):
+        '''
+        Apply quality settings, e.g. FrameScheduler.settings. Unrelated settings are ignored
 
-    def set_gst_info(self, app_out, gst_caps): 
+        :param face_pane_every: redraw the face pane on every Nth frame and reuse it in between
+        :param interpolation: 'area', 'linear' or 'nearest', for resizing the visualization
+        '''
+        self.face_pane_every = face_pane_every
+        self.interpolation = DisplayDrawer.INTERPOLATIONS[interpolation]
+
+
+    def set_gst_info(self, app_out, gst_caps, zero_copy=True): 
         '''
         Set output caps and hold onto a reference for the appsrc plugin that interfaces from here to the final output sink (by default, kmssink.. see gst_configs.py)
+
+        :param zero_copy: compose frames in buffers from a pool made for gst_caps and push them without copying (see gst_memory.OutputBufferPool). Falls back to copying each frame if the buffers cannot be mapped in place
         '''
         self.gst_app_out = app_out
         self.gst_caps = gst_caps
         self.gst_app_out.set_caps(self.gst_caps)
+        if zero_copy:
+            self.output_pool = gst_memory.OutputBufferPool(gst_caps, self.display_height, self.display_width, 3, self.num_frame_buffers)
 
 
     def push_to_display(self, image):
         '''
-        Push an image to the display through the appsrc
+        Push an image to the display through the appsrc. 
+        With image None, push the frame make_frame composed in a pool buffer without a copy, or the last one again if it was already pushed (e.g. the application loop repeating the last frame while it waits for input)
 
-        param image: and image whose dimensions and pixel format matches self.gst_caps
+        param image: and image whose dimensions and pixel format matches self.gst_caps, or None
         '''
-
-        buffer = Gst.Buffer.new_wrapped(image.tobytes())
+        if image is not None:
+            buffer = Gst.Buffer.new_wrapped(image.tobytes())
+        elif self.pending_output is not None:
+            buffer, map_info, _ = self.pending_output
+            # drop the view of the buffer's memory before unmapping it, so nothing can write to it after it is pushed
+            self.pending_output = None
+            gst_memory.unmap_buffer(buffer, map_info)
+            self.pushed_output = buffer
+        elif self.pushed_output is not None:
+            buffer = self.pushed_output
+        else:
+            return
 
         ret = self.gst_app_out.push_buffer(buffer)
+
+    def next_output_frame(self):
+        '''
+        The display-sized frame to compose the next output in: the memory of a buffer from the appsrc's pool if there is one, otherwise the next of self.frame_pool
+
+        :return: the frame, and its index in self.frame_pool or None for a pool buffer
+        '''
+        if self.output_pool is not None:
+            if self.pending_output is not None:
+                # the last frame was never pushed; drop the view of it and give its buffer back
+                buffer, map_info, _ = self.pending_output
+                self.pending_output = None
+                gst_memory.unmap_buffer(buffer, map_info)
+            buffer, map_info, frame = self.output_pool.acquire()
+            if buffer is not None:
+                self.pending_output = (buffer, map_info, frame)
+                # nothing is known about what a pool buffer's memory holds, so the static (black) background is drawn on every acquire; make_frame draws the rest
+                frame[self.image_height:] = 0
+                return frame, None
+            # buffers cannot be mapped in place; compose in self.frame_pool and copy from now on
+            self.output_pool.stop()
+            self.output_pool = None
+
+        pool_index = self.frame_index % len(self.frame_pool)
+        self.frame_index += 1
+        return self.frame_pool[pool_index], pool_index
       
     def make_frame_init(self):
         '''
@@ -126,17 +220,52 @@ class DisplayDrawer():
         '''
         Use the output information from the tidlinferer plugin (after reformatting to convenient shape)
             to write some useful information onto various portions of the screen
+
+        The frame is composed in place in the next buffer from the appsrc pool or of self.frame_pool (see next_output_frame), so nothing display-sized is allocated or copied per frame. 
+        A frame of self.frame_pool is returned, and reused num_frame_buffers frames later. A frame in a pool buffer is kept by the DisplayDrawer and None is returned: push it with push_to_display(None), which unmaps it
         
         input image: HxWxC numpy array
-        infer_output: tensor/2d array of shape num_boxes x 6, where the 6 values are x1,y1,x2,y2,score, label
+        infer_output: detections that passed post-processing, as a structured array of model_runner.DETECTION_DTYPE (box in image pixels, score, label), or tracks from tracker.BoxTracker, which also have a track_id
         categories: in same format as dataset.yaml, a mapping of class labels to class names (strings)
         model_obj: the ModelRunner object associated with the model being run with tidlinferer
         '''
+        frame, pool_index = self.next_output_frame()
 
+        # the input image is drawn into the frame first and the boxes over it, so the faces are cropped from a clean input image without copying it
+        visualization, image_coord_ul, viz_size = self.create_visualization(input_image, action, out=frame[0:self.image_height, 0:self.image_width])
+        t1 = time.time()
+        if action == Actions.OFF:
+            _, faces = self.draw_bounding_boxes(None, infer_output, categories)
+        else:
+            # boxes are in input image pixels; move them into the (cropped and) resized visualization
+            box_scale = (self.image_width / viz_size[1], self.image_height / viz_size[0])
+            _, faces = self.draw_bounding_boxes(visualization, infer_output, categories, offset=image_coord_ul, scale=box_scale)
+
+        if self.face_pane is None or self.frame_count % self.face_pane_every == 0:
+            self.face_pane = self.create_face_pane(input_image, faces, image_coord_ul, viz_size, out=self.face_pane_buffer)
+            self.face_pane_version += 1
+        self.frame_count += 1
+        # a pool buffer always gets the face pane, since its memory may hold anything
+        if pool_index is None or self.frame_pane_versions[pool_index] != self.face_pane_version:
+            np.copyto(frame[0:self.image_height, self.image_width:], self.face_pane)
+            if pool_index is not None: self.frame_pane_versions[pool_index] = self.face_pane_version
+        t2 = time.time()
+        print("making viz frame time: %.3f ms" % ((t2-t1)*1000))
+
+        return frame if pool_index is not None else None
+
+    def make_frame_copy(self, input_image, infer_output, categories, model_obj, action):
+        '''
+        The copy-based way make_frame used to compose a frame, kept to compare against (see benchmark_make_frame): boxes are drawn on a copy of the input image, 
+            the visualization and face pane are allocated per frame, and both are copied into a newly allocated frame. Same arguments as make_frame
+        '''
         processed_image, faces = self.draw_bounding_boxes(input_image.copy(), infer_output, categories)
         t1 = time.time()
         visualization, image_coord_ul, viz_size = self.create_visualization(processed_image, action)
-        face_pane = self.create_face_pane(input_image, faces, image_coord_ul, viz_size)
+        if self.face_pane is None or self.frame_count % self.face_pane_every == 0:
+            self.face_pane = self.create_face_pane(input_image, faces, image_coord_ul, viz_size)
+        face_pane = self.face_pane
+        self.frame_count += 1
         t2 = time.time()
         print("making viz frame time: %.3f ms" % ((t2-t1)*1000))
 
@@ -146,96 +275,156 @@ class DisplayDrawer():
 
         return frame
     
-    def draw_bounding_boxes(self, image, boxes_tensor, categories, viz_thres=0.6):
+    def draw_bounding_boxes(self, image, detections, categories, offset=(0, 0), scale=(1, 1)):
         '''
-        Draw bounding boxes with classnames onto the 
+        Draw bounding boxes with classnames onto the image
         
-        Each box in the tensor expected to be x1,y1,x2,y2,score,class-label.
+        Detections are expected to be filtered and scaled already, as a structured array of model_runner.DETECTION_DTYPE (see ModelRunner.postprocess_detections) or tracker.TRACK_DTYPE
 
+        :param image: image to draw on, or None to only list the boxes
+        :param offset, scale: where the input image pixels are in the image drawn on, as x,y of the input image at the image's top left corner and x,y scale factors, e.g. for a cropped and resized visualization
+        :return: the image, and a list of (x1,y1,x2,y2,class_name,track_id) per box in input image pixels. track_id is None for detections that are not tracked
         '''
         objects = []
-        for box in boxes_tensor:
-            score = box[4]
-            label = box[5]
-
-            if score > viz_thres:
-                class_name = categories[int(label)]['name']
-                x1,y1,x2,y2 = box.astype(np.int32)[:4]
-                # print(box)
-                cv.rectangle(image, (x1,y1), (x2,y2), color=(0, 255, 255), thickness=4)
-                # cv.putText(image, class_name, (x1,y1), cv.FONT_HERSHEY_SIMPLEX, 0.75, color=(0, 255, 255), thickness=2)
-                objects.append((x1,y1,x2,y2, class_name))
+        track_ids = detections['track_id'].tolist() if 'track_id' in detections.dtype.names else [None] * len(detections)
+        thickness = max(1, round(DisplayDrawer.BOX_THICKNESS * min(scale)))
+        for (x1,y1,x2,y2), label, track_id in zip(detections['box'].tolist(), detections['label'].tolist(), track_ids):
+            class_name = categories[label]['name']
+            if image is not None:
+                p1 = (int((x1 - offset[0]) * scale[0]), int((y1 - offset[1]) * scale[1]))
+                p2 = (int((x2 - offset[0]) * scale[0]), int((y2 - offset[1]) * scale[1]))
+                cv.rectangle(image, p1, p2, color=(0, 255, 255), thickness=thickness)
+            # cv.putText(image, class_name, (x1,y1), cv.FONT_HERSHEY_SIMPLEX, 0.75, color=(0, 255, 255), thickness=2)
+            objects.append((x1,y1,x2,y2, class_name, track_id))
 
         return image, objects
 
-    def create_visualization(self, input_image, action):
-        # print('viz input size: ' + str(input_image.shape))
-        print(str(action))
-        size=None
-        if action == Actions.PASSTHROUGH:
-            # viz_image = cv.resize(input_image, (self.image_width, self.image_height), interpolation=cv.INTER_CUBIC)
-            size = input_image.shape
-            viz_image = cv.resize(input_image, (self.image_width, self.image_height), interpolation=cv.INTER_AREA)
-            point = (0,0)
-        elif action == Actions.LEFT:
+    def get_view_region(self, image_height, image_width, action):
+        '''
+        The (x, y, width, height) part of the input image that is on display for an action. LEFT, RIGHT, UP, DOWN and ZOOM show an unscaled crop the size of the display image; PASSTHROUGH and OFF give the whole image
+        '''
+        if action == Actions.LEFT:
             x = 0
-            y = int((input_image.shape[0] - self.image_height) / 2)
-            point=(x,y)
-            viz_image = input_image[y:y+self.image_height, x:x+self.image_width]
+            y = int((image_height - self.image_height) / 2)
         elif action == Actions.RIGHT:
-            x = int(input_image.shape[1] - self.image_width)
-            y = int((input_image.shape[0] - self.image_height) / 2)
-            point=(x,y)
-            viz_image = input_image[y:y+self.image_height, x:x+self.image_width]
+            x = int(image_width - self.image_width)
+            y = int((image_height - self.image_height) / 2)
         elif action == Actions.UP:
-            x = int((input_image.shape[1] - self.image_width) / 2)
+            x = int((image_width - self.image_width) / 2)
             y = 0
-            point=(x,y)
-            viz_image = input_image[y:y+self.image_height, x:x+self.image_width]
         elif action == Actions.DOWN:
-            x = int((input_image.shape[1] - self.image_width) / 2)
-            y = int(input_image.shape[0] - self.image_height)
-            point=(x,y)
-            viz_image = input_image[y:y+self.image_height, x:x+self.image_width]
+            x = int((image_width - self.image_width) / 2)
+            y = int(image_height - self.image_height)
         elif action == Actions.ZOOM:
-            x = int((input_image.shape[1] - self.image_width) / 2)
-            y = int((input_image.shape[0] - self.image_height) / 2)
-            point=(x,y)
-            viz_image = input_image[y:y+self.image_height, x:x+self.image_width]
-        elif action == Actions.OFF:
-            viz_image = np.zeros((self.image_height, self.image_width, 3))
-            point=(0,0)
-            size=(0,0,3)
+            x = int((image_width - self.image_width) / 2)
+            y = int((image_height - self.image_height) / 2)
+        else:
+            return 0, 0, image_width, image_height
+        return x, y, self.image_width, self.image_height
+
+    def create_visualization(self, input_image, action, out=None):
+        '''
+        Fill the visualization with the part of the input image on display for the action, resized to the display image size
+
+        :param out: image_height x image_width x 3 array to write into, e.g. part of an output frame. Allocated if None
+        :return: the visualization, the upper-left point of the input image region shown, and the size of that region (0 for OFF)
+        '''
+        # print('viz input size: ' + str(input_image.shape))
+        print(str(action))
+        if out is None:
+            out = np.empty((self.image_height, self.image_width, 3), dtype=np.uint8)
+        if action == Actions.OFF:
+            out[:] = 0
+            return out, (0,0), (0,0,3)
+
+        if action == Actions.PASSTHROUGH:
+            x, y, w, h = 0, 0, input_image.shape[1], input_image.shape[0]
+        else:
+            x, y, w, h = self.get_view_region(input_image.shape[0], input_image.shape[1], action)
+        viz_image = input_image[y:y+h, x:x+w]
         # print('viz output size: ' + str(viz_image.shape))
 
         if viz_image.shape[0] != self.image_height or viz_image.shape[1] != self.image_width:
-            size = viz_image.shape
-            viz_image = cv.resize(viz_image, (self.image_width, self.image_height), interpolation=cv.INTER_AREA)
-        elif size is None:
-            size = viz_image.shape
+            cv.resize(viz_image, (self.image_width, self.image_height), dst=out, interpolation=self.interpolation)
+        else:
+            np.copyto(out, viz_image)
 
-
-        return viz_image, point, size
+        return out, (x,y), viz_image.shape
     
-    def create_face_pane(self, input_image, faces_list, crop_point, crop_size):
+    def assign_face_slots(self, faces_list, num_slots):
+        '''
+        Pick a face pane slot for each tracked face. A track keeps the slot it was first given for as long as it lives; new tracks take the lowest free slot
+
+        :return: dict of track_id -> slot, for the tracks that got a slot
+        '''
+        live_ids = set(face[5] for face in faces_list)
+        self.face_slots = {track_id: slot for track_id, slot in self.face_slots.items() if track_id in live_ids}
+        free_slots = [slot for slot in range(num_slots) if slot not in self.face_slots.values()]
+        for track_id in sorted(live_ids):
+            if track_id not in self.face_slots and len(free_slots) > 0:
+                self.face_slots[track_id] = free_slots.pop(0)
+        return self.face_slots
+
+    def face_slot_origin(self, slot):
+        '''
+        Upper left x,y of a face in the face pane. Slots fill down each column, then across
+        '''
+        x = DisplayDrawer.X_SPACING + (slot // DisplayDrawer.FACES_PER_COLUMN) * (DisplayDrawer.X_SPACING + DisplayDrawer.FACE_SIZE[0])
+        y = DisplayDrawer.Y_SPACING*2 + (slot % DisplayDrawer.FACES_PER_COLUMN) * (DisplayDrawer.Y_SPACING + DisplayDrawer.FACE_SIZE[1])
+        return x, y
+
+    def create_face_pane_layers(self):
+        '''
+        Draw the static parts of the face pane once: a white background with rectangles to underline where faces can go, and the same with every slot's label, to copy a label from when its slot is used
+        '''
+        background = np.full(shape=[self.info_panel_height, self.info_panel_width, 3], fill_value=255, dtype=np.uint8)
+        for slot in range(DisplayDrawer.MAX_NUM_FACES):
+            x, y = self.face_slot_origin(slot)
+            y += DisplayDrawer.FACE_SIZE[1]
+            cv.rectangle(background, (x,y), (x+DisplayDrawer.FACE_SIZE[0],y),color=(0,0,0), thickness=2)
+
+        labels = background.copy()
+        for slot in range(DisplayDrawer.MAX_NUM_FACES):
+            x, y = self.face_slot_origin(slot)
+            cv.putText(labels, f'Attendee {slot+1}', (x,y-3), cv.FONT_HERSHEY_SIMPLEX, 0.6, color=(0, 0, 0), thickness=1)
+
+        return background, labels
+
+    def create_face_pane(self, input_image, faces_list, crop_point, crop_size, out=None):
         '''
         Fill the info panel with crops of the faces to track people in the frame. The input image may be modified to only show a portion (e.g. the right side area or a zoomed in area) by cropping, so those cropping parameters are provided
 
         :param input_image: The entire input image, regardless of any cropping done based on a command/action 
-        :param faces_list: A list of 4-element tuples (x1,y1,x2,y2) as bounding boxes of the output. The values will fit within the input_image, but not necessarily the cropped part of the image
+        :param faces_list: A list of tuples (x1,y1,x2,y2,class_name,track_id) as bounding boxes of the output, from draw_bounding_boxes. The values will fit within the input_image, but not necessarily the cropped part of the image
         :param crop_point: Upper-left point representing where the output display will focus
         :param crop_size: The height and width of the area that the output display will focus on
+        :param out: info panel sized array to draw into. Allocated if None
         :return: An image destined for the right-pane of the output display, including individuals' faces resize to fit the region. By default, up to 9 faces can be shown. 
         '''
-        faces_list = sorted(faces_list, key=lambda face: face[0]+face[1])
-        face_pane = np.full(shape=[self.info_panel_height, self.info_panel_width, 3], fill_value=255, dtype=np.uint8)
-
-        #create a list holding the images of faces that have already been cropped
+        FACE_SIZE = DisplayDrawer.FACE_SIZE
+        MAX_NUM_FACES = DisplayDrawer.MAX_NUM_FACES
+
+        # start from the prerendered background with the underlines where faces can go
+        if out is None:
+            face_pane = self.face_pane_background.copy()
+        else:
+            face_pane = out
+            np.copyto(face_pane, self.face_pane_background)
+
+        # tracked faces keep their slot; untracked ones fill slots in order of x1+y1
+        tracked = len(faces_list) > 0 and faces_list[0][5] is not None
+        if tracked:
+            face_slots = self.assign_face_slots(faces_list, MAX_NUM_FACES)
+        else:
+            faces_list = sorted(faces_list, key=lambda face: face[0]+face[1])
+
+        #create a list holding the slot and image of faces that have already been cropped
         face_images = []
 
         #we'll increase the size of the area to include more of their head
         INCREASE_SIZE_SCALE = 0.2
         for face in faces_list:
+            if tracked and face[5] not in face_slots: continue
             w = face[2] - face[0]
             h = face[3] - face[1]
             x1 = int(face[0] - w * INCREASE_SIZE_SCALE)
@@ -243,45 +432,65 @@ class DisplayDrawer():
             y1 = int(face[1] - h * INCREASE_SIZE_SCALE)
             y2 = int(face[3] + h * INCREASE_SIZE_SCALE)
 
-            #check face points are within the vizualiatio post crop/resize
-            if x1 >= crop_point[0] and \
+            #check face points are within the vizualiatio post crop/resize, and the crop is not empty (untracked detections can have zero size)
+            if x2 > x1 and y2 > y1 and \
+                x1 >= crop_point[0] and \
                 y1 >= crop_point[1] and \
                 x2 <= crop_point[0] + crop_size[1] and \
                 y2 <= crop_point[1] + crop_size[0]:
 
                 # crop_locations = (x1, y1, x2, y2)
                 # print(crop_locations)
-                face_images.append(input_image[y1:y2, x1:x2])
-
-        # define dimensions for how to place resized and cropped faces
-        X_SPACING = 15
-        Y_SPACING = 20
-        FACE_SIZE = (150, 150) #x,y
-        MAX_NUM_FACES = 9
-        FACES_PER_ROW = 3
-        FACES_PER_COLUMN = 3
-
-        #draw rectangles to underline where faces can go
-        x = X_SPACING
-        y = Y_SPACING*2 + FACE_SIZE[1]
-        for i in range(MAX_NUM_FACES):
-            cv.rectangle(face_pane, (x,y), (x+FACE_SIZE[0],y),color=(0,0,0), thickness=2)
-            y += Y_SPACING + FACE_SIZE[1]
-            if i % FACES_PER_COLUMN == FACES_PER_COLUMN - 1:
-                x += X_SPACING + FACE_SIZE[0]
-                y = Y_SPACING*2 + FACE_SIZE[1]
-
-        x = X_SPACING
-        y = Y_SPACING*2
-        for i, face in enumerate(face_images):
-            #copy the face area, resize, and add to the output image
-            copy_face = cv.resize(face.copy(), FACE_SIZE, interpolation=cv.INTER_AREA)
-            face_pane[y:y+FACE_SIZE[1], x:x+FACE_SIZE[0]] = copy_face
-            cv.putText(face_pane, f'Attendee {i+1}', (x,y-3), cv.FONT_HERSHEY_SIMPLEX, 0.6, color=(0, 0, 0), thickness=1)
-            y += Y_SPACING + FACE_SIZE[1]
-            if i % FACES_PER_COLUMN == FACES_PER_COLUMN - 1:
-                x += X_SPACING + FACE_SIZE[0]
-                y = Y_SPACING*2
-            if i >= MAX_NUM_FACES - 1: break
+                slot = face_slots[face[5]] if tracked else len(face_images)
+                if slot < MAX_NUM_FACES:
+                    face_images.append((slot, input_image[y1:y2, x1:x2]))
+
+        for slot, face in face_images:
+            x, y = self.face_slot_origin(slot)
+            #resize the face area straight into the pane, and copy in the slot's label
+            cv.resize(face, FACE_SIZE, dst=face_pane[y:y+FACE_SIZE[1], x:x+FACE_SIZE[0]], interpolation=cv.INTER_AREA)
+            label_rows = slice(y - DisplayDrawer.Y_SPACING, y)
+            face_pane[label_rows, x:x+FACE_SIZE[0]] = self.face_pane_labels[label_rows, x:x+FACE_SIZE[0]]
 
         return face_pane
+
+
+def benchmark_make_frame(display_sizes=((1280, 720), (1920, 1080)), image_size=(1920, 1080), num_frames=200, num_faces=4):
+    '''
+    Time make_frame against the copy-based make_frame_copy on a random image with a few face boxes, for each display size and a full frame and cropped view. No GStreamer pipeline is needed
+    '''
+    import io, contextlib
+    import model_runner
+
+    image = np.random.randint(0, 255, (image_size[1], image_size[0], 3), dtype=np.uint8)
+    detections = np.zeros(num_faces, dtype=model_runner.DETECTION_DTYPE)
+    for i in range(num_faces):
+        x, y = 300 + 200 * i, 300 + 50 * i
+        detections['box'][i] = (x, y, x + 80, y + 100)
+    categories = {0: {'name': 'face'}}
+
+    print('**** make_frame on a %dx%d image, ms/frame ****' % image_size)
+    for display_width, display_height in display_sizes:
+        for action in (Actions.PASSTHROUGH, Actions.ZOOM):
+            t_frames = []
+            for method_name in ('make_frame_copy', 'make_frame'):
+                # a drawer per path, so neither reuses the other's face pane or frames
+                drawer = DisplayDrawer(display_width, display_height, aspect_ratio=4/3)
+                method = getattr(drawer, method_name)
+                # make_frame prints per frame timing, which would dominate
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for _ in range(5): method(image, detections, categories, None, action)
+                    t_start = time.perf_counter()
+                    for _ in range(num_frames): method(image, detections, categories, None, action)
+                    t_frames.append((time.perf_counter() - t_start) / num_frames)
+            print('%dx%d display, %s: copy %.2f, in place %.2f (%.2fx)' % (display_width, display_height, action.name, t_frames[0] * 1000, t_frames[1] * 1000, t_frames[0] / t_frames[1]))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark composing output frames with DisplayDrawer.make_frame against the copy-based make_frame_copy')
+    parser.add_argument('-n', '--num-frames', default=200, type=int)
+    parser.add_argument('-s', '--display-sizes', default='1280x720,1920x1080', help='comma separated WxH display sizes')
+    args = parser.parse_args()
+
+    benchmark_make_frame([tuple(int(n) for n in size.split('x')) for size in args.display_sizes.split(',')], num_frames=args.num_frames)
@@ -0,0 +1,127 @@
+#
+# Copyright (C) 2023 Texas Instruments Incorporated - http://www.ti.com/
+#
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#    Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+#    Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the
+#    distribution.
+#
+#    Neither the name of Texas Instruments Incorporated nor the names of
+#    its contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''
+Adaptive quality control for the vision application loop. 
+
+The loop reports how long each stage of a frame took. If the work per frame (everything except waiting on the pipeline for samples) does not fit in the target frame time, the scheduler steps down one quality level; 
+once it has fit comfortably for a while, it steps back up. Levels trade, in order: how often the face pane is refreshed, the resize interpolation, and how often the detector runs (the tracker fills in between). 
+Steady frame pacing is preferred over full quality
+'''
+
+from collections import deque
+import numpy as np
+
+# each level adds one degradation to the one before
+QUALITY_LEVELS = [
+    {'face_pane_every': 1, 'interpolation': 'area', 'detect_every': 1},
+    {'face_pane_every': 2, 'interpolation': 'area', 'detect_every': 1},
+    {'face_pane_every': 2, 'interpolation': 'linear', 'detect_every': 1},
+    {'face_pane_every': 2, 'interpolation': 'linear', 'detect_every': 2},
+    {'face_pane_every': 4, 'interpolation': 'linear', 'detect_every': 2},
+    {'face_pane_every': 4, 'interpolation': 'linear', 'detect_every': 3},
+    {'face_pane_every': 4, 'interpolation': 'nearest', 'detect_every': 3},
+    {'face_pane_every': 4, 'interpolation': 'nearest', 'detect_every': 4},
+]
+
+
+class FrameScheduler():
+    '''
+    Watch rolling per-stage latencies against a target frame time and choose a quality level from QUALITY_LEVELS
+    '''
+    STAGES = ('pull', 'decode', 'draw', 'push')
+    # pull is mostly waiting for the camera and accelerators, so it is reported but not counted as work
+    WORK_STAGES = ('decode', 'draw', 'push')
+
+    def __init__(self, target_fps=30, window=30, headroom=0.7, min_detect_every=1):
+        '''
+        :param window: frames between decisions, and the length of the rolling averages
+        :param headroom: step back up only when the work takes less than this fraction of the frame time
+        :param min_detect_every: the detector cadence to use at full quality, e.g. from the command line
+        '''
+        self.frame_budget = 1 / target_fps
+        self.window = window
+        self.headroom = headroom
+        self.min_detect_every = min_detect_every
+        self.latencies = {stage: deque(maxlen=window) for stage in FrameScheduler.STAGES}
+        self.level = 0
+        self.frames_since_change = 0
+        self.level_changes = 0
+
+    @property
+    def settings(self):
+        settings = dict(QUALITY_LEVELS[self.level])
+        settings['detect_every'] = max(settings['detect_every'], self.min_detect_every)
+        return settings
+
+    def record(self, stage, seconds):
+        self.latencies[stage].append(seconds)
+
+    def mean_latency(self, stage):
+        return np.mean(self.latencies[stage]) if len(self.latencies[stage]) > 0 else 0
+
+    def frame_done(self):
+        '''
+        Call once per frame after recording its stages. Returns True if the quality level changed
+        '''
+        self.frames_since_change += 1
+        if self.frames_since_change < self.window: return False
+
+        work = sum(self.mean_latency(stage) for stage in FrameScheduler.WORK_STAGES)
+        if work > self.frame_budget and self.level < len(QUALITY_LEVELS) - 1:
+            self.level += 1
+        elif work < self.headroom * self.frame_budget and self.level > 0:
+            self.level -= 1
+        else:
+            return False
+
+        self.frames_since_change = 0
+        self.level_changes += 1
+        return True
+
+    def active_degradations(self):
+        '''
+        Human readable list of what is currently reduced from full quality
+        '''
+        full, current = QUALITY_LEVELS[0], self.settings
+        degradations = []
+        if current['face_pane_every'] != full['face_pane_every']:
+            degradations.append('face pane every %d frames' % current['face_pane_every'])
+        if current['interpolation'] != full['interpolation']:
+            degradations.append('%s resize' % current['interpolation'])
+        if current['detect_every'] != max(full['detect_every'], self.min_detect_every):
+            degradations.append('detector every %d frames' % current['detect_every'])
+        return degradations
+
+    def report(self):
+        return 'quality level %d/%d (%s); stage ms: %s' % (self.level, len(QUALITY_LEVELS) - 1, ', '.join(self.active_degradations()) or 'full quality', 
+            ', '.join('%s %.1f' % (stage, 1000 * self.mean_latency(stage)) for stage in FrameScheduler.STAGES))
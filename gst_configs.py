@@ -33,11 +33,13 @@ This file configures a gstreamer pipeline that will run this demo.
 It is assumed there is 1 camera (imx219 or usb cameras supporting 720p or 1080p), 1 display, and 1 model to run
 '''
 import numpy as np
+from collections import deque
 import math
 import time
+import threading
 
 
-import display, model_runner
+import display, model_runner, gst_memory
 
 import gi
 gi.require_version('Gst', '1.0')
@@ -83,17 +85,50 @@ class CamParams():
             self.fps = '30/1'
 
             self.input_gst_str = f'v4l2src device={device}  ! image/jpeg,width={self.width},height={self.height} ! jpegdec ! tiovxdlcolorconvert '
+
+        # no camera needed, e.g. for running on a host with the CPU backend
+        elif cam_name=='test':
+            self.width = 1280
+            self.height = 720
+            self.fps = '30/1'
+
+            self.input_gst_str = f'videotestsrc is-live=true pattern=ball ! video/x-raw, width={self.width}, height={self.height}, framerate={self.fps} '
+
+        # device is the path to a video file, which is scaled to 720p
+        elif cam_name=='file':
+            self.width = 1280
+            self.height = 720
+            self.fps = '30/1'
+
+            self.input_gst_str = f'filesrc location={device} ! decodebin ! videoconvert ! videoscale ! video/x-raw, width={self.width}, height={self.height} '
         else: 
             raise ValueError('cam_name not recognized: ' + cam_name)
 
 
 class GstBuilder():
-    def __init__(self, model_params, camera_params, display_obj:display.DisplayDrawer, appsink_tensor_name='tensor_in', appsink_image_name='image_in', appsrc_name='out'):
+    # buffers in the pool of the color conversion that feeds the image appsink. Samples the application holds keep their buffers out of the pool, see SamplePairer
+    IMAGE_POOL_SIZE = 6
+
+    def __init__(self, model_params, camera_params, display_obj:display.DisplayDrawer, appsink_tensor_name='tensor_in', appsink_image_name='image_in', appsrc_name='out', backend='tidl', display_sink='autovideosink sync=false', detect_every=1, adaptive_detect_rate=False, tiles=None):
         '''
         GST pipeline builder class. Requires information about the input, model, and output. 
+
+        :param backend: 'tidl' runs the model with tidlinferer on TI SoCs. 'cpu' uses only standard GStreamer elements, and the tensor appsink gives the frame resized to the model input so the application can run the model itself (see model_runner.CPUInferencePool)
+        :param display_sink: sink for the output pipeline with the 'cpu' backend, e.g. fakesink on a host without a display
+        :param detect_every: run the model on only every Nth camera frame, by rate limiting the tensor branch. The application tracks objects between detections
+        :param adaptive_detect_rate: always include the rate limiter, so set_detect_every can change the rate while running
+        :param tiles: list of (x, y, width, height) regions of the camera frame (see ModelRunner.set_tiling). Each region gets its own tensor branch and appsink, named appsink_tensor_name + '_<index>'. None runs the model on the whole frame
         '''
         self.model_params = model_params
         self.camera_params = camera_params
+        self.backend = backend
+        self.display_sink = display_sink
+        self.detect_every = detect_every
+        self.adaptive_detect_rate = adaptive_detect_rate
+        self.tiles = tiles
+        self.rate_limiter_names = []
+        # smallest tile the tensor branch can take, see generate_resize_string. The CPU backend's videoscale can also upscale
+        self.min_tile_size = (0, 0)
 
         self.appsink_tensor_name = appsink_tensor_name
         self.appsink_image_name = appsink_image_name
@@ -103,17 +138,19 @@ class GstBuilder():
         
         self.display = display_obj
 
-    def generate_resize_string(self, in_height, in_width, model_height, model_width):
+    def generate_resize_string(self, in_height, in_width, model_height, model_width, src_pad='split_resize.'):
         '''
         Generate the tiovxmultiscaler gstreamer string that is used for the model input. 
             This can only downscale from in_h/w to model_h/w. 
             If there is a down-scale by more than 4x, then the multiscaler has to be called twice due to hardware limitations
 
+        :param src_pad: multiscaler pad to take the input from. For tiles, this is the src pad whose ROI is set to the tile
+
         TODO: make this resursive to it works on tiny models and large inputs
         '''
         MAX_RESIZE_FACTOR = 4
 
-        gst_string = f'   split_resize. ! queue max-size-buffers=1 leaky=2 '
+        gst_string = f'   {src_pad} ! queue max-size-buffers=1 leaky=2 '
 
         width_ratio = in_width / model_width
         height_ratio = in_height / model_height
@@ -123,42 +160,47 @@ class GstBuilder():
             resize_w = math.ceil(in_width / common_ratio)
             if resize_h % 2 == 1: resize_h +=1 #cannot be an odd number!
             if resize_w % 2 == 1: resize_w +=1 
+            # the second scaler cannot upscale, so a tile moved at runtime (see set_tiles) must stay at least this size
+            self.min_tile_size = (resize_w, resize_h)
             
             return gst_string + f' ! video/x-raw, width={resize_w}, height={resize_h}, format=NV12  ! tiovxmultiscaler target=1 ! video/x-raw, width={model_width}, height={model_height} '
 
         else:
+            self.min_tile_size = (model_width, model_height)
             return gst_string + f' ! video/x-raw, width={model_width}, height={model_height}, format=NV12  '
 
 
-    def build_gst_strings(self, model_obj:model_runner.ModelRunner):
+    def generate_rate_limit_string(self, name='detect_rate'):
         '''
-        Build a GST string that pulls input, preprocesses, runs inference, post 
-        processing, exposes interface to application code, and merges app output 
-        with postproc output for display.
+        Drop frames in the tensor branch so the model runs at 1/detect_every of the camera frame rate. Empty if the model runs on every frame
+        '''
+        if self.detect_every <= 1 and not self.adaptive_detect_rate: return ''
+        self.rate_limiter_names.append(name)
+        return f' ! videorate name={name} drop-only=true max-rate={self.detect_max_rate(self.detect_every)} '
 
-        param model_obj: Holds information about the model object, primarily 
-        data type. Most parameters instead come from self.model_params, 
-        which is set in __init__
+    def detect_max_rate(self, detect_every):
+        num, den = [int(n) for n in self.camera_params.fps.split('/')]
+        return max(1, round(num / den / detect_every))
 
-        Note that queues here often play a very important role! Then need to have max sizes and drop policies to prevent long latency and memory overflows
+    def set_detect_every(self, detect_every):
         '''
-    
-        video_conv = 'tiovxdlcolorconvert' # videoconvert # tiovxdlcolorconvert #tiovxdl are Neon optimized
-        
+        Change how often the model runs while the pipeline is playing. Needs the pipeline to have been built with a rate limiter (detect_every > 1 or adaptive_detect_rate)
+        '''
+        self.detect_every = detect_every
+        for name in self.rate_limiter_names:
+            self.pipe.get_by_name(name).set_property('max-rate', self.detect_max_rate(detect_every))
 
-        # input from camera and get ready to split into two 
-        gst_str = self.camera_params.input_gst_str 
+    def generate_tensor_string(self, model_obj:model_runner.ModelRunner, in_height, in_width, appsink_name, src_pad='split_resize.'):
+        '''
+        Generate the tensor branch: resize to the model input, preprocess, run tidlinferer, and push the output tensor to an appsink
 
-        # Use the videoflip to mirror the image horizontally -- this is more intuitive when the camera and display are facing the user(s)
-        gst_str+= f' !  video/x-raw, format=NV12 ! videoflip method=4  ! tiovxmultiscaler name=split_resize  ' 
-        
-        
-        # pipeline to do DL inference on. Requires preprocessing to match model
-        gst_str += self.generate_resize_string(self.camera_params.height, self.camera_params.width, model_obj.model_height, model_obj.model_width)
+        :param in_height, in_width: size of the branch input, i.e. the camera frame or one tile of it
+        '''
+        gst_str = self.generate_resize_string(in_height, in_width, model_obj.model_height, model_obj.model_width, src_pad=src_pad)
+        gst_str += self.generate_rate_limit_string(name=appsink_name + '_rate')
 
         tensor_format=self.model_params['preprocess']['data_layout']
         data_type = model_obj.input_type
-        print('model datatype : ' + str(data_type))
         #do preprocessing. We'll need to check the model_params (param.yaml)
         tensor_format = 'BGR' if self.model_params['preprocess']['reverse_channels'] else 'RGB'
         gst_str += f' ! tiovxdlpreproc out-pool-size=2 data-type={data_type}   channel-order={self.model_params["session"]["input_data_layout"].lower()} tensor-format={tensor_format.lower()} '
@@ -174,12 +216,85 @@ class GstBuilder():
         gst_str += f' ! application/x-tensor-tiovx '
 
         #run inference and push into application code via appsink
-        gst_str += f' ! tidlinferer model={model_obj.modeldir} ! appsink name={self.appsink_tensor_name} max-buffers=1 drop=True '
+        gst_str += f' ! tidlinferer model={model_obj.modeldir} ! appsink name={appsink_name} max-buffers=1 drop=True '
+
+        return gst_str
+
+    def generate_tile_roi_string(self):
+        '''
+        Set the region of interest on the first len(self.tiles) multiscaler outputs, so each one crops its tile out of the camera frame before scaling
+        '''
+        if not self.tiles: return ''
+        # the multiscaler has 5 outputs, and one is needed for the display image
+        if len(self.tiles) > 4:
+            raise ValueError('tidl backend supports at most 4 tiles, got %d' % len(self.tiles))
+        roi_str = ''
+        for i, (x, y, w, h) in enumerate(self.tiles):
+            roi_str += f' src_{i}::roi-startx={x} src_{i}::roi-starty={y} src_{i}::roi-width={w} src_{i}::roi-height={h} '
+        return roi_str
+
+    def set_tiles(self, tiles):
+        '''
+        Move the tiles while the pipeline is playing, e.g. so the model input follows the part of the frame on display. 
+        There must be as many tiles as the pipeline was built with, and with the TIDL backend none smaller than self.min_tile_size (see ModelRunner.set_tiling)
+        '''
+        self.tiles = tiles
+        if self.backend == 'cpu':
+            frame_height, frame_width = self.camera_params.height, self.camera_params.width
+            for i, (x, y, w, h) in enumerate(tiles):
+                crop = self.pipe.get_by_name(f'{self.appsink_tensor_name}_{i}_crop')
+                for prop, value in zip(('left', 'top', 'right', 'bottom'), (x, y, frame_width - x - w, frame_height - y - h)):
+                    crop.set_property(prop, value)
+        else:
+            scaler = self.pipe.get_by_name('split_resize')
+            for i, tile in enumerate(tiles):
+                pad = scaler.get_static_pad(f'src_{i}')
+                for prop, value in zip(('roi-startx', 'roi-starty', 'roi-width', 'roi-height'), tile):
+                    pad.set_property(prop, value)
+                # the multiscaler takes up a new ROI when its output is renegotiated
+                pad.send_event(Gst.Event.new_reconfigure())
+
+    def build_gst_strings(self, model_obj:model_runner.ModelRunner):
+        '''
+        Build a GST string that pulls input, preprocesses, runs inference, post 
+        processing, exposes interface to application code, and merges app output 
+        with postproc output for display.
+
+        param model_obj: Holds information about the model object, primarily 
+        data type. Most parameters instead come from self.model_params, 
+        which is set in __init__
+
+        Note that queues here often play a very important role! Then need to have max sizes and drop policies to prevent long latency and memory overflows
+        '''
+        if self.backend == 'cpu':
+            return self.build_gst_strings_cpu(model_obj)
+    
+        video_conv = 'tiovxdlcolorconvert' # videoconvert # tiovxdlcolorconvert #tiovxdl are Neon optimized
+        
+
+        # input from camera and get ready to split into two 
+        gst_str = self.camera_params.input_gst_str 
+
+        # Use the videoflip to mirror the image horizontally -- this is more intuitive when the camera and display are facing the user(s)
+        gst_str+= f' !  video/x-raw, format=NV12 ! videoflip method=4  ! tiovxmultiscaler name=split_resize {self.generate_tile_roi_string()} ' 
+        
+        
+        # pipeline to do DL inference on. Requires preprocessing to match model
+        print('model datatype : ' + str(model_obj.input_type))
+        if self.tiles:
+            # one multiscaler output per tile, each cropped to its region of the frame with the pad's ROI. 
+            # The tiles are not batched: tidlinferer takes one tensor per buffer and TIDL artifacts are compiled for a fixed batch size (normally 1), so each tile has its own tidlinferer, TIDL context and model run. 
+            # The runs share the accelerator, so inference time grows with the number of tiles
+            for i, (x, y, w, h) in enumerate(self.tiles):
+                gst_str += self.generate_tensor_string(model_obj, h, w, f'{self.appsink_tensor_name}_{i}', src_pad=f'split_resize.src_{i}')
+        else:
+            gst_str += self.generate_tensor_string(model_obj, self.camera_params.height, self.camera_params.width, self.appsink_tensor_name)
 
         # another copy of the input image is resized and pushed to application code via appsink for post-processing & visualization
         in_height = self.camera_params.height - (self.camera_params.height % 16)
         in_width = self.camera_params.width - (self.camera_params.width % 16)
-        gst_str += f'   split_resize. ! queue leaky=2 max-size-buffers=1  ! video/x-raw, width={in_width}, height={in_height}, format=NV12 ! {video_conv} out-pool-size=4 ! video/x-raw, format=RGB ! appsink name={self.appsink_image_name} max-buffers=1 drop=True'
+        image_pad = f'split_resize.src_{len(self.tiles)}' if self.tiles else 'split_resize.'
+        gst_str += f'   {image_pad} ! queue leaky=2 max-size-buffers=1  ! video/x-raw, width={in_width}, height={in_height}, format=NV12 ! {video_conv} out-pool-size={GstBuilder.IMAGE_POOL_SIZE} ! video/x-raw, format=RGB ! appsink name={self.appsink_image_name} max-buffers=1 drop=True'
         
 
         #### boundary between input gstreamer string and output gstreamer string. Application code (appsink and appsrc) sits between these two. The two gstreamer strings are their own unique pipelines, connected by applicatoin code. 
@@ -197,7 +312,43 @@ class GstBuilder():
         
         self.gst_str = gst_str
         self.out_gst_str = out_gst_str
+        self.build_output_caps()
+
+        return gst_str, out_gst_str
+
+    def build_gst_strings_cpu(self, model_obj:model_runner.ModelRunner):
+        '''
+        Build the same pipelines as build_gst_strings from standard GStreamer elements only. Instead of a tensor from tidlinferer, the tensor appsink gives an RGB frame at the model input size to preprocess and run on the CPU
+        '''
+        video_conv = 'videoconvert'
+
+        # the usb cameras use TI color conversion after decoding
+        gst_str = self.camera_params.input_gst_str.replace('tiovxdlcolorconvert', video_conv)
+        gst_str += f' ! {video_conv} ! videoflip method=4 ! tee name=split_resize '
+
+        if self.tiles:
+            # crop each tile out of the frame with videocrop, which takes the margins to remove
+            frame_height, frame_width = self.camera_params.height, self.camera_params.width
+            for i, (x, y, w, h) in enumerate(self.tiles):
+                appsink_name = f'{self.appsink_tensor_name}_{i}'
+                gst_str += f'   split_resize. ! queue max-size-buffers=1 leaky=2 {self.generate_rate_limit_string(name=appsink_name + "_rate")} ! videocrop name={appsink_name}_crop left={x} top={y} right={frame_width - x - w} bottom={frame_height - y - h} ! videoscale ! {video_conv} ! video/x-raw, width={model_obj.model_width}, height={model_obj.model_height}, format=RGB ! appsink name={appsink_name} max-buffers=1 drop=True '
+        else:
+            gst_str += f'   split_resize. ! queue max-size-buffers=1 leaky=2 {self.generate_rate_limit_string()} ! videoscale ! {video_conv} ! video/x-raw, width={model_obj.model_width}, height={model_obj.model_height}, format=RGB ! appsink name={self.appsink_tensor_name} max-buffers=1 drop=True '
 
+        in_height = self.camera_params.height - (self.camera_params.height % 16)
+        in_width = self.camera_params.width - (self.camera_params.width % 16)
+        gst_str += f'   split_resize. ! queue leaky=2 max-size-buffers=1 ! videoscale ! {video_conv} ! video/x-raw, width={in_width}, height={in_height}, format=RGB ! appsink name={self.appsink_image_name} max-buffers=1 drop=True'
+
+        out_gst_str = f' appsrc format=GST_FORMAT_TIME is-live=true  name={self.appsrc_name} ! video/x-raw,  format={self.appsrc_output_format}, width={self.display.display_width}, height={self.display.display_height} '
+        out_gst_str += f' ! queue leaky=2 max-size-buffers=1 ! {video_conv} ! {self.display_sink}'
+
+        self.gst_str = gst_str
+        self.out_gst_str = out_gst_str
+        self.build_output_caps()
+
+        return gst_str, out_gst_str
+
+    def build_output_caps(self):
         # define output caps for the receipt image coming from appsrc
         gst_caps_str = "video/x-raw, " + \
             "width=%d, " % self.display.display_width + \
@@ -205,8 +356,6 @@ class GstBuilder():
             "format=%s, " % self.appsrc_output_format + \
             "framerate=%s" % '0/1'
         self.gst_caps = Gst.caps_from_string(gst_caps_str)
-
-        return gst_str, out_gst_str
     
 
     def setup_gst_appsrcsink(self):
@@ -220,7 +369,13 @@ class GstBuilder():
         self.pipe = Gst.parse_launch(self.gst_str)
         self.out_pipe = Gst.parse_launch(self.out_gst_str)
 
-        self.app_in_tensor = self.pipe.get_by_name(self.appsink_tensor_name)
+        if self.tiles:
+            # one appsink per tile, in the same order as self.tiles
+            self.app_in_tiles = [self.pipe.get_by_name(f'{self.appsink_tensor_name}_{i}') for i in range(len(self.tiles))]
+            self.app_in_tensor = self.app_in_tiles[0]
+        else:
+            self.app_in_tiles = None
+            self.app_in_tensor = self.pipe.get_by_name(self.appsink_tensor_name)
         self.app_in_image = self.pipe.get_by_name(self.appsink_image_name)
         self.app_out = self.out_pipe.get_by_name(self.appsrc_name)
         '''
@@ -236,49 +391,244 @@ class GstBuilder():
         s = self.pipe.set_state(Gst.State.PLAYING)
         s = self.out_pipe.set_state(Gst.State.PLAYING)
 
-    def pull_sample(self, app, loop=True):
+    def pull_sample(self, app, loop=True, timeout_ns=50000000):
         '''
-        Retrieve a sample from the appsink 'app' and return a buffer of data.
+        Retrieve a sample from the appsink 'app', with its buffer mapped for reading.
         The pipeline and appsink instance must be PLAYING state
 
+        The data is not copied: the returned gst_memory.SampleHandle holds the sample and the mapping, and gives the data as a read-only NumPy view. 
+        Call its release() when the frame is done with it, so the pipeline can reuse the buffer
+
         param app: The appsink obtained from a valid pipeline
+        param timeout_ns: how long to wait for each try. 0 returns immediately if no sample is waiting
+        :return: SampleHandle, or None if loop is False and no sample came
         '''
-        data = None
-        struct = None
-        sample = app.try_pull_sample(50000000)
+        sample = app.try_pull_sample(timeout_ns)
         if type(sample) != Gst.Sample:
             # Poll endlessly for a sample
             if loop:
                 while type(sample) != Gst.Sample:
-                    sample = app.try_pull_sample(50000000)
-            else: return data, struct # None, None
-
-        buffer = sample.get_buffer()
-        # with flag READ, the data buffer cannot be modified. A copy must be made to modify
-        _, map_info = buffer.map(Gst.MapFlags.READ)
-        # print(buffer.get_size())
-        # print(buffer.get_sizes())
-        # the buffer of data
-        data = map_info.data
-        # release the sample and map to GST memory
-        buffer.unmap(map_info)
-        
-        # get caps to help learn about input structure
-        appsink_caps = sample.get_caps()
-        struct = appsink_caps.get_structure(0)
+                    sample = app.try_pull_sample(timeout_ns)
+            else: return None
 
-        return data, struct
+        return gst_memory.SampleHandle(sample)
 
-    def format_image_from_sample(self, sample_image, struct):
+    def format_image_from_sample(self, sample):
         '''
-        Reformat the image from an input byte buffer into a numpy ndarray with proper height, width, and channels
+        View the image in a SampleHandle from pull_sample as a numpy ndarray with proper height, width, and channels. The view is read-only and only valid until the sample is released
 
         Assuming that inputs are RGB images
         '''
-        width = struct.get_value("width")
-        height = struct.get_value("height")
+        width = sample.struct.get_value("width")
+        height = sample.struct.get_value("height")
 
-        frame = np.ndarray((height, width, 3), np.uint8, sample_image)
+        frame = np.ndarray((height, width, 3), np.uint8, sample.data)
 
         return frame
-    
\ No newline at end of file
+    
+
+class SamplePairer():
+    '''
+    Match samples from the image and tensor appsinks by buffer PTS, so detections are drawn on the frame they came from. 
+    Both branches start from the same camera frame, but have their own leaky queues and the tensor branch also runs inference, so their samples arrive at different times and either can be dropped
+
+    Samples are held, in order, until they pair up or cannot any more. An image whose tensor will not come (a newer tensor arrived, or more than window images are waiting) is dropped if require_tensor, or else handed out without a tensor. 
+    A tensor older than every waiting image belongs to an image that is gone: it is dropped if require_tensor, or else handed out with the next image and counted as mismatched (the detector runs on only some frames, and late detections are better than none)
+
+    Held samples keep their buffers out of the upstream buffer pools, so at most max_held images and max_held tensors are held. When another arrives, the oldest is released and counted as dropped; none of them has been matched, or it would have been handed out
+    '''
+    def __init__(self, window=3, require_tensor=True, max_held=GstBuilder.IMAGE_POOL_SIZE - 2):
+        '''
+        :param window: images to hold while waiting for their tensors. With require_tensor False this is also how many frames the display may lag to wait for detections; 0 hands out every image at once. Limited to max_held - 1
+        :param require_tensor: only hand out images that have a tensor, e.g. when the model runs on every frame
+        :param max_held: most images, and most tensors, to hold at once. Must be below the out-pool-size of the element that makes the buffers, less the buffers held elsewhere (the appsink or SampleDelivery, and the frame being drawn), or the pool runs dry and stalls that branch of the pipeline
+        '''
+        self.max_held = max_held
+        self.window = min(window, max_held - 1)
+        self.require_tensor = require_tensor
+        self.images = deque()
+        self.tensors = deque()
+        self.stats = {'paired': 0, 'image_only': 0, 'mismatched': 0, 'dropped_images': 0, 'dropped_tensors': 0}
+
+    def add_image(self, sample):
+        if sample is None: return
+        self.images.append(sample)
+        if len(self.images) > self.max_held:
+            self.images.popleft().release()
+            self.stats['dropped_images'] += 1
+
+    def add_tensor(self, sample):
+        '''
+        Add a tensor sample, or a list of them for the tiles of a frame, which must all have the same PTS
+        '''
+        if sample is None: return
+        if isinstance(sample, list) and any(tile.pts != sample[0].pts for tile in sample):
+            # tiles from different frames; the appsinks drop independently
+            gst_memory.release_samples(sample)
+            self.stats['dropped_tensors'] += 1
+            return
+        self.tensors.append(sample)
+        if len(self.tensors) > self.max_held:
+            gst_memory.release_samples(self.tensors.popleft())
+            self.stats['dropped_tensors'] += 1
+
+    def waiting_for_tensor(self):
+        '''
+        True if an image is waiting and the next thing to pair it is a tensor
+        '''
+        return len(self.images) > 0 and len(self.tensors) == 0
+
+    @staticmethod
+    def pts_of(sample):
+        return sample[0].pts if isinstance(sample, list) else sample.pts
+
+    def pop(self):
+        '''
+        :return: (image, tensor) for the oldest frame that is ready, where tensor may be None unless require_tensor, or None if no frame is ready yet
+        '''
+        while len(self.images) > 0:
+            image = self.images[0]
+            # tensors for frames older than the oldest image can no longer be matched
+            while len(self.tensors) > 0 and self.pts_of(self.tensors[0]) < image.pts:
+                late_tensor = self.tensors.popleft()
+                # a newer tensor that is no newer than the image replaces it
+                if self.require_tensor or (len(self.tensors) > 0 and self.pts_of(self.tensors[0]) <= image.pts):
+                    gst_memory.release_samples(late_tensor)
+                    self.stats['dropped_tensors'] += 1
+                else:
+                    self.images.popleft()
+                    self.stats['mismatched'] += 1
+                    return image, late_tensor
+
+            if len(self.tensors) > 0 and self.pts_of(self.tensors[0]) == image.pts:
+                self.stats['paired'] += 1
+                return self.images.popleft(), self.tensors.popleft()
+
+            # a newer tensor is waiting, so this image will not get one
+            if len(self.tensors) > 0 or len(self.images) > self.window:
+                self.images.popleft()
+                if self.require_tensor:
+                    image.release()
+                    self.stats['dropped_images'] += 1
+                    continue
+                self.stats['image_only'] += 1
+                return image, None
+            return None
+
+        # tensors with no image yet; bound how many are held
+        while len(self.tensors) > self.window + 1:
+            gst_memory.release_samples(self.tensors.popleft())
+            self.stats['dropped_tensors'] += 1
+        return None
+
+    def release_all(self):
+        gst_memory.release_samples(*self.images, *self.tensors)
+        self.images.clear()
+        self.tensors.clear()
+
+
+class SampleDelivery():
+    '''
+    Hand samples to the application as the appsinks receive them, instead of polling each appsink with pull_sample. 
+    Each appsink emits new-sample from its pipeline's streaming thread; the callback pulls and maps the sample there, stamps its arrival time and queues it. The application thread sleeps in wait() until a frame's samples are there, so it neither wakes every poll timeout while the pipeline is idle nor leaves a sample in one appsink while it waits on the other
+
+    Each appsink has its own bounded queue. When the application falls behind, the oldest sample is released and counted as dropped, like the leaky queues in the pipeline
+    '''
+    def __init__(self, gst_conf:GstBuilder, capacity=1):
+        '''
+        :param gst_conf: builder whose appsinks (after setup_gst_appsrcsink) deliver samples. Connect before the pipeline plays so no sample is missed
+        :param capacity: samples held per appsink. 1 keeps only the newest, like the appsinks' max-buffers=1, so a slow application does not fall further and further behind
+        '''
+        self.capacity = capacity
+        self.condition = threading.Condition()
+        self.queues = {}
+        self.handlers = []
+        self.stopped = False
+        self.stats = {'delivered': 0, 'dropped': 0}
+
+        self.connect(gst_conf.app_in_image, 'image')
+        # one queue per tile; the tiles of a frame are handed out together as a list
+        self.tiled = gst_conf.app_in_tiles is not None
+        tensor_sinks = gst_conf.app_in_tiles if self.tiled else [gst_conf.app_in_tensor]
+        self.tensor_keys = list(range(len(tensor_sinks)))
+        for key, app in zip(self.tensor_keys, tensor_sinks):
+            self.connect(app, key)
+
+    def connect(self, app, key):
+        self.queues[key] = deque()
+        app.set_property('emit-signals', True)
+        self.handlers.append((app, app.connect('new-sample', self.on_new_sample, key)))
+
+    def on_new_sample(self, app, key):
+        '''
+        new-sample callback; runs in the pipeline's streaming thread
+        '''
+        t_arrival = time.time()
+        sample = app.pull_sample()
+        if type(sample) != Gst.Sample: return Gst.FlowReturn.OK
+        handle = gst_memory.SampleHandle(sample)
+        handle.t_arrival = t_arrival
+
+        dropped = None
+        with self.condition:
+            if self.stopped:
+                dropped = handle
+            else:
+                queue = self.queues[key]
+                if len(queue) >= self.capacity:
+                    dropped = queue.popleft()
+                    self.stats['dropped'] += 1
+                queue.append(handle)
+                self.stats['delivered'] += 1
+                self.condition.notify()
+        # unmap outside the lock, so the other streaming threads are not held up
+        if dropped is not None: dropped.release()
+        return Gst.FlowReturn.OK
+
+    def ready(self, wake_on):
+        if wake_on == 'image': return len(self.queues['image']) > 0
+        # a tensor from every tile
+        return all(len(self.queues[key]) > 0 for key in self.tensor_keys)
+
+    def wait(self, timeout_s=0.5, wake_on='image'):
+        '''
+        Wait until an image or a whole tensor has arrived, then take everything that is ready
+
+        :param timeout_s: longest wait, so the caller can check whether to stop
+        :param wake_on: 'image' or 'tensor', whichever paces the frames. Samples of the other kind are taken along without waking the caller on their own
+        :return: (images, tensors), lists of SampleHandles in arrival order. With tiling each tensor is a list with a sample per tile, from the same camera frame. The lists may be empty if the wait timed out
+        '''
+        stale = []
+        with self.condition:
+            if not self.ready(wake_on): self.condition.wait_for(lambda: self.ready(wake_on), timeout_s)
+            images = list(self.queues['image'])
+            self.queues['image'].clear()
+
+            tensors = []
+            tensor_queues = [self.queues[key] for key in self.tensor_keys]
+            while all(len(queue) > 0 for queue in tensor_queues):
+                newest = max(queue[0].pts for queue in tensor_queues)
+                if all(queue[0].pts == newest for queue in tensor_queues):
+                    tiles = [queue.popleft() for queue in tensor_queues]
+                    tensors.append(tiles if self.tiled else tiles[0])
+                else:
+                    # an appsink dropped this frame's tile, so the other tiles of it are no use
+                    for queue in tensor_queues:
+                        if queue[0].pts < newest: stale.append(queue.popleft())
+            self.stats['dropped'] += len(stale)
+        gst_memory.release_samples(*stale)
+        return images, tensors
+
+    def stop(self):
+        '''
+        Disconnect from the appsinks and release the samples not yet taken
+        '''
+        with self.condition:
+            self.stopped = True
+            queued = [sample for queue in self.queues.values() for sample in queue]
+            for queue in self.queues.values(): queue.clear()
+        for app, handler_id in self.handlers:
+            app.disconnect(handler_id)
+            app.set_property('emit-signals', False)
+        self.handlers = []
+        gst_memory.release_samples(*queued)
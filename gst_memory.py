@@ -0,0 +1,165 @@
+#
+# Copyright (C) 2023 Texas Instruments Incorporated - http://www.ti.com/
+#
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#    Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+#    Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the
+#    distribution.
+#
+#    Neither the name of Texas Instruments Incorporated nor the names of
+#    its contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''
+Zero-copy access to GStreamer buffer memory from NumPy. 
+
+Gst.Buffer.new_wrapped needs bytes, so every frame out of the application would be copied, and every frame in is copied unless its buffer is mapped in place. 
+With the gst-python overrides (part of the Edge AI SDK), Gst.Buffer.map gives the mapped memory as a memoryview instead of a copy, and map_buffer wraps that memory in a NumPy array without copying. 
+Plain PyGObject only gives a bytes copy; map_buffer then reports that the buffer cannot be mapped in place, so callers can copy instead. 
+An array from map_buffer is only valid until unmap_buffer is called
+'''
+
+import ctypes
+import numpy as np
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+
+def map_buffer(buffer, flags=Gst.MapFlags.READ):
+    '''
+    Map a Gst.Buffer and return (map_info, array), where array is a flat uint8 view of the buffer's memory. With flags READ the array is read-only. 
+    A WRITE mapping needs a writable buffer, i.e. one that nothing else holds a reference to
+
+    :return: (None, None) if the buffer could not be mapped in place
+    '''
+    success, map_info = buffer.map(flags)
+    if not success:
+        return None, None
+    if not isinstance(map_info.data, memoryview):
+        # PyGObject without the gst-python overrides copies the data out
+        buffer.unmap(map_info)
+        return None, None
+
+    # view the memory by address rather than through the memoryview: unmap releases the memoryview, which fails while an array still uses it
+    size = len(map_info.data)
+    address = np.frombuffer(map_info.data, dtype=np.uint8).ctypes.data
+    array = np.ctypeslib.as_array((ctypes.c_uint8 * size).from_address(address))
+    array.flags.writeable = bool(int(flags) & int(Gst.MapFlags.WRITE))
+    return map_info, array
+
+def unmap_buffer(buffer, map_info):
+    '''
+    Release a mapping from map_buffer. Any array of the mapped memory must not be used after this
+    '''
+    buffer.unmap(map_info)
+
+
+class OutputBufferPool():
+    '''
+    A Gst.BufferPool of frames for an appsrc, so a frame is composed straight into a buffer's memory and pushed without copying. 
+    Buffers come back to the pool once the downstream pipeline is done with them. Their memory is not cleared, and a buffer may be new or have been changed downstream, so each acquired frame must be drawn in full
+    '''
+    def __init__(self, gst_caps, height, width, channels=3, num_buffers=3):
+        '''
+        :param gst_caps: caps of the appsrc, e.g. GstBuilder.gst_caps
+        :param num_buffers: buffers allocated up front. More are allocated if downstream holds on to all of them
+        '''
+        self.shape = (height, width, channels)
+        self.pool = Gst.BufferPool.new()
+        config = self.pool.get_config()
+        Gst.BufferPool.config_set_params(config, gst_caps, height * width * channels, num_buffers, 0)
+        self.pool.set_config(config)
+        self.pool.set_active(True)
+
+    def acquire(self):
+        '''
+        Take a buffer from the pool and map it for writing
+
+        :return: (buffer, map_info, frame), frame being a height x width x channels view of the buffer, or (None, None, None) if that failed, e.g. because buffers cannot be mapped in place (see map_buffer)
+        '''
+        ret, buffer = self.pool.acquire_buffer(None)
+        if ret != Gst.FlowReturn.OK:
+            return None, None, None
+        map_info, array = map_buffer(buffer, Gst.MapFlags.WRITE)
+        if map_info is None:
+            return None, None, None
+        return buffer, map_info, array.reshape(self.shape)
+
+    def stop(self):
+        self.pool.set_active(False)
+
+
+class SampleHandle():
+    '''
+    A sample pulled from an appsink, with its buffer mapped for reading for as long as the application needs it, e.g. one frame. 
+    data is a flat, read-only uint8 NumPy view of the buffer memory and struct the caps structure (width, height, ...). 
+    The pipeline cannot reuse the buffer until release() is called, so release each handle once its frame is done
+    '''
+    def __init__(self, sample):
+        self.sample = sample
+        self.buffer = sample.get_buffer()
+        self.struct = sample.get_caps().get_structure(0)
+        # presentation timestamp, shared by the samples of both pipeline branches that came from the same camera frame
+        self.pts = self.buffer.pts
+        # time.time() when the appsink had the sample, if it was delivered by signal (see gst_configs.SampleDelivery)
+        self.t_arrival = None
+        self.map_info, self.data = map_buffer(self.buffer, Gst.MapFlags.READ)
+        if self.map_info is None:
+            # the buffer cannot be mapped in place; copy the data through PyGObject instead
+            _, map_info = self.buffer.map(Gst.MapFlags.READ)
+            self.data = np.frombuffer(map_info.data, dtype=np.uint8)
+            self.buffer.unmap(map_info)
+
+    def release(self):
+        '''
+        Unmap the buffer and drop the sample. The data view must not be used afterwards. Safe to call more than once
+        '''
+        if self.map_info is not None:
+            unmap_buffer(self.buffer, self.map_info)
+            self.map_info = None
+        self.data = None
+        self.buffer = None
+        self.sample = None
+
+    def __del__(self):
+        # a handle that was never released must still unmap, or the buffer is never freed
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def release_samples(*samples):
+    '''
+    Release SampleHandles, or lists of them (e.g. the tiles of a frame), once nothing reads their memory any more. None is skipped
+    '''
+    for sample in samples:
+        if isinstance(sample, list):
+            release_samples(*sample)
+        elif sample is not None:
+            sample.release()
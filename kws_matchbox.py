@@ -33,17 +33,371 @@
 '''
 This source file is a standalone application for running live inference for 
  keyword spotting on audio data from a microphone connected in linux 
+
+librosa, onnxruntime and pyaudio are imported where they are used, so importing this module (e.g. for KWSResultChannel in the vision application) stays cheap
 '''
 
 import os, time
-import pyaudio
+import threading
+import argparse
+from collections import deque
 import numpy as np
-import librosa
-import onnxruntime as ort
 import yaml
-import queue
+from multiprocessing import shared_memory
+
+from audio_features import MFCCEngine, StreamingFeatureExtractor, PolyphaseDecimator
+from audio_sources import MicrophoneSource, FileSource, SyntheticSource
+
+class AudioRingBuffer(object):
+    '''
+    Preallocated single-producer / single-consumer ring buffer of int16 samples. 
+
+    The PortAudio callback is the only writer and the inference worker is the only reader. Each side only advances its own counter, so no lock is needed on the data path; 
+    the event just wakes the reader when new samples arrive. If the reader falls so far behind that a write will not fit, the new samples are dropped and counted as an overrun rather than blocking the audio driver
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        # total samples ever written and read. The difference is the backlog
+        self.write_count = 0
+        self.read_count = 0
+        self.data_ready = threading.Event()
+
+        self.overruns = 0
+        self.dropped_samples = 0
+        self.max_backlog = 0
+
+    def backlog(self):
+        return self.write_count - self.read_count
+
+    def write(self, data, block=False):
+        '''
+        Copy samples in. Returns False if the samples were dropped. 
+        From a real audio callback this must never block; block=True is for file replay at full speed, where the writer should wait for the reader instead
+        '''
+        data = np.frombuffer(data, dtype=np.int16)
+        n = len(data)
+        while block and self.backlog() + n > self.capacity and n <= self.capacity:
+            time.sleep(0.001)
+        if self.backlog() + n > self.capacity:
+            self.overruns += 1
+            self.dropped_samples += n
+            self.data_ready.set()
+            return False
+
+        start = self.write_count % self.capacity
+        first = min(n, self.capacity - start)
+        self.buffer[start:start+first] = data[:first]
+        self.buffer[:n-first] = data[first:]
+
+        self.write_count += n
+        self.max_backlog = max(self.max_backlog, self.backlog())
+        self.data_ready.set()
+        return True
+
+    def read(self, n, timeout=None):
+        '''
+        Copy out the next n samples, waiting up to timeout seconds for them to arrive. Returns None if not enough samples are available
+        '''
+        while self.backlog() < n:
+            self.data_ready.clear()
+            # recheck after clearing so a write between the check and clear is not missed
+            if self.backlog() >= n: break
+            if not self.data_ready.wait(timeout): return None
+
+        start = self.read_count % self.capacity
+        first = min(n, self.capacity - start)
+        data = np.concatenate([self.buffer[start:start+first], self.buffer[:n-first]])
+
+        self.read_count += n
+        return data
+
+
+class KWSResultChannel(object):
+    '''
+    Fixed-size records of KWS results in shared memory, for passing results from the KWS process to the vision application without pickling. 
+
+    Each record holds the label index (-1 if no word was above LOGIT_THRESHOLD), the best logit as a score, the capture time of the end of the window, and a sequence number. 
+    The label strings are written once by publish_labels, which also tells the reader that KWS is running.
+    There is one writer. Old records are overwritten when the ring is full; a reader that falls that far behind skips what it missed and counts it in self.lost
+
+    Create it in the parent with a capacity, and pass the object to the child process, which attaches to the same memory by name
+    '''
+    RECORD_DTYPE = np.dtype([('seq', np.int64), ('capture_time', np.float64), ('score', np.float32), ('label', np.int32)])
+    # header is [records written, length of label bytes, capacity]
+    HEADER_SIZE = 64
+    LABELS_SIZE = 4096
+
+    def __init__(self, capacity=64, name=None):
+        if name is None:
+            size = KWSResultChannel.HEADER_SIZE + KWSResultChannel.LABELS_SIZE + capacity * KWSResultChannel.RECORD_DTYPE.itemsize
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+
+        self.header = np.ndarray((3,), dtype=np.int64, buffer=self.shm.buf)
+        if self.owner:
+            self.header[:] = [0, 0, capacity]
+        self.capacity = int(self.header[2])
+        self.labels_buffer = np.ndarray((KWSResultChannel.LABELS_SIZE,), dtype=np.uint8, buffer=self.shm.buf, offset=KWSResultChannel.HEADER_SIZE)
+        self.records = np.ndarray((self.capacity,), dtype=KWSResultChannel.RECORD_DTYPE, buffer=self.shm.buf, offset=KWSResultChannel.HEADER_SIZE + KWSResultChannel.LABELS_SIZE)
+
+        # reader state, local to each process
+        self.read_count = 0
+        self.lost = 0
+        self.labels = None
+
+    def __reduce__(self):
+        return (KWSResultChannel, (self.capacity, self.shm.name))
+
+    def publish_labels(self, labels):
+        encoded = np.frombuffer('\n'.join(labels).encode('utf-8'), dtype=np.uint8)
+        if len(encoded) > KWSResultChannel.LABELS_SIZE:
+            raise ValueError('Labels take %d bytes; only %d fit in the result channel' % (len(encoded), KWSResultChannel.LABELS_SIZE))
+        self.labels_buffer[:len(encoded)] = encoded
+        self.header[1] = len(encoded)
+
+    def get_labels(self, timeout=None):
+        '''
+        Wait up to timeout seconds (forever if None) for the writer to publish the labels. Returns the list of labels, or None on timeout
+        '''
+        t_start = time.time()
+        while self.labels is None:
+            length = int(self.header[1])
+            if length > 0:
+                self.labels = self.labels_buffer[:length].tobytes().decode('utf-8').split('\n')
+            elif timeout is not None and time.time() - t_start > timeout:
+                return None
+            else:
+                time.sleep(0.01)
+        return self.labels
+
+    def write(self, label, score, capture_time):
+        count = int(self.header[0])
+        record = self.records[count % self.capacity]
+        record['capture_time'] = capture_time
+        record['score'] = score
+        record['label'] = label
+        # sequence number last, so a reader that sees it also sees the rest of the record
+        record['seq'] = count
+        self.header[0] = count + 1
+
+    def read(self):
+        '''
+        Return a copy of every record written since the last read, oldest first, as a structured array with fields seq, capture_time, score and label
+        '''
+        write_count = int(self.header[0])
+        start = max(self.read_count, write_count - self.capacity)
+        self.lost += start - self.read_count
+        if start == write_count:
+            return self.records[:0].copy()
+
+        indices = np.arange(start, write_count)
+        records = self.records[indices % self.capacity]
+        # drop records the writer overwrote while they were copied, or that are not fully visible yet
+        valid = (records['seq'] == indices) & (indices >= int(self.header[0]) - self.capacity)
+        self.lost += int(np.sum(~valid))
+        self.read_count = write_count
+        return records[valid]
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class VoiceActivityDetector(object):
+    '''
+    Cheap gate to decide whether a window of audio could contain a spoken command. 
+
+    Audio is split into 10 ms subframes. A subframe is active if its energy is well above an adaptive noise floor, or somewhat above it with a high zero-crossing rate (unvoiced sounds like 's' and 'f' are quiet but noisy).
+    The noise floor drops immediately to quieter subframes and rises slowly, so steady noise like HVAC is absorbed into it while short words are not.
+    A window is kept if any subframe in it was active, so a word anywhere in the window still reaches the model
+    '''
+    # default thresholds, see __init__
+    MARGIN_DB = 9.0
+    UNVOICED_ZCR = 0.25
+    FLOOR_RISE = 0.002
+
+    def __init__(self, rate, window_seconds=1.0, subframe_seconds=0.01, margin_db=MARGIN_DB, unvoiced_zcr=UNVOICED_ZCR, floor_rise=FLOOR_RISE, min_floor_db=-70.0):
+        '''
+        :param margin_db: energy above the noise floor for a subframe to count as active
+        :param unvoiced_zcr: zero-crossing rate (crossings per sample) above which only half the margin is needed
+        :param floor_rise: fraction of the gap the noise floor rises by per subframe when the signal is louder than it
+        :param min_floor_db: lower limit on the floor so digital silence does not make every small click look like speech
+        '''
+        self.subframe_size = int(rate * subframe_seconds)
+        self.window_size = int(rate * window_seconds)
+        self.margin_db = margin_db
+        self.unvoiced_zcr = unvoiced_zcr
+        self.floor_rise = floor_rise
+        self.min_floor_db = min_floor_db
+
+        self.noise_floor_db = None
+        # start as if there has been no activity in the last window
+        self.samples_since_active = self.window_size
+
+    def update(self, audio_chunk):
+        '''
+        Add the newest int16 audio. Returns True if the window ending with this chunk had any active subframes
+        '''
+        num_subframes = len(audio_chunk) // self.subframe_size
+        if num_subframes == 0:
+            self.samples_since_active += len(audio_chunk)
+            return self.samples_since_active < self.window_size
+
+        subframes = (np.asarray(audio_chunk[:num_subframes * self.subframe_size], dtype=np.float32) / 32768).reshape(num_subframes, self.subframe_size)
+        energy_db = 10 * np.log10(np.mean(subframes ** 2, axis=1) + 1e-10)
+        zcr = np.mean(np.signbit(subframes[:, 1:]) != np.signbit(subframes[:, :-1]), axis=1)
+
+        last_active = -1
+        for i in range(num_subframes):
+            if self.noise_floor_db is None or energy_db[i] < self.noise_floor_db:
+                self.noise_floor_db = max(energy_db[i], self.min_floor_db)
+            else:
+                self.noise_floor_db += self.floor_rise * (energy_db[i] - self.noise_floor_db)
+
+            above_floor = energy_db[i] - self.noise_floor_db
+            if above_floor > self.margin_db or (above_floor > self.margin_db / 2 and zcr[i] > self.unvoiced_zcr):
+                last_active = i
+
+        if last_active >= 0:
+            self.samples_since_active = len(audio_chunk) - (last_active + 1) * self.subframe_size
+        else:
+            self.samples_since_active += len(audio_chunk)
+
+        return self.samples_since_active < self.window_size
+
+
+# names of onnxruntime.GraphOptimizationLevel values
+OPTIMIZATION_LEVELS = {'disable': 'ORT_DISABLE_ALL', 'basic': 'ORT_ENABLE_BASIC', 'extended': 'ORT_ENABLE_EXTENDED', 'all': 'ORT_ENABLE_ALL'}
+
+def optimized_model_path(modelpath, optimization_level, cache_dir):
+    '''
+    Where create_kws_session caches the optimized graph of a model
+    '''
+    return os.path.join(cache_dir, os.path.splitext(os.path.basename(modelpath))[0] + '_optimized_%s.onnx' % optimization_level)
+
+def create_kws_session(modelpath, intra_op_threads=0, inter_op_threads=0, execution_mode='sequential', optimization_level='extended', cache_dir=None):
+    '''
+    Create an ONNX Runtime CPU session for the KWS model with explicit threading and graph optimization settings
+
+    :param intra_op_threads: threads used within an operator. 0 lets onnxruntime choose (one per core), which competes with the vision pipeline for the same cores
+    :param inter_op_threads: threads used across operators; only used with execution_mode='parallel'
+    :param execution_mode: 'sequential' or 'parallel'
+    :param optimization_level: one of OPTIMIZATION_LEVELS. 'all' adds layout optimizations that are specific to the CPU they ran on
+    :param cache_dir: directory to save the optimized graph in and load it from on later startups, so graph optimization is skipped. None optimizes on every startup and writes nothing
+    :return: the session, and the seconds it took to create
+    '''
+    t1 = time.perf_counter()
+    import onnxruntime as ort
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = intra_op_threads
+    sess_options.inter_op_num_threads = inter_op_threads
+    sess_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if execution_mode == 'parallel' else ort.ExecutionMode.ORT_SEQUENTIAL
+
+    optimized_modelpath = optimized_model_path(modelpath, optimization_level, cache_dir) if cache_dir is not None else None
+    if optimized_modelpath is not None and os.path.exists(optimized_modelpath) and os.path.getmtime(optimized_modelpath) >= os.path.getmtime(modelpath):
+        # already optimized; running the optimizers again would find nothing to do
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        modelpath = optimized_modelpath
+    else:
+        sess_options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, OPTIMIZATION_LEVELS[optimization_level])
+        if optimized_modelpath is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            sess_options.optimized_model_filepath = optimized_modelpath
+
+    session = ort.InferenceSession(modelpath, providers=['CPUExecutionProvider'], provider_options=[{}], sess_options=sess_options)
+    return session, time.perf_counter() - t1
+
+
+class BoundSession(object):
+    '''
+    Run a session through IOBinding on preallocated input and output arrays, one set per batch size, so no tensors are allocated per call. 
+    Also keeps per-call latency statistics.
+
+    The arrays returned by run() are overwritten by the next call with the same batch size; copy anything that must outlive it
+    '''
+    def __init__(self, session, max_batch=1):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.output_name = session.get_outputs()[0].name
+        input_shape = session.get_inputs()[0].shape[1:]
+        output_shape = session.get_outputs()[0].shape[1:]
+
+        self.inputs = {}
+        self.outputs = {}
+        self.bindings = {}
+        for batch_size in range(1, max_batch + 1):
+            self.inputs[batch_size] = np.zeros([batch_size] + list(input_shape), dtype=np.float32)
+            self.outputs[batch_size] = np.zeros([batch_size] + list(output_shape), dtype=np.float32)
+            binding = session.io_binding()
+            binding.bind_input(self.input_name, 'cpu', 0, np.float32, list(self.inputs[batch_size].shape), self.inputs[batch_size].ctypes.data)
+            binding.bind_output(self.output_name, 'cpu', 0, np.float32, list(self.outputs[batch_size].shape), self.outputs[batch_size].ctypes.data)
+            self.bindings[batch_size] = binding
+
+        self.num_calls = 0
+        self.total_call_s = 0
+        self.max_call_s = 0
+
+    def run(self, batch):
+        '''
+        :param batch: array of shape (batch_size, ...) matching the model input
+        :return: the model output for the batch, as a view of a preallocated array
+        '''
+        batch_size = len(batch)
+        np.copyto(self.inputs[batch_size], batch)
+
+        t1 = time.perf_counter()
+        self.session.run_with_iobinding(self.bindings[batch_size])
+        t_call = time.perf_counter() - t1
+
+        self.num_calls += 1
+        self.total_call_s += t_call
+        self.max_call_s = max(self.max_call_s, t_call)
+        return self.outputs[batch_size]
+
+    def get_stats(self):
+        return {'num_calls': self.num_calls,
+                'mean_call_ms': 1000 * self.total_call_s / max(self.num_calls, 1),
+                'max_call_ms': 1000 * self.max_call_s}
+
+
+def make_dynamic_batch_model(modelpath, outpath):
+    '''
+    Write a copy of an ONNX model with the first (batch) dimension of every input and output made dynamic. Requires the onnx package
+    '''
+    import onnx
+    model = onnx.load(modelpath)
+    for tensor in list(model.graph.input) + list(model.graph.output):
+        dim = tensor.type.tensor_type.shape.dim[0]
+        dim.ClearField('dim_value')
+        dim.dim_param = 'batch'
+    # intermediate shapes were inferred for batch 1; let the runtime infer them again
+    del model.graph.value_info[:]
+    onnx.save(model, outpath)
+
+def get_batch_model(modelpath):
+    '''
+    Return a path to a version of the model that accepts any batch size, creating it next to the original if needed. Returns None if that is not possible
+    '''
+    batch_modelpath = os.path.splitext(modelpath)[0] + '_dynamic_batch.onnx'
+    if os.path.exists(batch_modelpath):
+        return batch_modelpath
+
+    import onnxruntime as ort
+    batch_dim = ort.InferenceSession(modelpath, providers=['CPUExecutionProvider']).get_inputs()[0].shape[0]
+    if not isinstance(batch_dim, int): 
+        return modelpath
+    else:
+        try:
+            make_dynamic_batch_model(modelpath, batch_modelpath)
+        except ImportError:
+            return None
+    return batch_modelpath
 
-p = pyaudio.PyAudio()
 
 class AudioInference(object):
     PROCESSING_RATE = 16000 #Hz
@@ -51,39 +405,134 @@ class AudioInference(object):
     NUM_MFCC_PER_BIN = 64
     BIN_WINDOW_SIZE = int(PROCESSING_RATE * 0.025)
     BIN_WINDOW_STEP = int(PROCESSING_RATE * 0.01)
+    N_FFT = 512
+    NUM_MELS = 64
     LOGIT_THRESHOLD = 10 #12 #This is arbitrary
     SECONDS_PER_CHUNK = 0.5
-    def __init__(self, modeldir, modelname, rate=48000, data_format=pyaudio.paInt16, channels=1, device_index=1, labels_file='labels.yaml', output_queue=None):
+    SECONDS_PER_WINDOW = 1.0 # the model sees 1 second of audio, NUM_MFCC_BINS frames
+    SECONDS_OF_BUFFERING = 4 # capture can run this far ahead of inference before samples are dropped
+    def __init__(self, modeldir, modelname, rate=48000, channels=1, device_index=1, labels_file='labels.yaml', result_channel=None, streaming_features=False, hop_seconds=SECONDS_PER_CHUNK, max_batch=1, vad=False, vad_config=None, session_config=None, int8=False):
+        '''
+        :param result_channel: a KWSResultChannel to write every result to, e.g. for the vision application in another process
+        :param streaming_features: compute MFCC frames incrementally as chunks arrive instead of recomputing the whole 1 second window for each chunk
+        :param hop_seconds: time between the starts of consecutive 1 second windows. Smaller hops respond to commands sooner for more CPU
+        :param max_batch: windows that are waiting together are run as one batch of up to this size. Needs a model with a dynamic batch dimension, see make_dynamic_batch_model
+        :param vad: skip feature extraction and inference for windows with no voice activity
+        :param vad_config: dict of keyword arguments for VoiceActivityDetector to tune it, e.g. {'margin_db': 12}
+        :param session_config: dict of keyword arguments for create_kws_session, e.g. {'intra_op_threads': 1}
+        :param int8: load the statically quantized version of the model (modelname with an _int8 suffix), see quantize_kws_model
+        '''
         print('initialize AudioInference')
         self.rate=rate
-        self.format=data_format
         self.channels=channels
         self.device_index=device_index
-        self.output_queue = output_queue
+        self.result_channel = result_channel
+        self.streaming_features = streaming_features
+        self.hop_seconds = hop_seconds
+        self.max_batch = max_batch
+        self.use_vad = vad
+        self.vad_config = vad_config or {}
 
-        self.input_stream = None
+        self.source = None
 
+        if int8:
+            modelname = int8_model_name(modelname)
         modelpath = os.path.join(modeldir, modelname)
+        assert os.path.exists(modelpath), 'Could not find model file ' + modelpath
+        if max_batch > 1:
+            modelpath = get_batch_model(modelpath)
+            if modelpath is None:
+                print('Could not find or create a dynamic batch model; running windows one at a time')
+                modelpath = os.path.join(modeldir, modelname)
+                self.max_batch = 1
 
         with open(labels_file,'r') as f:
             self.word_labels = yaml.safe_load(f)['labels']
 
-        self.sess_options = ort.SessionOptions()
-        self.interpreter = interpreter = ort.InferenceSession(modelpath, providers=['CPUExecutionProvider'], provider_options=[{}], sess_options=self.sess_options)
+        self.interpreter, self.session_creation_s = create_kws_session(modelpath, **(session_config or {}))
         self.input_details = self.interpreter.get_inputs()
+        self.bound_session = BoundSession(self.interpreter, self.max_batch)
+        print('KWS session created in %.1f ms' % (self.session_creation_s * 1000))
+
+        # window, mel filterbank and DCT basis are computed once here rather than on every chunk
+        self.mfcc_engine = self.make_mfcc_engine(AudioInference.PROCESSING_RATE)
 
         
-    def setup(self):
+    def setup(self, source=None):
+        '''
+        Start capturing and processing audio
+
+        :param source: an AudioSource from audio_sources.py. Defaults to the microphone at self.device_index. The capture rate and channels are taken from the source
+        '''
         self.inference_session = None
+        if source is None:
+            source = MicrophoneSource(self.rate, self.channels, self.device_index)
+        self.source = source
+        self.rate = source.rate
+        self.channels = source.channels
+
+        self.hop_size = int(self.rate * self.hop_seconds)
+        self.window_size = int(self.rate * AudioInference.SECONDS_PER_WINDOW)
+        # most recent window_size samples of raw audio. Only complete once samples_seen reaches window_size
+        self.window_audio = np.zeros(self.window_size, dtype=np.int16)
+        self.samples_seen = 0
+        self.vad = VoiceActivityDetector(self.rate, window_seconds=AudioInference.SECONDS_PER_WINDOW, **self.vad_config) if self.use_vad else None
+        self.windows_skipped = 0
+        # set when the VAD skipped windows, so streaming features are missing frames and have to be rebuilt
+        self.features_stale = False
+        self.ring_buffer = AudioRingBuffer(int(self.rate * AudioInference.SECONDS_OF_BUFFERING) * self.channels)
+        self.input_overflows = 0
+        self.chunks_processed = 0
+        # (samples written so far, time.time()) per capture callback, to find when each window finished arriving
+        self.capture_log = deque()
+        self.num_windows = 0
+        self.total_latency_s = 0
+        self.max_latency_s = 0
+        # (window end in samples, capture time, result time, label) for each detected word
+        self.detections = []
+        # capture is typically an exact multiple of the processing rate (48 kHz -> 16 kHz), so a stateful decimator can carry filter state from one chunk to the next
+        self.resampler = PolyphaseDecimator(self.rate // AudioInference.PROCESSING_RATE) if self.rate % AudioInference.PROCESSING_RATE == 0 else None
+        self.feature_extractor = StreamingFeatureExtractor(sr=AudioInference.PROCESSING_RATE, n_frames=AudioInference.NUM_MFCC_BINS, n_fft=AudioInference.N_FFT, win_length=AudioInference.BIN_WINDOW_SIZE, hop_length=AudioInference.BIN_WINDOW_STEP, n_mels=AudioInference.NUM_MELS, n_mfcc=AudioInference.NUM_MFCC_PER_BIN) if self.streaming_features else None
+
+        # features and inference run in their own thread so the audio callback only has to copy samples
+        self.running = True
+        self.worker = threading.Thread(target=self.inference_worker, daemon=True)
+        self.worker.start()
 
-        chunk_size = int(self.rate * AudioInference.SECONDS_PER_CHUNK)
-        self.last_chunk = None
         print('open input audio stream')
-        self.input_stream = p.open(rate=self.rate, channels=self.channels, format=self.format, input=True, input_device_index=self.device_index, output=False, stream_callback=self.inference_callback, frames_per_buffer=chunk_size)
+        self.source.start(self.capture, frames_per_buffer=self.hop_size)
         print('opened..')
+        if self.result_channel is not None:
+            self.result_channel.publish_labels(self.word_labels)
 
     def stop(self):
-        self.input_stream.close()
+        self.source.stop()
+        # let the worker finish any complete hops that were already captured
+        while self.worker.is_alive() and self.ring_buffer.backlog() >= self.hop_size * self.channels:
+            time.sleep(0.01)
+        self.running = False
+        self.worker.join()
+
+    def get_stats(self):
+        '''
+        Counters for how well inference is keeping up with capture
+        '''
+        return {'session_creation_ms': self.session_creation_s * 1000,
+                'inference': self.bound_session.get_stats(),
+                'chunks_processed': self.chunks_processed,
+                'windows_skipped': self.windows_skipped,
+                'skip_rate': self.windows_skipped / max(self.chunks_processed, 1),
+                'backlog_samples': self.ring_buffer.backlog(),
+                'max_backlog_samples': self.ring_buffer.max_backlog,
+                'ring_overruns': self.ring_buffer.overruns,
+                'dropped_samples': self.ring_buffer.dropped_samples,
+                'input_overflows': self.input_overflows,
+                'mean_latency_ms': 1000 * self.total_latency_s / max(self.num_windows, 1),
+                'max_latency_ms': 1000 * self.max_latency_s}
+
+    @classmethod
+    def make_mfcc_engine(cls, sr=PROCESSING_RATE):
+        return MFCCEngine(sr=sr, n_fft=cls.N_FFT, win_length=cls.BIN_WINDOW_SIZE, hop_length=cls.BIN_WINDOW_STEP, n_mels=cls.NUM_MELS, n_mfcc=cls.NUM_MFCC_PER_BIN)
 
     def calculate_features(self, audio_data, sr=PROCESSING_RATE):
         '''
@@ -91,92 +540,256 @@ class AudioInference(object):
 
         It is important these parameters match preprocessing parameters/steps during training
         '''
-        n_fft = 512
-        n_mels = 64
-        n_mfcc = 64
-
-        melspec = librosa.feature.melspectrogram(y=audio_data, sr=sr, n_fft=n_fft, win_length=AudioInference.BIN_WINDOW_SIZE,  hop_length=AudioInference.BIN_WINDOW_STEP,  n_mels=n_mels,  power=2, center=True, htk=True, norm=None)
-    
-        # print(melspec)
-        # S = lr.power_to_db(melspec)
-        S = np.log(melspec + 1e-6)
+        if sr != self.mfcc_engine.sr:
+            self.mfcc_engine = self.make_mfcc_engine(sr)
 
-        mfcc = librosa.feature.mfcc(S=S, norm='ortho', n_mfcc=n_mfcc)
+        mfcc = self.mfcc_engine.mfcc(audio_data)
         return mfcc
         
     def run_inference(self, mfcc):
 
-        #add a dimension
-        mfcc = mfcc[None,:]
-        # t1 = time.time_ns()//1000/1000
-        result = self.interpreter.run(None, {self.input_details[0].name: mfcc})
-        # t2 = time.time_ns()//1000/1000
-        # print("Inference Time is %0.3f ms" % (t2-t1))
+        #add a dimension. Copy the output since the bound session reuses its buffer on the next call
+        result = [self.bound_session.run(mfcc[None,:]).copy()]
 
         if np.max(result[0][0,:]) > AudioInference.LOGIT_THRESHOLD:
             best_class = int(np.argmax(result[0][0,:]))
         else: best_class = -1
         return best_class, result
+
+    def run_inference_batch(self, mfccs):
+        '''
+        Run inference on a stack of windows at once
+
+        :param mfccs: array of shape (num_windows, NUM_MFCC_PER_BIN, NUM_MFCC_BINS)
+        :return: list of (best_class, result) per window in the same format as run_inference
+        '''
+        if self.max_batch <= 1:
+            return [self.run_inference(mfcc) for mfcc in mfccs]
+
+        logits = self.bound_session.run(mfccs).copy()
+
+        results = []
+        for i in range(len(mfccs)):
+            if np.max(logits[i]) > AudioInference.LOGIT_THRESHOLD:
+                best_class = int(np.argmax(logits[i]))
+            else: best_class = -1
+            results.append((best_class, [logits[i:i+1]]))
+        return results
     
     def convert_audio_for_features(self, raw_input, input_rate, output_rate=PROCESSING_RATE):
-        audio_data = raw_input / max([np.max(raw_input),abs(np.min(raw_input))]) #normalize to [-1:1]
+        # the peak is taken in float: int() would truncate the peak of float audio, and abs() of the most negative int16 overflows
+        peak = float(np.abs(raw_input.astype(np.float32)).max()) if len(raw_input) > 0 else 0.
+        audio_data = raw_input / peak if peak > 0 else raw_input.astype(np.float64) #normalize to [-1:1]; silence is left as is
             
-        audio_resample = librosa.resample(audio_data.astype(np.float32), orig_sr=input_rate, target_sr=output_rate)
+        if input_rate % output_rate == 0:
+            audio_resample = PolyphaseDecimator.decimate(audio_data, input_rate // output_rate)
+        else:
+            import librosa
+            audio_resample = librosa.resample(audio_data.astype(np.float32), orig_sr=input_rate, target_sr=output_rate)
 
         return audio_resample
 
+    def prepare_clip(self, audio_data, sr):
+        '''
+        Normalize and resample a recorded clip, then pad or trim it to the 1 second window the model expects
+        '''
+        audio_resample = self.convert_audio_for_features(audio_data, sr)
+        window_size = int(AudioInference.PROCESSING_RATE * AudioInference.SECONDS_PER_WINDOW)
+        return np.pad(audio_resample[:window_size], (0, max(0, window_size - len(audio_resample))))
 
-    def inference_callback(self, audio_buffer, frame_count, time_info, flag):
+    def calculate_features_streaming(self, audio_chunk):
         '''
-        pyaudio compliant callback function (most inputs ignored)
+        Push the newest chunk through the streaming feature extractor and assemble features for the window ending with it. 
+
+        The chunk is resampled without normalization; normalization to the peak of the full window (self.window_audio, which already includes this chunk) is applied when the window is assembled. Both steps are linear, so this matches normalizing first
 
-        Take audio, resample, extract features, run inference, and pass the result through a queue
+        With the polyphase decimator the features match calculate_features on the whole window: the samples that the filter delay holds back end the window, and its start is resampled from zeros before it as the window path does
         '''
-        if self.last_chunk is None:
-            print('Skipping first chunk... typically takes a moment for librosa to initialize')
+        audio_data = np.asarray(audio_chunk, dtype=np.int16)
+        pending, head = None, None
+        if self.resampler is not None:
+            self.feature_extractor.push(self.resampler.process(audio_data))
+            pending = self.resampler.flush()
+            head = self.resampler.clip_head(self.window_audio)
         else:
+            import librosa
+            self.feature_extractor.push(librosa.resample(audio_data.astype(np.float32), orig_sr=self.rate, target_sr=AudioInference.PROCESSING_RATE))
+
+        # same normalization as convert_audio_for_features, which also works for float audio with a peak below 1
+        window_peak = float(np.abs(self.window_audio.astype(np.float32)).max())
+
+        return self.feature_extractor.get_features(scale=1/window_peak if window_peak > 0 else 1, pending=pending, head=head)
+
+
+    def capture(self, audio_buffer, overflowed=False, block=False):
+        '''
+        Callback for the audio source
+
+        Only copies the captured samples into the ring buffer; everything else happens in inference_worker
+        '''
+        if overflowed:
+            self.input_overflows += 1
+        if self.ring_buffer.write(audio_buffer, block=block):
+            self.capture_log.append((self.ring_buffer.write_count, time.time()))
+
+    def capture_time(self, sample_index):
+        '''
+        time.time() at which the sample at sample_index (counting all samples read from the ring buffer) was captured. Called from the worker, which reads samples in order
+        '''
+        while len(self.capture_log) > 1 and self.capture_log[0][0] < sample_index:
+            self.capture_log.popleft()
+        return self.capture_log[0][1] if len(self.capture_log) > 0 else time.time()
+
+    def inference_worker(self):
+        '''
+        Pull chunks from the ring buffer and process them until stop() is called
+        '''
+        hop_samples = self.hop_size * self.channels
+        while self.running:
+            hop = self.ring_buffer.read(hop_samples, timeout=0.5)
+            if hop is None: continue
+
+            # anything else already waiting goes into the same batch
+            hops = [hop]
+            while len(hops) < self.max_batch and self.ring_buffer.backlog() >= hop_samples:
+                hops.append(self.ring_buffer.read(hop_samples))
+            self.process_hops(hops)
+
+    def process_hops(self, hops):
+        '''
+        Take audio, resample, extract features, run inference, and pass the results to the result channel
+
+        :param hops: list of int16 numpy arrays, each the next hop_seconds of audio. Each hop completes one window, and all windows are run through the model as one batch
+        '''
+        mfccs = []
+        capture_times = []
+        window_ends = []
+        for hop in hops:
+            self.window_audio = np.concatenate([self.window_audio[len(hop):], hop])
+            self.samples_seen += len(hop)
+            self.chunks_processed += 1
+
+            if self.vad is not None and not self.vad.update(hop):
+                # nothing that could be speech anywhere in this window
+                self.windows_skipped += 1
+                self.features_stale = True
+                continue
+
             # t1 = time.time_ns()//1000/1000
-            audio_data = np.frombuffer(self.last_chunk+audio_buffer, dtype=np.int16)
-            audio_resample = self.convert_audio_for_features(audio_data, input_rate = self.rate, output_rate=AudioInference.PROCESSING_RATE)
-           
-            mfcc = self.calculate_features(audio_resample)
-            
+            if self.feature_extractor is not None and self.features_stale:
+                # frames were not computed while the VAD was skipping windows. Rebuild the history from the raw window
+                if self.resampler is not None: self.resampler.reset()
+                self.feature_extractor.reset()
+                mfcc = self.calculate_features_streaming(self.window_audio)
+                self.features_stale = False
+            elif self.feature_extractor is not None:
+                # always push so the window history is there once it fills
+                mfcc = self.calculate_features_streaming(hop)
+            elif self.samples_seen >= self.window_size:
+                audio_resample = self.convert_audio_for_features(self.window_audio, input_rate = self.rate, output_rate=AudioInference.PROCESSING_RATE)
+                mfcc = self.calculate_features(audio_resample)
+
+            if self.samples_seen < self.window_size:
+                print('Skipping partial window... waiting on the first second of audio')
+                continue
             # t2 = time.time_ns()//1000/1000
             # print("Preprocess Time is %0.3f ms" % (t2-t1))
+            mfccs.append(mfcc)
+            window_ends.append(self.samples_seen // self.channels)
+            capture_times.append(self.capture_time(self.samples_seen))
 
-            best_class, class_logits = self.run_inference(mfcc)
+        if len(mfccs) == 0: return
+
+        results = self.run_inference_batch(np.stack(mfccs))
+        t_result = time.time()
+        for (best_class, class_logits), window_end, t_capture in zip(results, window_ends, capture_times):
             class_name = 'unknown' if best_class < 0 else self.word_labels[best_class]
+            self.num_windows += 1
+            self.total_latency_s += t_result - t_capture
+            self.max_latency_s = max(self.max_latency_s, t_result - t_capture)
+            if best_class >= 0:
+                self.detections.append((window_end, t_capture, t_result, class_name))
             
 
             print('******detected speech: ' + class_name + '******\n')
-            if self.output_queue is not None:
-                print('adding kws to queue')
-                try:
-                    self.output_queue.put_nowait((class_logits, self.word_labels))
-                except queue.Full:
-                    self.output_queue.get()
-                    self.output_queue.put_nowait((class_logits, self.word_labels))
+            if self.result_channel is not None:
+                self.result_channel.write(best_class, np.max(class_logits[0]), t_capture)
+
+# audio_data = stream.read(num_frames=input_rate*seconds_per_run, exception_on_overflow = False)
 
-        self.last_chunk = audio_buffer
+def add_inference_arguments(parser, prefix='', streaming=False, max_batch=1, intra_op_threads=0):
+    '''
+    Add command line options for how AudioInference runs on live audio. inference_options turns the parsed arguments into AudioInference keyword arguments
 
-        return self.last_chunk, pyaudio.paContinue
+    :param prefix: put before each option name, e.g. 'kws-' in an application with options of its own
+    :param streaming, max_batch, intra_op_threads: this application's defaults
+    '''
+    parser.add_argument(f'--{prefix}streaming', default=streaming, action=argparse.BooleanOptionalAction, help='compute MFCC frames incrementally as audio arrives instead of over the whole window for each hop')
+    parser.add_argument(f'--{prefix}max-batch', default=max_batch, type=int, help='run windows that queue up as one batch of up to this size')
+    parser.add_argument(f'--{prefix}threads', default=intra_op_threads, type=int, help='onnxruntime intra-op threads for the model. 0 uses every core')
+    parser.add_argument(f'--{prefix}session-cache', default=None, help='directory to cache the optimized model graph in, so later startups skip graph optimization, e.g. ~/.cache/kws. Not cached by default')
+    parser.add_argument(f'--{prefix}vad', action='store_true', help='skip windows without voice activity (energy and zero-crossing gate). Saves CPU in quiet rooms, but quiet commands may be missed; tune with the other vad options')
+    parser.add_argument(f'--{prefix}vad-margin-db', default=None, type=float, help='with vad, energy above the noise floor for audio to count as voice. Default %.1f' % VoiceActivityDetector.MARGIN_DB)
+    parser.add_argument(f'--{prefix}vad-unvoiced-zcr', default=None, type=float, help='with vad, zero-crossing rate above which half the margin is enough. Default %.2f' % VoiceActivityDetector.UNVOICED_ZCR)
+    parser.add_argument(f'--{prefix}vad-floor-rise', default=None, type=float, help='with vad, how fast the noise floor follows louder audio, as a fraction per 10 ms. Default %.3f' % VoiceActivityDetector.FLOOR_RISE)
 
-# audio_data = stream.read(num_frames=input_rate*seconds_per_run, exception_on_overflow = False)
+def inference_options(args, prefix=''):
+    '''
+    AudioInference keyword arguments from options added by add_inference_arguments with the same prefix
+    '''
+    get = lambda name: getattr(args, (prefix + name).replace('-', '_'))
+    vad_config = {key: get('vad-' + name) for key, name in (('margin_db', 'margin-db'), ('unvoiced_zcr', 'unvoiced-zcr'), ('floor_rise', 'floor-rise')) if get('vad-' + name) is not None}
+    return {'streaming_features': get('streaming'), 'max_batch': get('max-batch'), 'vad': get('vad'), 'vad_config': vad_config, 'session_config': {'intra_op_threads': get('threads'), 'cache_dir': os.path.expanduser(get('session-cache')) if get('session-cache') else None}}
 
-def main(modeldir, modelname):
-    print('main')
-    audio = AudioInference(modeldir=modeldir, modelname=modelname, device_index=1, )
-    audio.setup()
+def main(modeldir, modelname, source=None, duration=None, hop_seconds=AudioInference.SECONDS_PER_CHUNK, inference_kwargs=None):
+    '''
+    Run KWS on the microphone, or on another audio source until it finishes or duration seconds pass. Prints throughput and latency at the end
 
-    while (audio.input_stream.is_active()): time.sleep(5)
+    :param inference_kwargs: more AudioInference keyword arguments, e.g. from inference_options
+    '''
+    print('main')
+    audio = AudioInference(modeldir=modeldir, modelname=modelname, device_index=1, hop_seconds=hop_seconds, **(inference_kwargs or {}))
+    audio.setup(source)
 
+    t_start = time.time()
+    try:
+        while audio.source.is_active() and (duration is None or time.time() - t_start < duration): 
+            time.sleep(0.1 if duration is not None or source is not None else 5)
+    except KeyboardInterrupt: pass
     audio.stop()
+    report_run(audio, time.time() - t_start)
+
+def report_run(audio_inf, t_total):
+    '''
+    Print throughput and latency for a finished run, including end-to-end command latency if the source inserted known clips
+    '''
+    stats = audio_inf.get_stats()
+    audio_seconds = audio_inf.samples_seen / audio_inf.channels / audio_inf.rate
+    print('\n**** KWS Run ****')
+    print('---- %.1f s of audio in %.1f s (%.1fx real time), %d windows, %.1f windows/s' % (audio_seconds, t_total, audio_seconds / t_total, audio_inf.num_windows, audio_inf.num_windows / t_total))
+    print('---- capture to result latency (ms): avg %.1f, max %.1f' % (stats['mean_latency_ms'], stats['max_latency_ms']))
+    print('---- skipped windows %d, overruns %d, dropped samples %d' % (stats['windows_skipped'], stats['ring_overruns'], stats['dropped_samples']))
 
-def test_on_file(modeldir, modelname):
+    clip_ends = getattr(audio_inf.source, 'clip_end_positions', [])
+    if len(clip_ends) > 0:
+        # the first detection whose window ends after most of the clip has played
+        clip_length = len(audio_inf.source.clip)
+        latencies = []
+        for clip_end in clip_ends:
+            matches = [d for d in audio_inf.detections if clip_end - clip_length / 2 <= d[0] < clip_end + audio_inf.window_size]
+            if len(matches) == 0: continue
+            window_end, t_capture, t_result, _ = matches[0]
+            latencies.append((window_end - clip_end) / audio_inf.rate + t_result - t_capture)
+        print('---- detected %d of %d inserted clips' % (len(latencies), len(clip_ends)))
+        if len(latencies) > 0:
+            print('---- end of clip to detection latency (ms): avg %.1f, max %.1f' % (1000 * np.mean(latencies), 1000 * np.max(latencies)))
+    print("-----------------------\n")
+
+def test_on_file(modeldir, modelname, wavfile='down_0c40e715_nohash_0.wav'):
     import soundfile
     audio_inf = AudioInference(modeldir=modeldir, modelname=modelname, device_index=1, )
 
-    audio_data, sr = soundfile.read('no_0cb74144_nohash_1.wav')
+    audio_data, sr = soundfile.read(wavfile)
 
 
     audio_resampled = audio_inf.convert_audio_for_features(audio_data, sr)
@@ -186,5 +799,289 @@ def test_on_file(modeldir, modelname):
     class_name = 'unknown' if best_class < 0 else audio_inf.word_labels[best_class]    
     print('******\ndetected class: ' + class_name + '\n******')
 
+def test_resampler_on_files(modeldir, modelname, wavfiles, capture_rate=48000):
+    '''
+    Check that KWS results do not change when the polyphase decimator replaces librosa.resample. 
+    Each 16 kHz clip is upsampled to capture_rate to mimic the microphone, then brought back down with librosa, with decimate() on the whole clip, and with process() on hop sized chunks as live audio is
+    '''
+    import soundfile
+    import librosa
+    audio_inf = AudioInference(modeldir=modeldir, modelname=modelname, rate=capture_rate)
+
+    num_same = 0
+    for wavfile in wavfiles:
+        audio_data, sr = soundfile.read(wavfile, dtype='float32')
+        capture_data = librosa.resample(audio_data, orig_sr=sr, target_sr=capture_rate)
+        capture_data = capture_data / np.max(np.abs(capture_data))
+
+        librosa_class, _ = audio_inf.run_inference(audio_inf.calculate_features(librosa.resample(capture_data, orig_sr=capture_rate, target_sr=sr)))
+        decimator_class, _ = audio_inf.run_inference(audio_inf.calculate_features(audio_inf.convert_audio_for_features(capture_data, capture_rate, sr)))
+        decimator = PolyphaseDecimator(capture_rate // sr)
+        hop_size = int(capture_rate * audio_inf.hop_seconds)
+        streamed = [decimator.process(capture_data[start:start + hop_size]) for start in range(0, len(capture_data), hop_size)]
+        stream_class, _ = audio_inf.run_inference(audio_inf.calculate_features(np.concatenate(streamed + [decimator.flush()])))
+
+        num_same += librosa_class == decimator_class == stream_class
+        print('%s: librosa -> %s, decimator -> %s, streamed decimator -> %s' % (wavfile, librosa_class, decimator_class, stream_class))
+
+    print('******\n%d of %d clips give the same result\n******' % (num_same, len(wavfiles)))
+    return num_same == len(wavfiles)
+
+def benchmark_batch(modeldir, modelname, batch_sizes=(1,4,8), num_iters=100):
+    '''
+    Measure model cost per window when windows are run in batches of different sizes
+    '''
+    audio_inf = AudioInference(modeldir=modeldir, modelname=modelname, max_batch=max(batch_sizes))
+    for batch_size in batch_sizes:
+        mfccs = np.random.randn(batch_size, AudioInference.NUM_MFCC_PER_BIN, AudioInference.NUM_MFCC_BINS).astype(np.float32)
+        audio_inf.run_inference_batch(mfccs)
+        t1 = time.perf_counter()
+        for _ in range(num_iters):
+            audio_inf.run_inference_batch(mfccs)
+        per_window = (time.perf_counter() - t1) / num_iters / batch_size
+        print('---- batch size %d: %.3f ms per window' % (batch_size, per_window * 1000))
+
+def label_from_path(wavfile, labels):
+    '''
+    Ground truth label for a Speech Commands style clip: either the directory it is in (e.g. down/0c40e715_nohash_0.wav) or the start of the filename (e.g. down_0c40e715_nohash_0.wav). None if neither is a known label
+    '''
+    dirname = os.path.basename(os.path.dirname(os.path.abspath(wavfile)))
+    if dirname in labels: return dirname
+    prefix = os.path.basename(wavfile).split('_')[0]
+    if prefix in labels: return prefix
+    return None
+
+def find_wav_files(wavdir, labels=None):
+    '''
+    All wav files under wavdir, sorted. If labels are given, only clips whose label can be found with label_from_path
+    '''
+    wavfiles = []
+    for root, _, files in os.walk(wavdir):
+        wavfiles += [os.path.join(root, f) for f in files if f.lower().endswith('.wav')]
+    if labels is not None:
+        wavfiles = [w for w in wavfiles if label_from_path(w, labels) is not None]
+    return sorted(wavfiles)
+
+def _init_eval_worker(modeldir, modelname, labels_file, int8):
+    global _eval_audio_inf
+    # one onnxruntime thread per process, since the pool already has a process per core
+    _eval_audio_inf = AudioInference(modeldir=modeldir, modelname=modelname, labels_file=labels_file, session_config={'intra_op_threads': 1}, int8=int8)
+
+def _evaluate_clip(wavfile):
+    '''
+    Run one clip through the same path as live audio. Runs in a worker process of evaluate_directory
+    '''
+    import soundfile
+    audio_data, sr = soundfile.read(wavfile, dtype='float32')
+    if audio_data.ndim > 1: audio_data = audio_data[:,0]
+
+    t1 = time.perf_counter()
+    audio_resample = _eval_audio_inf.prepare_clip(audio_data, sr)
+    t2 = time.perf_counter()
+    mfcc = _eval_audio_inf.calculate_features(audio_resample)
+    t3 = time.perf_counter()
+    best_class, _ = _eval_audio_inf.run_inference(mfcc)
+    t4 = time.perf_counter()
+
+    return wavfile, best_class, (t2 - t1, t3 - t2, t4 - t3)
+
+def evaluate_directory(wavdir, modeldir='.', modelname='matchboxnet.onnx', labels_file='labels.yaml', jobs=None, confusion_csv=None, int8=False):
+    '''
+    Evaluate the KWS pipeline on every wav file under wavdir, without a microphone. Reports throughput, per-stage latency, accuracy per label and a confusion matrix
+
+    :param jobs: number of worker processes. Defaults to the number of CPUs
+    :param confusion_csv: optionally write the full confusion matrix here. Rows are true labels and columns are predictions; the last column is 'unknown' (below LOGIT_THRESHOLD)
+    :param int8: evaluate the quantized model instead
+    '''
+    import multiprocessing as mp
+
+    with open(labels_file,'r') as f:
+        labels = yaml.safe_load(f)['labels']
+
+    wavfiles = find_wav_files(wavdir, labels)
+    if len(wavfiles) == 0:
+        print('No labelled wav files found under ' + wavdir)
+        return None
+    print('Evaluating %d clips' % len(wavfiles))
+
+    t_start = time.perf_counter()
+    with mp.Pool(jobs, initializer=_init_eval_worker, initargs=(modeldir, modelname, labels_file, int8)) as pool:
+        results = pool.map(_evaluate_clip, wavfiles, chunksize=8)
+    t_total = time.perf_counter() - t_start
+
+    # one extra column for clips that were not confidently classified
+    confusion = np.zeros((len(labels), len(labels) + 1), dtype=np.int64)
+    stage_times = np.zeros((len(results), 3))
+    for i, (wavfile, best_class, times) in enumerate(results):
+        confusion[labels.index(label_from_path(wavfile, labels)), best_class] += 1
+        stage_times[i] = times
+
+    print('\n**** KWS Evaluation ****')
+    print('---- %d clips in %.2f s: %.1f clips/s with %d processes' % (len(results), t_total, len(results) / t_total, jobs or mp.cpu_count()))
+    for i, stage in enumerate(['convert/resample', 'features', 'inference']):
+        p50, p90, p99 = np.percentile(stage_times[:,i] * 1000, [50, 90, 99])
+        print('---- %s time (ms): p50 %.3f, p90 %.3f, p99 %.3f' % (stage, p50, p90, p99))
+
+    num_correct = int(np.trace(confusion[:, :len(labels)]))
+    print('---- accuracy: %.2f%% (%d of %d)' % (100 * num_correct / len(results), num_correct, len(results)))
+    col_names = labels + ['unknown']
+    for i, label in enumerate(labels):
+        total = confusion[i].sum()
+        if total == 0: continue
+        mistakes = ', '.join(['%s=%d' % (col_names[j], confusion[i,j]) for j in np.nonzero(confusion[i])[0] if j != i])
+        print('     %-10s %6.2f%% of %d   %s' % (label, 100 * confusion[i,i] / total, total, mistakes))
+    print("-----------------------\n")
+
+    if confusion_csv is not None:
+        with open(confusion_csv, 'w') as f:
+            f.write('true\\predicted,' + ','.join(col_names) + '\n')
+            for i, label in enumerate(labels):
+                f.write(label + ',' + ','.join(str(c) for c in confusion[i]) + '\n')
+
+    return confusion
+
+def benchmark_sessions(modeldir, modelname, thread_counts=(1,2,4), optimization_levels=('disable','basic','extended','all'), num_iters=200):
+    '''
+    Report session creation time (first and cached startup) and per-call latency for combinations of session settings, to choose settings for a given SoC. 
+    The optimized graphs are cached in a temporary directory, so nothing is left next to the model
+    '''
+    import tempfile
+    modelpath = os.path.join(modeldir, modelname)
+    mfcc = np.random.randn(1, AudioInference.NUM_MFCC_PER_BIN, AudioInference.NUM_MFCC_BINS).astype(np.float32)
+    for level in optimization_levels:
+        for threads in thread_counts:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                _, t_first = create_kws_session(modelpath, intra_op_threads=threads, optimization_level=level, cache_dir=cache_dir)
+                session, t_cached = create_kws_session(modelpath, intra_op_threads=threads, optimization_level=level, cache_dir=cache_dir)
+            bound = BoundSession(session)
+            for _ in range(10): bound.run(mfcc)
+            bound = BoundSession(session)
+            for _ in range(num_iters): bound.run(mfcc)
+            stats = bound.get_stats()
+            print('---- %-8s optimization, %d threads: create %.1f ms (cached %.1f ms), call %.3f ms (max %.3f ms)' % (level, threads, t_first * 1000, t_cached * 1000, stats['mean_call_ms'], stats['max_call_ms']))
+
+def int8_model_name(modelname):
+    return os.path.splitext(modelname)[0] + '_int8.onnx'
+
+def quantize_kws_model(modeldir, modelname, calibration_dir, max_clips=500):
+    '''
+    Write a statically quantized int8 version of the KWS model (see int8_model_name), calibrated on features from the wav files under calibration_dir. 
+    Requires the onnx package. Weights are int8 per channel and activations uint8, in QDQ format, which onnxruntime runs with int8 kernels on Arm and x86 CPUs
+    '''
+    import tempfile
+    import soundfile
+    import onnx
+    from onnx import version_converter
+    from onnxruntime.quantization import quantize_static, CalibrationDataReader, QuantFormat, QuantType
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    modelpath = os.path.join(modeldir, modelname)
+    outpath = os.path.join(modeldir, int8_model_name(modelname))
+    wavfiles = find_wav_files(calibration_dir)[:max_clips]
+    assert len(wavfiles) > 0, 'No wav files found for calibration under ' + calibration_dir
+
+    audio_inf = AudioInference(modeldir=modeldir, modelname=modelname)
+    input_name = audio_inf.input_details[0].name
+
+    class KWSCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self.wavfiles = iter(wavfiles)
+        def get_next(self):
+            wavfile = next(self.wavfiles, None)
+            if wavfile is None: return None
+            audio_data, sr = soundfile.read(wavfile, dtype='float32')
+            if audio_data.ndim > 1: audio_data = audio_data[:,0]
+            mfcc = audio_inf.calculate_features(audio_inf.prepare_clip(audio_data, sr))
+            return {input_name: mfcc[None,:].astype(np.float32)}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # start from the dynamic batch version, since preprocessing folds a fixed batch size into constants and the int8 model could never be batched
+        model = onnx.load(get_batch_model(modelpath))
+        # per-channel quantization needs opset 13 or newer
+        opset = max([o.version for o in model.opset_import if o.domain in ('', 'ai.onnx')])
+        if opset < 13:
+            model = version_converter.convert_version(model, 13)
+        onnx.save(model, os.path.join(tmpdir, 'model.onnx'))
+        quant_pre_process(os.path.join(tmpdir, 'model.onnx'), os.path.join(tmpdir, 'model_pre.onnx'), skip_symbolic_shape=True)
+
+        print('Calibrating on %d clips' % len(wavfiles))
+        quantize_static(os.path.join(tmpdir, 'model_pre.onnx'), outpath, KWSCalibrationReader(), quant_format=QuantFormat.QDQ, per_channel=True, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    print('Wrote ' + outpath)
+    return outpath
+
+def compare_int8(wavdir, modeldir='.', modelname='matchboxnet.onnx'):
+    '''
+    Run the fp32 and int8 KWS models on the same clips. Reports how often their top-1 classes agree, with and without LOGIT_THRESHOLD applied, and the per-inference latency of each
+    '''
+    import soundfile
+    wavfiles = find_wav_files(wavdir)
+    assert len(wavfiles) > 0, 'No wav files found under ' + wavdir
+
+    fp32_inf = AudioInference(modeldir=modeldir, modelname=modelname, session_config={'intra_op_threads': 1})
+    int8_inf = AudioInference(modeldir=modeldir, modelname=modelname, session_config={'intra_op_threads': 1}, int8=True)
+
+    num_argmax_same = 0
+    num_class_same = 0
+    for wavfile in wavfiles:
+        audio_data, sr = soundfile.read(wavfile, dtype='float32')
+        if audio_data.ndim > 1: audio_data = audio_data[:,0]
+        mfcc = fp32_inf.calculate_features(fp32_inf.prepare_clip(audio_data, sr))
+
+        fp32_class, fp32_logits = fp32_inf.run_inference(mfcc)
+        int8_class, int8_logits = int8_inf.run_inference(mfcc)
+        num_argmax_same += np.argmax(fp32_logits[0]) == np.argmax(int8_logits[0])
+        num_class_same += fp32_class == int8_class
+
+    fp32_stats = fp32_inf.bound_session.get_stats()
+    int8_stats = int8_inf.bound_session.get_stats()
+    print('\n**** fp32 vs int8 KWS ****')
+    print('---- %d clips' % len(wavfiles))
+    print('---- top-1 agreement: %.2f%% (%.2f%% after logit threshold)' % (100 * num_argmax_same / len(wavfiles), 100 * num_class_same / len(wavfiles)))
+    print('---- fp32 inference time (ms): avg %.3f, max %.3f' % (fp32_stats['mean_call_ms'], fp32_stats['max_call_ms']))
+    print('---- int8 inference time (ms): avg %.3f, max %.3f' % (int8_stats['mean_call_ms'], int8_stats['max_call_ms']))
+    print("-----------------------\n")
+    return num_argmax_same / len(wavfiles)
+
 if __name__ == '__main__':
-    main('.', 'matchboxnet.onnx')
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model', default='matchboxnet.onnx', help='KWS model file in the current directory')
+    parser.add_argument('--benchmark-batch', action='store_true', help='time the model at batch sizes 1, 4 and 8 instead of running live on the microphone')
+    parser.add_argument('--benchmark-session', action='store_true', help='compare onnxruntime thread counts and optimization levels instead of running live on the microphone')
+    parser.add_argument('--quantize', default=None, help='directory of wav files to calibrate an int8 version of the model with. Writes the model with an _int8 suffix')
+    parser.add_argument('--compare-int8', default=None, help='directory of wav files to compare the fp32 and int8 models on')
+    parser.add_argument('-e', '--evaluate', default=None, help='directory of Speech Commands style wav files (label as directory name or filename prefix) to evaluate instead of running live on the microphone')
+    parser.add_argument('-j', '--jobs', default=None, type=int, help='number of processes for --evaluate. Defaults to the number of CPUs')
+    parser.add_argument('--confusion-csv', default=None, help='with --evaluate, write the full confusion matrix to this csv file')
+    parser.add_argument('--replay', default=None, help='run on a wav (or raw int16) file instead of the microphone')
+    parser.add_argument('--synthetic', default=None, type=float, help='run on this many seconds of generated noise instead of the microphone. Use --clip to insert a command word every few seconds')
+    parser.add_argument('--clip', default=None, help='with --synthetic, a wav file to insert every 3 seconds for measuring command latency')
+    parser.add_argument('--max-speed', action='store_true', help='with --replay or --synthetic, deliver audio as fast as it is processed instead of in real time')
+    parser.add_argument('--loop', action='store_true', help='with --replay, repeat the file until interrupted, e.g. for soak tests')
+    parser.add_argument('--int8', action='store_true', help='use the int8 model made by --quantize for --evaluate or live inference')
+    parser.add_argument('--hop', default=AudioInference.SECONDS_PER_CHUNK, type=float, help='seconds between the starts of consecutive windows for live inference')
+    add_inference_arguments(parser)
+    args = parser.parse_args()
+
+    if args.benchmark_batch:
+        benchmark_batch('.', args.model)
+    elif args.benchmark_session:
+        benchmark_sessions('.', args.model)
+    elif args.quantize:
+        quantize_kws_model('.', args.model, args.quantize)
+    elif args.compare_int8:
+        compare_int8(args.compare_int8, '.', args.model)
+    elif args.evaluate:
+        evaluate_directory(args.evaluate, '.', args.model, jobs=args.jobs, confusion_csv=args.confusion_csv, int8=args.int8)
+    else:
+        source = None
+        if args.replay:
+            source = FileSource(args.replay, realtime=not args.max_speed, loop=args.loop)
+        elif args.synthetic:
+            clip = None
+            if args.clip:
+                import librosa
+                clip_source = FileSource(args.clip)
+                clip = librosa.resample(clip_source.samples.astype(np.float32), orig_sr=clip_source.rate, target_sr=48000).astype(np.int16)
+            source = SyntheticSource(48000, duration=args.synthetic, clip=clip, realtime=not args.max_speed)
+        main('.', int8_model_name(args.model) if args.int8 else args.model, source, hop_seconds=args.hop, inference_kwargs=inference_options(args))
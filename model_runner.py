@@ -34,15 +34,28 @@ This file manages the deep learning model. It has been tested on a few models li
 
 import os
 import math
+import time
+import hashlib
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import onnxruntime
-import tflite_runtime.interpreter as tfl
 
 import cv2 as cv
 import yaml
 
 onnxruntime.set_default_logger_severity(3) #suppress some warnings that the logger prints
 
+# one row per detection that survives post-processing. box is x1,y1,x2,y2 in image pixels
+DETECTION_DTYPE = np.dtype([('box', np.int32, (4,)), ('score', np.float32), ('label', np.int32)])
+
+# stands in for onnxruntime's NodeArg when input/output details come from the ONNX graph instead of a session
+TensorDetails = namedtuple('TensorDetails', ['name', 'type', 'shape'])
+
+# written into the model directory by ModelRunner.load_model_layout
+LAYOUT_CACHE_FILE = 'io_layout_cache.yaml'
+
 TENSOR_TIOVX_ALIGN_BYTES = 128 # tensors allocated in min block size; start of next tensor will be aligned with this. Found in https://github.com/TexasInstruments/edgeai-gst-plugins/blob/8201082cf590473ecbd95c3f73225968adcdcd89/ext/ti/gsttidlinferer.cpp#L94
 
 
@@ -60,6 +73,8 @@ class ModelRunner():
             self.params = yaml.safe_load(open(paramsfile, 'r'))
 
         self.num_boxes = num_boxes
+        # (byte offset, dtype, shape) per output tensor; see compile_decode_plan
+        self.decode_plan = None
 
         self.modelfile = os.path.join(modeldir, self.params['session']['model_path'])
         assert os.path.exists(self.modelfile), 'Could not find model file ' + self.modelfile
@@ -69,6 +84,14 @@ class ModelRunner():
         else: 
             self.model_width = self.model_height = self.params['preprocess']['resize']
 
+        # box coordinate scale factors per output image size, see get_box_scale
+        self.normalized_detections = bool(self.params.get('postprocess', {}).get('normalized_detections'))
+        self.box_scales = {}
+
+        # (x, y, width, height) regions of the camera frame that the model runs on separately, see set_tiling. None runs on the whole frame
+        self.tiles = None
+        self.tile_transforms = {}
+
     @classmethod
     def bytes_from_type_and_elements(self, tensor_type, num_el):
         '''
@@ -157,7 +180,7 @@ class ModelRunner():
 
             else: 
                 sample_od = self.output_details[0]
-                tensor_type = self.output_details.type
+                tensor_type = sample_od.type
 
                 num_el = 6 * num_boxes
                 num_bytes, np_type = ModelRunner.bytes_from_type_and_elements(tensor_type, num_el)
@@ -203,6 +226,8 @@ class ModelRunner():
             self.num_boxes = result[0].shape[2]
             print(self.num_boxes)
 
+        # the decode plan is only for tidlinferer output; load_model_layout compiles it, and the CPU backend never needs it
+        self.decode_plan = None
         return self.tensor_offsets
 
     def load_model_tidl(self):
@@ -235,11 +260,109 @@ class ModelRunner():
             self.calculate_output_tensor_sizes()
             del (self.model)
 
-    def load_model(self):
+    def layout_cache_key(self):
+        '''
+        Hash of everything the I/O layout depends on: the model file, param.yaml, and the names, sizes and modification times of the compiled artifacts (which are large, so their contents are not read)
         '''
-        Load model to see input and output details. Will not be directly used for computation. 
+        key = hashlib.sha1()
+        with open(self.modelfile, 'rb') as f:
+            key.update(f.read())
+        key.update(yaml.safe_dump(self.params).encode('utf-8'))
+
+        artifacts_dir = os.path.join(self.modeldir, self.params['session'].get('artifacts_folder', 'artifacts'))
+        if os.path.isdir(artifacts_dir):
+            for name in sorted(os.listdir(artifacts_dir)):
+                stat = os.stat(os.path.join(artifacts_dir, name))
+                key.update(('%s:%d:%d' % (name, stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+        return key.hexdigest()
+
+    def load_model_layout(self):
+        '''
+        Get the input type and output tensor layout needed by gst_configs and decode_output_tensor, as cheaply as possible:
+            1. from the layout cache in the model directory, if the model, params and artifacts have not changed
+            2. from the ONNX graph, without creating a session (needs the onnx package, and output shapes that determine the sizes)
+            3. from load_model_tidl, which creates a TIDL session
+        The result of 2 or 3 is written to the cache. The decode plan for the tidlinferer output is compiled here too, so a layout it cannot decode fails at startup rather than on the first frame
+
+        :return: which of 'cache', 'onnx' or 'tidl' was used
+        '''
+        cache_path = os.path.join(self.modeldir, LAYOUT_CACHE_FILE)
+        key = self.layout_cache_key()
+        if os.path.exists(cache_path):
+            cache = yaml.safe_load(open(cache_path, 'r'))
+            if cache and cache.get('key') == key:
+                self.model_type = 'onnx'
+                self.input_type = cache['input_type']
+                self.num_boxes = cache['num_boxes']
+                self.tensor_offsets = cache['tensor_offsets']
+                self.tensor_types = [np.dtype(t).type for t in cache['tensor_types']]
+                self.compile_decode_plan()
+                return 'cache'
+
+        source = 'onnx' if self.load_model_layout_onnx() else 'tidl'
+        if source == 'tidl':
+            self.load_model_tidl()
+
+        cache = {'key': key,
+                 'input_type': self.input_type,
+                 'num_boxes': None if self.num_boxes is None else int(self.num_boxes),
+                 'tensor_offsets': [[int(n) for n in sizes] for sizes in self.tensor_offsets],
+                 'tensor_types': [np.dtype(t).name for t in self.tensor_types]}
+        try:
+            with open(cache_path, 'w') as f:
+                yaml.safe_dump(cache, f)
+        except OSError as e:
+            print('Could not write model layout cache: ' + str(e))
+        self.compile_decode_plan()
+        return source
+
+    def load_model_layout_onnx(self):
+        '''
+        Fill in input and output details from the ONNX graph and calculate the output tensor sizes, without creating a session. 
+        Returns False if the onnx package is missing or the sizes would need an inference to find (dynamic output shapes and no num_boxes or top_k)
+        '''
+        if 'onnx' not in self.modelfile.split('.')[-1]: return False
+        try:
+            import onnx
+            from onnx import helper
+        except ImportError:
+            return False
+
+        graph = onnx.load(self.modelfile, load_external_data=False).graph
+        initializers = set(init.name for init in graph.initializer)
+
+        def tensor_details(value_info):
+            np_type = np.dtype(helper.tensor_dtype_to_np_dtype(value_info.type.tensor_type.elem_type))
+            # same format as onnxruntime, e.g. "tensor(float)" or "tensor(uint8)"
+            tensor_type = 'tensor(%s)' % ('float' if np_type == np.float32 else np_type.name)
+            shape = [d.dim_value if d.HasField('dim_value') else d.dim_param for d in value_info.type.tensor_type.shape.dim]
+            return TensorDetails(value_info.name, tensor_type, shape)
+
+        input_details = [tensor_details(i) for i in graph.input if i.name not in initializers]
+        output_details = [tensor_details(o) for o in graph.output]
+
+        static_outputs = all([all([type(n) == int for n in od.shape]) for od in output_details])
+        top_k = self.params.get('session', {}).get('runtime_options', {}).get('object_detection:top_k')
+        if not static_outputs and self.num_boxes is None and not top_k:
+            return False
+
+        self.model_type = 'onnx'
+        self.input_details = input_details
+        self.output_details = output_details
+        self.input_type = self.input_details[0].type.split('(')[-1][:-1]
+        if self.input_type == 'float':
+            self.input_type = 'float32'
+
+        self.calculate_output_tensor_sizes()
+        return True
+
+    def load_model(self, intra_op_threads=0):
+        '''
+        Load model on the CPU to see input and output details. Also used for inference by the CPU backend (see CPUInferencePool)
 
         May be worth unloading this model after saving some IO information, since it will consume RAM otherwise
+
+        :param intra_op_threads: threads for each inference. 0 lets onnxruntime use every core
         '''
         ext = self.modelfile.split('.')[-1]
 
@@ -248,6 +371,7 @@ class ModelRunner():
             self.model_type = 'onnx'
 
             sess_options = onnxruntime.SessionOptions()
+            sess_options.intra_op_num_threads = intra_op_threads
             ep_list = ['CPUExecutionProvider']
             provider_options = [{}]
 
@@ -273,25 +397,111 @@ class ModelRunner():
 
         return result
 
+    def run_batch(self, images):
+        '''
+        Run several images (e.g. the tiles of one frame) and return one num_boxes x 6 array per image, like format_output_tensors. 
+        If the model has a dynamic batch dimension, the images go through in a single run; otherwise they are run one at a time
+        '''
+        tensors = [self.preprocess_image(image) for image in images]
+        if isinstance(self.input_details[0].shape[0], int):
+            return [self.format_output_tensors(self.run_onnx(tensor)) for tensor in tensors]
 
-    def decode_output_tensor(self, tensor_buffer):
+        outputs = self.run_onnx(np.concatenate(tensors))
+        if any(o.shape[0] != len(images) for o in outputs):
+            # outputs without a batch dimension, e.g. from a model with a fixed size detection output
+            return [self.format_output_tensors(self.run_onnx(tensor)) for tensor in tensors]
+        return [self.format_output_tensors([o[i:i + 1] for o in outputs]) for i in range(len(images))]
+
+    def preprocess_image(self, image):
         '''
-        model dependent decoding of the output tensor to get 
+        Do on the CPU what tiovxdlpreproc does in the TIDL pipeline: channel order, mean and scale (for float inputs), layout and data type
+
+        :param image: HxWx3 RGB uint8 image, already resized to the model input size
+        :return: tensor with a batch dimension, ready for run_onnx
         '''
-        if len(self.tensor_offsets) == 2:
+        if self.params['preprocess'].get('reverse_channels'):
+            image = image[..., ::-1]
+
+        input_type = np.dtype(self.input_type)
+        mean = self.params['session'].get('input_mean')
+        scale = self.params['session'].get('input_scale')
+        if input_type.kind == 'f' and mean is not None and scale is not None:
+            tensor = (image.astype(np.float32) - np.array(mean, dtype=np.float32)) * np.array(scale, dtype=np.float32)
+        else:
+            tensor = image
 
-            boxes_data = tensor_buffer[0:self.tensor_offsets[0][0]]
-            boxes_tensor = np.ndarray((self.num_boxes, 5), self.tensor_types[0], boxes_data)
+        if self.params['preprocess'].get('data_layout', 'NCHW') == 'NCHW':
+            tensor = tensor.transpose(2, 0, 1)
+        return np.ascontiguousarray(tensor[None], dtype=input_type)
 
-            classes_data = tensor_buffer[self.tensor_offsets[0][1]:self.tensor_offsets[0][1] + self.tensor_offsets[1][0]]
-            classes_tensor = np.ndarray(self.num_boxes, self.tensor_types[1], classes_data)
-            classes_tensor = classes_tensor.astype(boxes_tensor.dtype)[:,None]
+    def format_output_tensors(self, outputs):
+        '''
+        Arrange the outputs of run_onnx in the same num_boxes x 6 (x1,y1,x2,y2,score,class) format that decode_output_tensor gives for tidlinferer output. 
+        The first output sets the number of boxes; the rest (e.g. classes) are added as columns
+        '''
+        boxes = outputs[0].reshape(-1, outputs[0].shape[-1])
+        if len(outputs) == 1:
+            return boxes
+        return np.concatenate([boxes] + [o.reshape(len(boxes), -1).astype(boxes.dtype) for o in outputs[1:]], axis=1)
 
-            return np.concatenate([boxes_tensor, classes_tensor], axis=1)
-        else: 
-            data = tensor_buffer[0:self.tensor_offsets[0][0]]
-            tensor = np.ndarray((self.num_boxes, 6), self.tensor_types[0], data)
-            return tensor
+
+    def compile_decode_plan(self):
+        '''
+        Work out once where each output tensor sits in the buffer from gstreamer, so decoding a frame only creates views. 
+        Each tensor starts at the aligned end of the previous one. Tensors with a multiple of num_boxes elements are shaped num_boxes x N; others are flat
+
+        Outputs from more than one tensor are combined into one preallocated num_boxes x 6 (or more) array, in the dtype of the first tensor. 
+        Flat tensors are not per box (e.g. a count of detections), so they are left out of it; decode_output_tensors still gives them
+
+        :raises ValueError: if no output tensor has a row per box, so there is nothing to decode boxes from
+        '''
+        self.decode_plan = []
+        offset = 0
+        for sizes, tensor_type in zip(self.tensor_offsets, self.tensor_types):
+            # tensor_offsets pairs hold the data size and the aligned size, in either order
+            num_bytes, num_bytes_aligned = min(sizes), max(sizes)
+            tensor_type = np.dtype(tensor_type)
+            num_el = num_bytes // tensor_type.itemsize
+            if self.num_boxes and num_el % self.num_boxes == 0:
+                shape = (self.num_boxes, num_el // self.num_boxes)
+            else:
+                shape = (num_el,)
+            self.decode_plan.append((offset, tensor_type, shape))
+            offset += num_bytes_aligned
+
+        # indices of the tensors that give columns of the decoded boxes
+        self.decode_columns = [i for i, (_, _, shape) in enumerate(self.decode_plan) if len(shape) == 2]
+        if len(self.decode_columns) == 0:
+            raise ValueError('Cannot decode boxes: none of the output tensors (%s elements) has a multiple of num_boxes=%s elements' % (', '.join(str(shape[0]) for _, _, shape in self.decode_plan), self.num_boxes))
+
+        self.decode_output = None
+        if len(self.decode_columns) > 1:
+            num_columns = sum(self.decode_plan[i][2][1] for i in self.decode_columns)
+            self.decode_output = np.zeros((self.num_boxes, num_columns), dtype=self.decode_plan[self.decode_columns[0]][1])
+        return self.decode_plan
+
+    def decode_output_tensors(self, tensor_buffer):
+        '''
+        Zero-copy views of every output tensor in the buffer, in order. The views are read-only if the buffer is
+        '''
+        if self.decode_plan is None: self.compile_decode_plan()
+        return [np.ndarray(shape, tensor_type, tensor_buffer, offset) for offset, tensor_type, shape in self.decode_plan]
+
+    def decode_output_tensor(self, tensor_buffer):
+        '''
+        model dependent decoding of the output tensor to get a num_boxes x 6 array, each row x1,y1,x2,y2,score,class
+
+        With a single per-box output tensor this is a view of the buffer. With several (e.g. boxes and classes), they are copied side by side into an array that is reused for every frame, so do not hold onto it across frames
+        '''
+        tensors = self.decode_output_tensors(tensor_buffer)
+        if self.decode_output is None:
+            return tensors[self.decode_columns[0]]
+
+        column = 0
+        for tensor in [tensors[i] for i in self.decode_columns]:
+            np.copyto(self.decode_output[:, column:column + tensor.shape[1]], tensor, casting='unsafe')
+            column += tensor.shape[1]
+        return self.decode_output
 
 
     def decode_input_tensor(self, tensor_buffer):
@@ -317,22 +527,304 @@ class ModelRunner():
         return tensor
 
 
-    def resize_boxes(self, boxes_tensor, image_height, image_width):
+    def get_box_scale(self, image_height, image_width):
         '''
-        Assumed that format is x1,y1,x2,y2,score,class for each box (row) in the tensor
+        Factors to multiply x1,y1,x2,y2 by to go from model output coordinates to image pixels. Cached, since the image size rarely changes
         '''
+        scale = self.box_scales.get((image_height, image_width))
+        if scale is None:
+            if self.normalized_detections:
+                sx, sy = image_width, image_height
+            else:
+                sx, sy = image_width / self.model_width, image_height / self.model_height
+            scale = np.array([sx, sy, sx, sy], dtype=np.float32)
+            self.box_scales[(image_height, image_width)] = scale
+        return scale
 
+    def postprocess_detections(self, boxes_tensor, image_height, image_width, score_threshold=0.6, top_k=None):
+        '''
+        Filter and scale the decoded output tensor in one pass over the whole array: keep boxes above score_threshold (and only the top_k highest scoring, if given), scale them to the image size, clip to the image and cast to int. 
+        The tensor is not modified
 
-        for box in boxes_tensor:
-            if self.params['postprocess'].get('normalized_detections'):
-                box[0] *= image_width
-                box[1] *= image_height
-                box[2] *= image_width
-                box[3] *= image_height
-            else:
-                box[0] *= image_width / self.model_width
-                box[1] *= image_height / self.model_height
-                box[2] *= image_width / self.model_width
-                box[3] *= image_height / self.model_height
+        :param boxes_tensor: num_boxes x 6 array, each row x1,y1,x2,y2,score,class in model output coordinates, e.g. from decode_output_tensor
+        :return: structured array of DETECTION_DTYPE, highest score first if top_k is used
+        '''
+        scores = boxes_tensor[:, 4]
+        keep = np.flatnonzero(scores > score_threshold)
+        if top_k is not None and len(keep) > top_k:
+            keep = keep[np.argsort(-scores[keep], kind='stable')[:top_k]]
+
+        detections = np.empty(len(keep), dtype=DETECTION_DTYPE)
+        if len(keep) == 0: return detections
 
-        return boxes_tensor
+        boxes = boxes_tensor[keep, :4] * self.get_box_scale(image_height, image_width)
+        np.clip(boxes, 0, [image_width - 1, image_height - 1, image_width - 1, image_height - 1], out=boxes)
+        detections['box'] = boxes
+        detections['score'] = scores[keep]
+        detections['label'] = boxes_tensor[keep, 5]
+        return detections
+
+
+    def set_tiling(self, frame_width, frame_height, tile_cols=2, tile_rows=2, overlap=0.2, region=None, min_tile_size=(0, 0)):
+        '''
+        Split the camera frame into tile_cols x tile_rows overlapping tiles, so small objects (e.g. faces across a room) are not shrunk as far as when the whole frame is resized to the model input. 
+        Each tile is run separately and merge_tile_detections puts the boxes back together
+
+        :param overlap: fraction of a tile shared with its neighbour. An object smaller than this is whole in at least one tile
+        :param region: (x, y, width, height) part of the frame to tile, e.g. the part on display. Defaults to the whole frame
+        :param min_tile_size: (width, height) that tiles are grown to if the region is too small, e.g. because the scaler cannot upscale. The tiles grow around the centre of the region and stay inside the frame
+        :return: list of (x, y, width, height) in camera frame pixels, row by row. Values are even, as the TI multiscaler requires
+        '''
+        def spans(start, length, frame_length, num_tiles, min_size):
+            size = max(length / (num_tiles - (num_tiles - 1) * overlap), min_size)
+            size = min(frame_length, math.ceil(size / 2) * 2)
+            step = size * (1 - overlap)
+            covered = min(frame_length, size + (num_tiles - 1) * step)
+            start = min(max(0, start + (length - covered) / 2), frame_length - covered)
+            # the last tile is moved back to end at the frame edge
+            return [(min(int(start + i * step) // 2 * 2, frame_length - size), size) for i in range(num_tiles)]
+
+        x, y, w, h = region if region is not None else (0, 0, frame_width, frame_height)
+        self.tile_frame_size = (frame_width, frame_height)
+        self.tile_layout = (tile_cols, tile_rows, overlap)
+        self.tiles = [(tx, ty, tw, th) for ty, th in spans(y, h, frame_height, tile_rows, min_tile_size[1]) for tx, tw in spans(x, w, frame_width, tile_cols, min_tile_size[0])]
+        self.tile_transforms = {}
+        return self.tiles
+
+    def crop_tiles(self, frame):
+        '''
+        Cut self.tiles out of a full camera frame and resize each to the model input, as the tiled GStreamer pipeline does. Used for benchmarking without GStreamer
+        '''
+        return [cv.resize(frame[y:y + h, x:x + w], (self.model_width, self.model_height), interpolation=cv.INTER_LINEAR) for x, y, w, h in self.tiles]
+
+    def get_tile_transform(self, image_height, image_width):
+        '''
+        Per tile (scale, offset) that take x1,y1,x2,y2 from model output coordinates to pixels of the full image, which is the camera frame resized to image_width x image_height. Cached
+        '''
+        transforms = self.tile_transforms.get((image_height, image_width))
+        if transforms is None:
+            frame_width, frame_height = self.tile_frame_size
+            frame_scale = np.array([image_width / frame_width, image_height / frame_height] * 2, dtype=np.float32)
+            transforms = [(self.get_box_scale(h, w) * frame_scale, np.array([x, y, x, y], dtype=np.float32) * frame_scale) for x, y, w, h in self.tiles]
+            self.tile_transforms[(image_height, image_width)] = transforms
+        return transforms
+
+    def merge_tile_detections(self, tile_outputs, image_height, image_width, score_threshold=0.6, iou_threshold=0.5):
+        '''
+        Combine the model outputs of every tile into detections on the full image. Boxes are moved into full image coordinates, and duplicates of an object seen by neighbouring tiles are removed with non_max_suppression
+
+        :param tile_outputs: num_boxes x 6 array per tile, in the order of self.tiles. decode_output_tensor reuses its output array, so pass copies
+        :return: structured array of DETECTION_DTYPE, like postprocess_detections
+        '''
+        boxes, scores, labels = [], [], []
+        for (scale, offset), output in zip(self.get_tile_transform(image_height, image_width), tile_outputs):
+            keep = output[:, 4] > score_threshold
+            boxes.append(output[keep, :4] * scale + offset)
+            scores.append(output[keep, 4])
+            labels.append(output[keep, 5])
+        boxes, scores, labels = np.concatenate(boxes), np.concatenate(scores), np.concatenate(labels)
+
+        keep = non_max_suppression(boxes, scores, labels, iou_threshold)
+        detections = np.empty(len(keep), dtype=DETECTION_DTYPE)
+        if len(keep) == 0: return detections
+
+        boxes = boxes[keep]
+        np.clip(boxes, 0, [image_width - 1, image_height - 1, image_width - 1, image_height - 1], out=boxes)
+        detections['box'] = boxes
+        detections['score'] = scores[keep]
+        detections['label'] = labels[keep]
+        return detections
+
+
+def non_max_suppression(boxes, scores, labels, iou_threshold=0.5):
+    '''
+    Greedy NMS: take boxes from the highest score down, dropping any box that overlaps an already kept box of the same label by more than iou_threshold
+
+    :param boxes: N x 4 array of x1,y1,x2,y2
+    :return: indices of the kept boxes, highest score first
+    '''
+    if len(boxes) == 0: return np.zeros(0, dtype=np.int64)
+
+    # shift each label to its own region of the plane, so boxes of different labels never overlap
+    boxes = boxes + (labels * (boxes.max() + 1))[:, None]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while len(order) > 0:
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        w = np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0])
+        h = np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1])
+        intersection = np.clip(w, 0, None) * np.clip(h, 0, None)
+        iou = intersection / (areas[i] + areas[rest] - intersection + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+class CPUInferencePool():
+    '''
+    Run the detector with onnxruntime on the CPU instead of tidlinferer, with up to num_inflight frames being processed at once by a thread pool. 
+    onnxruntime releases the GIL while running, so the frames really do run in parallel. 
+
+    Results come out in the order frames were submitted, in the num_boxes x 6 format of ModelRunner.decode_output_tensor, so the rest of the application is the same for either backend.
+    The model must have been loaded with ModelRunner.load_model
+    '''
+    def __init__(self, model_obj:ModelRunner, num_inflight=2):
+        self.model_obj = model_obj
+        self.num_inflight = num_inflight
+        self.executor = ThreadPoolExecutor(max_workers=num_inflight)
+        # seq -> (future, payload, submit time) for frames submitted but not yet returned by get_result
+        self.pending = {}
+        self.next_submit_seq = 0
+        self.next_result_seq = 0
+        self.lock = threading.Lock()
+
+        self.num_results = 0
+        self.total_latency_s = 0
+        self.max_latency_s = 0
+
+    def infer(self, image):
+        # a list is the tiles of one frame, see ModelRunner.set_tiling
+        if isinstance(image, list):
+            return self.model_obj.run_batch(image)
+        tensor = self.model_obj.preprocess_image(image)
+        return self.model_obj.format_output_tensors(self.model_obj.run_onnx(tensor))
+
+    def full(self):
+        '''
+        True if num_inflight frames are pending, so the oldest must be taken with get_result(block=True) before another is submitted. This holds the caller to the rate the CPU can sustain
+        '''
+        return len(self.pending) >= self.num_inflight
+
+    def submit(self, image, payload=None):
+        '''
+        Start inference on an image (see ModelRunner.preprocess_image), or on a list of tile images that gives a list of outputs. The pool must not be full(): 
+        at most num_inflight frames, and their payloads, are ever held, e.g. so mapped samples do not use up the pipeline's buffer pool
+
+        :param payload: anything to hand back with the result, e.g. the full resolution frame to draw on
+        :return: sequence number of this frame
+        '''
+        if self.full():
+            raise RuntimeError('%d frames are already in flight; take the oldest result with get_result before submitting another' % self.num_inflight)
+
+        with self.lock:
+            seq = self.next_submit_seq
+            self.pending[seq] = (self.executor.submit(self.infer, image), payload, time.time())
+            self.next_submit_seq += 1
+        return seq
+
+    def get_result(self, block=False):
+        '''
+        Return (seq, infer_output, payload) for the oldest submitted frame once it is done, or None if it is not done yet (or nothing is pending) and block is False
+        '''
+        with self.lock:
+            if self.next_result_seq not in self.pending: return None
+            future, payload, t_submit = self.pending[self.next_result_seq]
+        if not block and not future.done(): return None
+
+        infer_output = future.result()
+        with self.lock:
+            seq = self.next_result_seq
+            del self.pending[seq]
+            self.next_result_seq += 1
+
+        latency = time.time() - t_submit
+        self.num_results += 1
+        self.total_latency_s += latency
+        self.max_latency_s = max(self.max_latency_s, latency)
+        return seq, infer_output, payload
+
+    def get_stats(self):
+        return {'num_results': self.num_results,
+                'mean_latency_ms': 1000 * self.total_latency_s / max(self.num_results, 1),
+                'max_latency_ms': 1000 * self.max_latency_s}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def benchmark_cpu_backend(modeldir, num_frames=200, num_inflight=(1, 2, 4), intra_op_threads=None):
+    '''
+    Run random frames through CPUInferencePool without a camera or GStreamer, for capacity planning on any host. Reports frames/s and submit-to-result latency for each number of in-flight frames
+
+    :param intra_op_threads: threads per inference. Defaults to splitting the cores between the in-flight frames
+    '''
+    for inflight in num_inflight:
+        model_obj = ModelRunner(modeldir)
+        threads = intra_op_threads if intra_op_threads is not None else max(1, (os.cpu_count() or 1) // inflight)
+        model_obj.load_model(intra_op_threads=threads)
+        pool = CPUInferencePool(model_obj, inflight)
+
+        frame = np.random.randint(0, 255, (model_obj.model_height, model_obj.model_width, 3), dtype=np.uint8)
+        pool.infer(frame) # warm up
+
+        t_start = time.perf_counter()
+        num_done = 0
+        for _ in range(num_frames):
+            if pool.full():
+                pool.get_result(block=True)
+                num_done += 1
+            pool.submit(frame)
+            while pool.get_result() is not None: num_done += 1
+        while num_done < num_frames:
+            pool.get_result(block=True)
+            num_done += 1
+        t_total = time.perf_counter() - t_start
+        pool.shutdown()
+
+        stats = pool.get_stats()
+        print('%d in flight, %d threads each: %.1f frames/s, latency avg %.1f ms, max %.1f ms' % (inflight, threads, num_frames / t_total, stats['mean_latency_ms'], stats['max_latency_ms']))
+
+
+def benchmark_tiling(modeldir, tilings=((1, 1), (2, 1), (2, 2)), frame_width=1640, frame_height=1232, num_frames=50, overlap=0.2, intra_op_threads=0):
+    '''
+    Run a random camera-sized frame through the model tiled in each way in tilings, to see what each tile count costs on this CPU. The crop/resize, inference and merge times are reported separately. 
+    On the TI SoC, the crop and resize are done by the multiscaler and each tile is one more tidlinferer run, so inference time per tile is what scales
+
+    :param tilings: (columns, rows) pairs
+    '''
+    model_obj = ModelRunner(modeldir)
+    model_obj.load_model(intra_op_threads=intra_op_threads)
+    frame = np.random.randint(0, 255, (frame_height, frame_width, 3), dtype=np.uint8)
+
+    t_frame_single = None
+    for cols, rows in tilings:
+        model_obj.set_tiling(frame_width, frame_height, cols, rows, overlap)
+        model_obj.run_batch(model_obj.crop_tiles(frame)) # warm up
+
+        t_crop = t_infer = t_merge = 0
+        for _ in range(num_frames):
+            t0 = time.perf_counter()
+            tiles = model_obj.crop_tiles(frame)
+            t1 = time.perf_counter()
+            outputs = model_obj.run_batch(tiles)
+            t2 = time.perf_counter()
+            model_obj.merge_tile_detections(outputs, frame_height, frame_width)
+            t3 = time.perf_counter()
+            t_crop += t1 - t0
+            t_infer += t2 - t1
+            t_merge += t3 - t2
+        t_frame = (t_crop + t_infer + t_merge) / num_frames
+        if t_frame_single is None: t_frame_single = t_frame
+
+        tile_w, tile_h = model_obj.tiles[0][2:]
+        print('%dx%d tiles of %dx%d: %.1f frames/s, %.1f ms/frame (crop+resize %.1f, infer %.1f, merge %.2f), %.1fx the cost of the first tiling' % (cols, rows, tile_w, tile_h, 1 / t_frame, 1000 * t_frame, 1000 * t_crop / num_frames, 1000 * t_infer / num_frames, 1000 * t_merge / num_frames, t_frame / t_frame_single))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the CPU (onnxruntime) detection backend on random frames')
+    parser.add_argument('-m', '--modeldir', default='./model/', help='model directory with param.yaml and the onnx model')
+    parser.add_argument('-n', '--num-frames', default=200, type=int)
+    parser.add_argument('-i', '--inflight', default='1,2,4', help='comma separated numbers of frames in flight to test')
+    parser.add_argument('-t', '--threads', default=None, type=int, help='onnxruntime threads per inference. Default splits the cores between in-flight frames')
+    parser.add_argument('--tiles', default=None, help='benchmark tiled inference instead, for each comma separated COLSxROWS tiling, e.g. 1x1,2x1,2x2')
+    parser.add_argument('--frame-size', default='1640x1232', help='camera frame WIDTHxHEIGHT to tile, e.g. 3280x2464 for imx219-8mp')
+    args = parser.parse_args()
+
+    if args.tiles:
+        frame_width, frame_height = [int(n) for n in args.frame_size.split('x')]
+        tilings = [tuple(int(n) for n in tiling.split('x')) for tiling in args.tiles.split(',')]
+        benchmark_tiling(args.modeldir, tilings, frame_width, frame_height, args.num_frames, intra_op_threads=args.threads or 0)
+    else:
+        benchmark_cpu_backend(args.modeldir, args.num_frames, [int(n) for n in args.inflight.split(',')], args.threads)
@@ -0,0 +1,199 @@
+#
+# Copyright (C) 2023 Texas Instruments Incorporated - http://www.ti.com/
+#
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#    Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#
+#    Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the
+#    distribution.
+#
+#    Neither the name of Texas Instruments Incorporated nor the names of
+#    its contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''
+Track-by-detection for the vision application, so boxes keep an identity from frame to frame and can be carried over frames where the detector did not run. 
+
+Each track has a constant-velocity Kalman filter on the box center, width and height (as in SORT). Every frame all tracks are predicted forward; when there are detections, they are matched to tracks of the same label greedily by IoU, matched tracks are corrected, unmatched detections start new tracks, and tracks that miss too many detector frames are dropped.
+Only tracks confirmed by a few detections, and matched on the latest detector frame, are given out for drawing; the others are kept so a face that flickers out for a frame keeps its identity
+All tracks are kept in arrays and filtered together, so the cost per frame barely depends on the number of tracks
+'''
+
+import numpy as np
+
+# one row per track, like model_runner.DETECTION_DTYPE plus a stable track_id
+TRACK_DTYPE = np.dtype([('box', np.int32, (4,)), ('score', np.float32), ('label', np.int32), ('track_id', np.int32)])
+
+
+def iou_matrix(boxes_a, boxes_b):
+    '''
+    IoU between every pair of x1,y1,x2,y2 boxes, as a len(boxes_a) x len(boxes_b) array
+    '''
+    boxes_a = np.asarray(boxes_a, dtype=np.float32)[:, None, :]
+    boxes_b = np.asarray(boxes_b, dtype=np.float32)[None, :, :]
+    inter_w = np.clip(np.minimum(boxes_a[..., 2], boxes_b[..., 2]) - np.maximum(boxes_a[..., 0], boxes_b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(boxes_a[..., 3], boxes_b[..., 3]) - np.maximum(boxes_a[..., 1], boxes_b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (boxes_a[..., 2] - boxes_a[..., 0]) * (boxes_a[..., 3] - boxes_a[..., 1])
+    area_b = (boxes_b[..., 2] - boxes_b[..., 0]) * (boxes_b[..., 3] - boxes_b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+class BoxTracker():
+    '''
+    Multi-object tracker for detections from ModelRunner.postprocess_detections. 
+
+    Call update() once per displayed frame, with the detections if the detector ran on that frame and None otherwise, then get_tracks() for the boxes to draw
+    '''
+    # Kalman state is cx, cy, w, h and their velocities per frame. Noise is relative to the box height so it scales with distance to the camera
+    POSITION_STD = 1 / 20
+    VELOCITY_STD = 1 / 160
+
+    def __init__(self, iou_threshold=0.3, max_misses=3, min_hits=2):
+        '''
+        :param iou_threshold: minimum IoU for a detection to continue a track
+        :param max_misses: drop a track after this many consecutive detector frames without a match. Tracks that missed the latest detector frame are not drawn in the meantime
+        :param min_hits: detections a track needs before it is drawn, so one-off false detections are not
+        '''
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.min_hits = min_hits
+
+        self.F = np.eye(8, dtype=np.float32)
+        self.F[:4, 4:] = np.eye(4)
+        self.H = np.eye(4, 8, dtype=np.float32)
+
+        self.states = np.zeros((0, 8), dtype=np.float32)
+        self.covariances = np.zeros((0, 8, 8), dtype=np.float32)
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.labels = np.zeros(0, dtype=np.int32)
+        self.track_ids = np.zeros(0, dtype=np.int32)
+        self.misses = np.zeros(0, dtype=np.int32)
+        self.hits = np.zeros(0, dtype=np.int32)
+        self.next_track_id = 1
+
+    @staticmethod
+    def boxes_to_measurements(boxes):
+        boxes = np.asarray(boxes, dtype=np.float32)
+        return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2, boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]], axis=1)
+
+    def predict(self):
+        heights = np.maximum(self.states[:, 3], 1)
+        std = np.concatenate([np.repeat((BoxTracker.POSITION_STD * heights)[:, None], 4, axis=1), np.repeat((BoxTracker.VELOCITY_STD * heights)[:, None], 4, axis=1)], axis=1)
+        self.states = self.states @ self.F.T
+        self.covariances = self.F @ self.covariances @ self.F.T + std[:, :, None]**2 * np.eye(8, dtype=np.float32)
+
+    def correct(self, track_indices, measurements):
+        '''
+        Kalman update of the given tracks with their matched measurements (cx, cy, w, h)
+        '''
+        states = self.states[track_indices]
+        covariances = self.covariances[track_indices]
+        std = BoxTracker.POSITION_STD * np.maximum(states[:, 3], 1)
+
+        innovation_cov = self.H @ covariances @ self.H.T + (std[:, None, None]**2) * np.eye(4, dtype=np.float32)
+        # gain = P H^T S^-1, solved as S^T K^T = H P^T
+        gain = np.linalg.solve(np.transpose(innovation_cov, (0, 2, 1)), self.H @ np.transpose(covariances, (0, 2, 1))).transpose(0, 2, 1)
+        residual = measurements - states @ self.H.T
+        self.states[track_indices] = states + np.einsum('tij,tj->ti', gain, residual)
+        self.covariances[track_indices] = covariances - gain @ self.H @ covariances
+
+    def match(self, detections):
+        '''
+        Greedily pair detections with tracks of the same label, highest IoU first. Returns matched (track, detection) index arrays
+        '''
+        if len(self.states) == 0 or len(detections) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+        ious = iou_matrix(self.get_boxes(), detections['box'])
+        ious[self.labels[:, None] != detections['label'][None, :]] = 0
+        track_indices, detection_indices = [], []
+        candidates = np.argwhere(ious >= self.iou_threshold)
+        order = np.argsort(-ious[candidates[:, 0], candidates[:, 1]], kind='stable')
+        used_tracks, used_detections = set(), set()
+        for t, d in candidates[order].tolist():
+            if t in used_tracks or d in used_detections: continue
+            used_tracks.add(t)
+            used_detections.add(d)
+            track_indices.append(t)
+            detection_indices.append(d)
+        return np.array(track_indices, dtype=int), np.array(detection_indices, dtype=int)
+
+    def update(self, detections=None):
+        '''
+        Advance all tracks by one frame. 
+
+        :param detections: structured array with 'box' (x1,y1,x2,y2), 'score' and 'label' fields (see model_runner.DETECTION_DTYPE) if the detector ran on this frame, otherwise None to only predict
+        '''
+        self.predict()
+        if detections is None: return
+
+        track_indices, detection_indices = self.match(detections)
+        if len(track_indices) > 0:
+            self.correct(track_indices, BoxTracker.boxes_to_measurements(detections['box'][detection_indices]))
+            self.scores[track_indices] = detections['score'][detection_indices]
+            self.hits[track_indices] += 1
+
+        missed = np.ones(len(self.states), dtype=bool)
+        missed[track_indices] = False
+        self.misses[missed] += 1
+        self.misses[~missed] = 0
+
+        new = np.ones(len(detections), dtype=bool)
+        new[detection_indices] = False
+        num_new = int(np.sum(new))
+        if num_new > 0:
+            measurements = BoxTracker.boxes_to_measurements(detections['box'][new])
+            states = np.concatenate([measurements, np.zeros_like(measurements)], axis=1)
+            # velocity is unknown for a new track
+            std = np.concatenate([np.repeat(2 * BoxTracker.POSITION_STD * np.maximum(measurements[:, 3:4], 1), 4, axis=1), np.repeat(10 * BoxTracker.VELOCITY_STD * np.maximum(measurements[:, 3:4], 1), 4, axis=1)], axis=1)
+            self.states = np.concatenate([self.states, states])
+            self.covariances = np.concatenate([self.covariances, std[:, :, None]**2 * np.eye(8, dtype=np.float32)])
+            self.scores = np.concatenate([self.scores, detections['score'][new]])
+            self.labels = np.concatenate([self.labels, detections['label'][new]])
+            self.track_ids = np.concatenate([self.track_ids, np.arange(self.next_track_id, self.next_track_id + num_new, dtype=np.int32)])
+            self.misses = np.concatenate([self.misses, np.zeros(num_new, dtype=np.int32)])
+            self.hits = np.concatenate([self.hits, np.ones(num_new, dtype=np.int32)])
+            self.next_track_id += num_new
+
+        keep = self.misses <= self.max_misses
+        if not np.all(keep):
+            self.states, self.covariances, self.scores, self.labels, self.track_ids, self.misses, self.hits = self.states[keep], self.covariances[keep], self.scores[keep], self.labels[keep], self.track_ids[keep], self.misses[keep], self.hits[keep]
+
+    def get_boxes(self):
+        cx, cy, w, h = self.states[:, 0], self.states[:, 1], np.maximum(self.states[:, 2], 1), np.maximum(self.states[:, 3], 1)
+        return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+    def get_tracks(self, image_height, image_width):
+        '''
+        Current boxes of the tracks to draw, clipped to the image, as a structured array of TRACK_DTYPE ordered by track_id. 
+        These are the tracks with at least min_hits detections that were matched on the latest detector frame
+        '''
+        visible = (self.hits >= self.min_hits) & (self.misses == 0)
+        tracks = np.empty(int(np.sum(visible)), dtype=TRACK_DTYPE)
+        boxes = self.get_boxes()[visible]
+        np.clip(boxes, 0, [image_width - 1, image_height - 1, image_width - 1, image_height - 1], out=boxes)
+        tracks['box'] = boxes
+        tracks['score'] = self.scores[visible]
+        tracks['label'] = self.labels[visible]
+        tracks['track_id'] = self.track_ids[visible]
+        return tracks
@@ -40,3 +40,25 @@ def get_categories(modeldir):
     categories = yaml.safe_load(open(filepath, 'r'))['categories']
     return categories
 
+
+class StartupTimer():
+    '''
+    Record how long each startup phase takes and when it finished, to track time-to-first-frame. 
+    Phases may overlap (e.g. run in different threads or processes), so each one is timed from its own start
+    '''
+    def __init__(self, t_launch=None):
+        self.t_launch = time.perf_counter() if t_launch is None else t_launch
+        self.phases = []
+
+    def record(self, phase, t_phase_start):
+        '''
+        Record a phase that started at t_phase_start (from time.perf_counter) and just finished
+        '''
+        t_now = time.perf_counter()
+        self.phases.append((phase, t_now - t_phase_start, t_now - self.t_launch))
+
+    def print_report(self):
+        print('\n**** Startup Times ****')
+        for phase, duration, t_done in self.phases:
+            print('---- %s: %d ms (done at %d ms)' % (phase, duration*1000, t_done*1000))
+        print("-----------------------\n")
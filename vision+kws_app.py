@@ -38,6 +38,7 @@ Use the -h tag for displaying the command line options
 
 
 import os, time
+t_launch = time.perf_counter() # startup timing includes the imports below
 from pprint import pprint
 import numpy as np
 import yaml
@@ -45,7 +46,6 @@ import threading
 import argparse
 import math
 import multiprocessing as mp
-import queue
 from collections import deque
 import cv2 as cv
 
@@ -55,28 +55,53 @@ gi.require_version('GstApp', '1.0')
 from gi.repository import Gst, GstApp, GLib, GObject
 Gst.init(None)
 
-import gst_configs, model_runner, display, utils
+import gst_configs, gst_memory, model_runner, display, utils, tracker, frame_scheduler
 import kws_matchbox as kws
 import command_interpreter
 
 # global variables to help control the GST thread
 stop_threads = False
 infer_thread = None
+# the SamplePairer must be able to hold an image waiting for its tensor and the next image
+MIN_PAIRER_IMAGES = 2
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('-c', '--camera', default='usb-1080p', help='name of camera type to use. options are usb-720p from logitech, usb-1080p (c920 or c922 from logitech), and IMX219 (RPi cam v2)')
+    parser.add_argument('-c', '--camera', default='usb-1080p', help='name of camera type to use. options are usb-720p from logitech, usb-1080p (c920 or c922 from logitech), IMX219 (RPi cam v2), test (a test pattern; no camera) and file (a video file given by --device)')
     parser.add_argument('-m', '--modeldir', default='./model/', help='location of the model directory. Assumed to have dataset.yaml, param.yaml, model as model.onnx, and subdir for artifacts. See typical format of directories from /opt/model_zoo for example')
     parser.add_argument('-d', '--device', default='/dev/video2', help="location of the camera device under /dev")
     parser.add_argument('-o', '--output-dimensions', default='1280x720', help="Resolution of the output display in WxH format, e.g. 1920x1080")
+    parser.add_argument('-b', '--backend', default='tidl', choices=['tidl', 'cpu'], help='run the vision model with tidlinferer (TI SoCs), or with onnxruntime on the CPU so the application runs on any host')
+    parser.add_argument('--inflight', default=2, type=int, help='with --backend cpu, number of frames the model runs on at once. Each holds an image buffer, so at most %d' % (gst_configs.GstBuilder.IMAGE_POOL_SIZE - 2 - MIN_PAIRER_IMAGES))
+    parser.add_argument('--display-sink', default='autovideosink sync=false', help='with --backend cpu, the GStreamer sink for the output, e.g. fakesink')
+    parser.add_argument('-n', '--detect-every', default=1, type=int, help='run the vision model on every Nth camera frame and track objects on the frames between, to reduce the inference load')
+    parser.add_argument('--tiles', default=None, help='run the vision model on COLSxROWS overlapping tiles of the camera frame, e.g. 2x2, so small faces in a large room are found. Costs one model run per tile; see "python3 model_runner.py --tiles" to compare tilings')
+    parser.add_argument('--tile-overlap', default=0.2, type=float, help='with --tiles, fraction of each tile shared with its neighbours')
+    parser.add_argument('--follow-view', action='store_true', help='run the vision model on the part of the frame on display when a voice command pans or zooms, instead of the whole frame. Works with --tiles')
+    parser.add_argument('--pair-wait', default=0, type=int, help='when the vision model does not run on every frame (-n, -t), how many frames an image may wait for its detections before it is shown without them. Detections that come later are used with a newer frame')
+    parser.add_argument('--delivery', default='poll', choices=['poll', 'signal'], help='how frames come from the pipeline: poll the appsinks with timed pulls, or have them signal each sample as it arrives so the application sleeps until a frame is ready')
+    parser.add_argument('-t', '--target-fps', default=0, type=float, help='lower the face pane refresh, resize quality and detector rate as needed to hold this frame rate. 0 disables')
     parser.add_argument('-a', '--audio-device', default=1, type=int, help='The device channel index for your microphone. This is typically on starter kit EVMs. Run the detect_microphone.py script to see which microphones are connected')
+    parser.add_argument('--kws-int8', action='store_true', help='Use the int8 keyword spotting model. Create it first with "python3 kws_matchbox.py --quantize <dir of wav files>"')
+    parser.add_argument('-k', '--kws-hop', default=kws.AudioInference.SECONDS_PER_CHUNK, type=float, help='Seconds between keyword spotting windows, e.g. 0.1 for faster command response at more CPU cost. Windows that queue up are batched')
+    # --kws-streaming, --kws-max-batch, --kws-threads and --kws-vad with its thresholds. The VAD is off unless asked for
+    kws.add_inference_arguments(parser, prefix='kws-', streaming=True, max_batch=8, intra_op_threads=1)
 
     args = parser.parse_args()
+    max_inflight = gst_configs.GstBuilder.IMAGE_POOL_SIZE - 2 - MIN_PAIRER_IMAGES
+    if args.backend == 'cpu' and not 1 <= args.inflight <= max_inflight:
+        parser.error('--inflight must be between 1 and %d: each frame in flight holds one of the %d image buffers, and the appsink, the frame being drawn and the frame pairing need the rest' % (max_inflight, gst_configs.GstBuilder.IMAGE_POOL_SIZE))
     
     return args
 
+def max_pairer_images(num_inflight=0):
+    '''
+    Images the SamplePairer may hold without running the image branch's buffer pool (GstBuilder.IMAGE_POOL_SIZE) dry: one buffer is in the appsink or SampleDelivery, one is the frame being drawn and num_inflight are in the CPU inference pool
+    '''
+    return gst_configs.GstBuilder.IMAGE_POOL_SIZE - 2 - num_inflight
+
 def print_stats(stats):
     '''
     Print some runtime stats related to total time, preprocessing, and postprocessing
@@ -90,111 +115,295 @@ def print_stats(stats):
     std_out = math.sqrt(stats['total_output_stage_sq'] / stats['count'] - mean_out**2)
     print('**** Runtime Stats ****')
     print('---- Pull input time (ms): avg %d +- %d (min to max: %d to %d)' % (mean_inf*1000, std_inf*1000, stats['total_pre_stage_min']*1000, stats['total_pre_stage_max']*1000))
+    if stats['delivery'] is None:
+        print('---- Pull tensor time (ms): avg %.1f, pull image time (ms): avg %.1f' % (1000 * stats['total_tensor_pull_s'] / stats['count'], 1000 * stats['total_image_pull_s'] / stats['count']))
+    print('---- Idle wakeups (no frame ready): %d, %.2f per frame' % (stats['idle_wakeups'], stats['idle_wakeups'] / stats['count']))
+    if stats['pickup_count'] > 0:
+        mean_pickup = stats['total_pickup_latency_s'] / stats['pickup_count']
+        std_pickup = math.sqrt(max(0, stats['total_pickup_latency_sq'] / stats['pickup_count'] - mean_pickup**2))
+        print('---- Arrival to processing latency (ms): avg %.1f +- %.1f (max %.1f), samples delivered %d, dropped %d' % (mean_pickup*1000, std_pickup*1000, stats['pickup_latency_max']*1000, stats['delivery']['delivered'], stats['delivery']['dropped']))
     print('---- Output (draw, post-proc) time (ms): avg %d +- %d' % (mean_out*1000, std_out*1000))
+    pairing = stats['pairing']
+    print('---- Frame pairing: paired %d, images without tensor %d, mismatched %d, dropped images %d, dropped tensors %d' % (pairing['paired'], pairing['image_only'], pairing['mismatched'], pairing['dropped_images'], pairing['dropped_tensors']))
+    if stats['kws_results'] > 0:
+        print('---- KWS results: %d, capture to pickup latency (ms): avg %d, lost %d' % (stats['kws_results'], 1000 * stats['total_kws_latency_s'] / stats['kws_results'], stats['kws_lost']))
     print('---- FPS: %.02f' % fps)
     print("-----------------------\n")
 
 
-def application_thread(gst_conf:gst_configs.GstBuilder, model_obj:model_runner.ModelRunner, display_obj:display.DisplayDrawer, categories, args, input_queue):
+def pull_tensors(gst_conf:gst_configs.GstBuilder, loop=False, timeout_ns=50000000):
+    '''
+    Pull the tensor sample for one frame: the model output with the tidl backend, or the model input with the cpu backend. 
+    With tiling, one sample is pulled per tile and a list is returned, or None if a tile did not arrive. The tiles come from the same camera frame, so once the first is there the rest are waited for
+    '''
+    if gst_conf.app_in_tiles is None:
+        return gst_conf.pull_sample(gst_conf.app_in_tensor, loop=loop, timeout_ns=timeout_ns)
+
+    samples = []
+    for app in gst_conf.app_in_tiles:
+        sample = gst_conf.pull_sample(app, loop=loop, timeout_ns=timeout_ns if not samples else max(timeout_ns, 50000000))
+        if not sample:
+            gst_memory.release_samples(samples)
+            return None
+        samples.append(sample)
+    return samples
+
+def follow_view(gst_conf:gst_configs.GstBuilder, model_obj:model_runner.ModelRunner, display_obj:display.DisplayDrawer, action, image_height, image_width):
+    '''
+    Point the model input at the part of the frame on display for this action, so the detector's input resolution goes where the viewer is looking. 
+    Boxes still come back in full image coordinates (see ModelRunner.merge_tile_detections). Outputs already in the pipeline when the view changes are mapped with the new tiles, so boxes may be off for a frame or two
+    '''
+    x, y, w, h = display_obj.get_view_region(image_height, image_width, action)
+    # the crop can extend past an image that is smaller than the display area
+    x, y = max(0, x), max(0, y)
+    w, h = min(w, image_width - x), min(h, image_height - y)
+
+    frame_width, frame_height = model_obj.tile_frame_size
+    sx, sy = frame_width / image_width, frame_height / image_height
+    tile_cols, tile_rows, overlap = model_obj.tile_layout
+    tiles = model_obj.set_tiling(frame_width, frame_height, tile_cols, tile_rows, overlap, region=(int(x * sx), int(y * sy), int(w * sx), int(h * sy)), min_tile_size=gst_conf.min_tile_size)
+    gst_conf.set_tiles(tiles)
+    print('Vision model input follows %s: %s' % (action, tiles))
+
+def application_thread(gst_conf:gst_configs.GstBuilder, model_obj:model_runner.ModelRunner, display_obj:display.DisplayDrawer, categories, args, kws_channel:kws.KWSResultChannel, startup_timer:utils.StartupTimer, cpu_pool:model_runner.CPUInferencePool=None):
     '''
     This is where application code between appsink and appsrc code lives
+
+    With the CPU backend, cpu_pool runs the model; each frame's result is drawn once it comes out of the pool, a few frames after the frame was pulled
     '''
     print("waiting until audio thread gives something:")
-    try:
-        kws_output = input_queue.get(block=True)
-        print('\n***\ngot some kws output...ready to start the rest the vision pipeline!\n***\n')
-        print(kws_output)
-    except: pass
+    t_wait = time.perf_counter()
+    kws_labels = kws_channel.get_labels()
+    startup_timer.record('wait for keyword spotting', t_wait)
+    print('\n***\nkeyword spotting is running...ready to start the rest the vision pipeline!\n***\n')
+    print(kws_labels)
 
     last_commands = deque(maxlen=5)
     commander = command_interpreter.CommandInterpreter()
+    scheduler = frame_scheduler.FrameScheduler(args.target_fps, min_detect_every=args.detect_every) if args.target_fps > 0 else None
+    # when the model runs on every frame, wait for its output and then take the matching image; otherwise the image sets the pace
+    paced_by_tensor = args.detect_every == 1 and scheduler is None
+    # the tracker carries boxes over the frames the model skips; when every frame has detections it would only add lag. 
+    # Tracks are missed after a few detector frames without a match, however many frames that spans
+    box_tracker = tracker.BoxTracker(max_misses=3) if not paced_by_tensor else None
+    # match images to the tensors from the same camera frame. When the model runs on every frame, frames without both are dropped; otherwise images wait up to args.pair_wait frames for their tensor. 
+    # The image branch's pool buffers are shared by the appsink, the frame being drawn, the frames in the CPU inference pool and the pairer, which gets what is left (see SamplePairer max_held)
+    max_held = max_pairer_images(cpu_pool.num_inflight if cpu_pool is not None else 0)
+    pairer = gst_configs.SamplePairer(window=3, require_tensor=True, max_held=max_held) if paced_by_tensor else gst_configs.SamplePairer(window=args.pair_wait, require_tensor=False, max_held=max_held)
+    # the action the model input was last pointed at, with --follow-view
+    view_action = commander.current_action
 
     if not hasattr(gst_conf, 'gst_str'): gst_conf.build_gst_strings(model_obj)
+    # with signal delivery the appsinks queue samples as they arrive and the loop sleeps until a frame is ready
+    delivery = gst_configs.SampleDelivery(gst_conf) if args.delivery == 'signal' else None
 
+    t_gst = time.perf_counter()
     gst_conf.start_gst()
+    startup_timer.record('start pipelines', t_gst)
     
     #we'll collect some statistics on where time is spent in the application
-    stats = {'count':0, 'total_pre_stage_s':0, 'total_output_stage_s':0, 'total_pre_stage_sq':0, 'total_output_stage_sq':0, 'total_pre_stage_min':100000, 'total_pre_stage_max':-1, 'total_infer_frame':0}
+    stats = {'count':0, 'total_pre_stage_s':0, 'total_output_stage_s':0, 'total_pre_stage_sq':0, 'total_output_stage_sq':0, 'total_pre_stage_min':100000, 'total_pre_stage_max':-1, 'total_infer_frame':0, 'kws_results':0, 'total_kws_latency_s':0, 'kws_lost':0, 'total_tensor_pull_s':0, 'total_image_pull_s':0, 'pairing':pairer.stats, 'idle_wakeups':0, 'pickup_count':0, 'total_pickup_latency_s':0, 'total_pickup_latency_sq':0, 'pickup_latency_max':0, 'delivery':delivery.stats if delivery is not None else None}
 
     #run to init and output frame. pushing images alleviates race condition between the pipelines and prevents hanging
     output_frame = display_obj.make_frame_init()
     t_loop = time.time()
 
     global stop_threads 
-    while not stop_threads:
-        #push an image from the last iteration first so we're able to create the display output immediately
-        display_obj.push_to_display(output_frame)
-        # print('pull GST buffers')
-        t_start_loop = time.time()
-        sample_tensor, _ = gst_conf.pull_sample(gst_conf.app_in_tensor, loop=False)
-        if not sample_tensor: continue
-
-        sample_image, struct_image = gst_conf.pull_sample(gst_conf.app_in_image, loop=False)
-        if not sample_image: continue
-
-        # print('got GST buffers in app code')
-
-        # tensor is the output of dlinferer. If so, format is model dependent. View tidlpostproc and tidlinferer to  see how this structure is encoded into a buffer. If there are multiple tensors, there will be offsets. Values below are specific to mobilvenetv2SSD-lite 
-        t_pre_draw = time.time()
-
-        #decode the tensor. Model dependent
-        infer_output = model_obj.decode_output_tensor(sample_tensor)
-        #resize the bounding boxes from the model to match the image dimensions. Helps with visualization logic
-        infer_output = model_obj.resize_boxes(infer_output, struct_image.get_value("height"), struct_image.get_value("width"))
-
-        try:
-            #pull keyword spotting output from the queue, but don't wait for it
-            kws_output = input_queue.get_nowait()
-
-            if np.max(kws_output[0]) > kws.AudioInference.LOGIT_THRESHOLD:
-                max_conf = int(np.argmax(kws_output[0]))
-                command = None if max_conf < 0 else kws_output[1][max_conf]
-                last_commands.append(command)
-                print(last_commands)
-        except queue.Empty: pass
-
-        action = commander.interpret_commands(last_commands)
-
-        # reshape data buffer to match the dimensions
-        input_image = gst_conf.format_image_from_sample(sample_image, struct_image)
-        # cv.imwrite('from_gst.png', input_image)
-        t_post_proc = time.time()
-
-        # create the output frame; gets pushed at top of loop
-        output_frame = display_obj.make_frame(input_image, infer_output, categories, model_obj, action)
-        t_final = time.time()
+    # samples of the frame being processed; released in the finally block too, so an exception part way through a frame does not keep its buffers from the pipeline
+    done_samples = []
+    try:
+        while not stop_threads:
+            #push an image from the last iteration first so we're able to create the display output immediately
+            t_push = time.time()
+            display_obj.push_to_display(output_frame)
+            if scheduler is not None: scheduler.record('push', time.time() - t_push)
+            # print('pull GST buffers')
+            t_start_loop = time.time()
+            # samples hold their buffers mapped (see gst_memory.SampleHandle) and must be released on every path
+            if delivery is not None:
+                # sleep until the appsinks have signalled the sample the next frame is waiting for
+                images, tensors = delivery.wait(wake_on='tensor' if paced_by_tensor else 'image')
+                for sample in images: pairer.add_image(sample)
+                for sample in tensors: pairer.add_tensor(sample)
+            else:
+                # take what the appsinks have for the pairer to match up by PTS, only waiting on the branch the next frame is short of
+                pairer.add_image(gst_conf.pull_sample(gst_conf.app_in_image, loop=False, timeout_ns=0 if len(pairer.images) > 0 else 50000000))
+                t_image_pulled = time.time()
+                pairer.add_tensor(pull_tensors(gst_conf, timeout_ns=50000000 if paced_by_tensor and pairer.waiting_for_tensor() else 0))
+                t_tensor_pulled = time.time()
+                stats['total_image_pull_s'] += t_image_pulled - t_start_loop
+                stats['total_tensor_pull_s'] += t_tensor_pulled - t_image_pulled
+
+            frame_samples = pairer.pop()
+            if frame_samples is None:
+                stats['idle_wakeups'] += 1
+                continue
+            sample_image, sample_tensor = frame_samples
+            # samples to release once this frame is drawn
+            done_samples = [sample_image, sample_tensor]
+            t_pulled = time.time()
+            if sample_image.t_arrival is not None:
+                # from when the last sample of this frame reached its appsink
+                t_arrival = max([sample_image.t_arrival] + [tile.t_arrival for tile in (sample_tensor if isinstance(sample_tensor, list) else [sample_tensor]) if tile is not None])
+                stats['pickup_count'] += 1
+                stats['total_pickup_latency_s'] += t_pulled - t_arrival
+                stats['total_pickup_latency_sq'] += (t_pulled - t_arrival)**2
+                stats['pickup_latency_max'] = max(t_pulled - t_arrival, stats['pickup_latency_max'])
+
+            # print('got GST buffers in app code')
+
+            infer_output = None
+            if cpu_pool is not None:
+                # tensor is the frame resized for the model. Start inference on it and continue with the oldest frame that is done. 
+                # The oldest result is taken first, waiting for it if the pool is full, so the pool never holds more than num_inflight frames' samples
+                result = cpu_pool.get_result(block=bool(sample_tensor) and cpu_pool.full())
+                if sample_tensor:
+                    model_shape = (model_obj.model_height, model_obj.model_width, 3)
+                    if isinstance(sample_tensor, list):
+                        # the tiles of this frame run together and come back as a list of outputs
+                        cpu_pool.submit([np.ndarray(model_shape, np.uint8, tile.data) for tile in sample_tensor], payload=(sample_image, sample_tensor))
+                    else:
+                        cpu_pool.submit(np.ndarray(model_shape, np.uint8, sample_tensor.data), payload=(sample_image, sample_tensor))
+                    # the pool reads the tensor while it runs, and the image may be drawn once the result is out; both are released with the result
+                    done_samples = []
+                if result is not None:
+                    _, infer_output, payload = result
+                    done_samples += payload
+                    # draw on the frame the result belongs to when every frame is inferred; otherwise the tracker carries boxes to the newest frame
+                    if paced_by_tensor: sample_image = payload[0]
+                elif paced_by_tensor:
+                    gst_memory.release_samples(*done_samples)
+                    continue
+                t_pre_draw = time.time()
+            else:
+                # tensor is the output of dlinferer. If so, format is model dependent. View tidlpostproc and tidlinferer to  see how this structure is encoded into a buffer. If there are multiple tensors, there will be offsets. Values below are specific to mobilvenetv2SSD-lite 
+                t_pre_draw = time.time()
+
+                #decode the tensor. Model dependent
+                if isinstance(sample_tensor, list):
+                    # copy each tile's output, since decode_output_tensor may reuse its array
+                    infer_output = [np.array(model_obj.decode_output_tensor(tile.data)) for tile in sample_tensor]
+                elif sample_tensor: infer_output = model_obj.decode_output_tensor(sample_tensor.data)
+
+            image_height, image_width = sample_image.struct.get_value("height"), sample_image.struct.get_value("width")
+            if isinstance(infer_output, list):
+                # boxes from every tile, moved into the image and with duplicates from overlapping tiles removed
+                detections = model_obj.merge_tile_detections(infer_output, image_height, image_width)
+            elif infer_output is not None:
+                #keep confident boxes and resize them from the model to match the image dimensions. Helps with visualization logic
+                detections = model_obj.postprocess_detections(infer_output, image_height, image_width)
+            else:
+                # no detector output for this frame
+                detections = None
+            if box_tracker is not None:
+                # without detections, this predicts where the tracked boxes moved
+                box_tracker.update(detections)
+                infer_output = box_tracker.get_tracks(image_height, image_width)
+            else:
+                infer_output = detections if detections is not None else np.zeros(0, dtype=model_runner.DETECTION_DTYPE)
+            t_decoded = time.time()
+
+            #take every keyword spotting result since the last frame, but don't wait for any
+            t_kws = time.time()
+            for kws_result in kws_channel.read():
+                stats['kws_results'] += 1
+                stats['total_kws_latency_s'] += t_kws - kws_result['capture_time']
+                if kws_result['label'] >= 0:
+                    last_commands.append(kws_labels[kws_result['label']])
+                    print(last_commands)
+            stats['kws_lost'] = kws_channel.lost
+
+            action = commander.interpret_commands(last_commands)
+            if args.follow_view and action != view_action:
+                follow_view(gst_conf, model_obj, display_obj, action, image_height, image_width)
+                view_action = action
+
+            # reshape data buffer to match the dimensions
+            input_image = gst_conf.format_image_from_sample(sample_image)
+            # cv.imwrite('from_gst.png', input_image)
+            t_post_proc = time.time()
+
+            # create the output frame; gets pushed at top of loop. None if it is in an appsrc pool buffer, which the display holds and push_to_display(None) pushes
+            output_frame = display_obj.make_frame(input_image, infer_output, categories, model_obj, action)
+            gst_memory.release_samples(*done_samples)
+            done_samples = []
+            t_final = time.time()
+            if stats['count'] == 0:
+                startup_timer.record('first frame', t_gst)
+                startup_timer.print_report()
         
-        #collect some stats    
-        stats['count'] += 1
-        stats['total_pre_stage_s'] += t_pre_draw - t_start_loop
-        stats['total_pre_stage_min'] = min(t_pre_draw - t_start_loop, stats['total_pre_stage_min'])
-        stats['total_pre_stage_max'] = max(t_pre_draw - t_start_loop, stats['total_pre_stage_max'])
-
-        stats['total_pre_stage_sq'] += (t_pre_draw - t_start_loop)**2
-        stats['total_output_stage_s'] += t_final - t_pre_draw
-        stats['total_output_stage_sq'] += (t_final - t_pre_draw)**2
-
-        stats['total_infer_frame'] += (time.time() - t_loop)
-        t_loop = time.time()
-        # print_stats(stats)
-
-    if stats['count'] > 0:
-        print_stats(stats)
-
-def kws_thread(output_queue, device_index):
-    audio = kws.AudioInference(modeldir='.', modelname='matchboxnet.onnx', device_index=device_index, output_queue=output_queue)
+            #collect some stats    
+            stats['count'] += 1
+            stats['total_pre_stage_s'] += t_pre_draw - t_start_loop
+            stats['total_pre_stage_min'] = min(t_pre_draw - t_start_loop, stats['total_pre_stage_min'])
+            stats['total_pre_stage_max'] = max(t_pre_draw - t_start_loop, stats['total_pre_stage_max'])
+
+            stats['total_pre_stage_sq'] += (t_pre_draw - t_start_loop)**2
+            stats['total_output_stage_s'] += t_final - t_pre_draw
+            stats['total_output_stage_sq'] += (t_final - t_pre_draw)**2
+
+            stats['total_infer_frame'] += (time.time() - t_loop)
+            t_loop = time.time()
+            # print_stats(stats)
+
+            if scheduler is not None:
+                scheduler.record('pull', t_pulled - t_start_loop)
+                scheduler.record('decode', t_decoded - t_pulled)
+                scheduler.record('draw', t_final - t_decoded)
+                if scheduler.frame_done():
+                    settings = scheduler.settings
+                    display_obj.set_quality(**settings)
+                    if settings['detect_every'] != gst_conf.detect_every:
+                        gst_conf.set_detect_every(settings['detect_every'])
+                    print(scheduler.report())
+    finally:
+        gst_memory.release_samples(*done_samples)
+        if stats['count'] > 0:
+            print_stats(stats)
+        if scheduler is not None:
+            print('Frame scheduler: %d quality changes, ended at %s' % (scheduler.level_changes, scheduler.report()))
+        if delivery is not None: delivery.stop()
+        pairer.release_all()
+        if cpu_pool is not None:
+            # release the samples of frames still in the pool
+            result = cpu_pool.get_result(block=True)
+            while result is not None:
+                gst_memory.release_samples(*result[2])
+                result = cpu_pool.get_result(block=True)
+            cpu_pool.shutdown()
+            print('CPU inference: ' + str(cpu_pool.get_stats()))
+
+def kws_thread(kws_channel, device_index, hop_seconds, int8, inference_kwargs):
+    '''
+    :param inference_kwargs: AudioInference settings from the --kws- options, see kws_matchbox.inference_options
+    '''
+    startup_timer = utils.StartupTimer()
+    audio = kws.AudioInference(modeldir='.', modelname='matchboxnet.onnx', device_index=device_index, result_channel=kws_channel, hop_seconds=hop_seconds, int8=int8, **inference_kwargs)
+    startup_timer.record('load keyword spotting model', startup_timer.t_launch)
+    t_setup = time.perf_counter()
     audio.setup()
+    startup_timer.record('open audio input', t_setup)
+    startup_timer.print_report()
 
-    while (audio.input_stream.is_active()): 
+    while (audio.source.is_active()): 
         # print something so developer knows the thread is alive
-        print('audio still running...')
+        print('audio still running... ' + str(audio.get_stats()))
         time.sleep(5)
 
     audio.stop()
 
 
 def main():
+    startup_timer = utils.StartupTimer(t_launch)
+    startup_timer.record('imports', t_launch)
     args = parse_args()
+
+    #fork a process to allow parallel processing. Start it first so keyword spotting loads while the vision model and pipelines do
+    t_kws = time.perf_counter()
+    kws_channel = kws.KWSResultChannel(capacity=64)
+    kws_process = mp.Process(target=kws_thread, args=[kws_channel, args.audio_device, args.kws_hop, args.kws_int8, kws.inference_options(args, prefix='kws-')])
+    kws_process.start()
+    startup_timer.record('start keyword spotting process', t_kws)
     
     # camera parameters and information assumed based on device in CLI args
     cam_params = gst_configs.CamParams(args.camera, device=args.device)
@@ -213,29 +422,40 @@ def main():
     categories = utils.get_categories(modeldir)
 
     # setup the model for inference. Parameters used by gst_config
+    t_model = time.perf_counter()
     model_obj = model_runner.ModelRunner(modeldir, paramsfile=paramsfile)
-    model_obj.load_model_tidl() #load model to get info about input data type
+    cpu_pool = None
+    if args.backend == 'cpu':
+        # split the cores between the frames in flight
+        model_obj.load_model(intra_op_threads=max(1, (os.cpu_count() or 1) // args.inflight))
+        cpu_pool = model_runner.CPUInferencePool(model_obj, num_inflight=args.inflight)
+        startup_timer.record('load vision model on CPU', t_model)
+    else:
+        #get info about input data type and output tensors, from a cache if this model was run before
+        layout_source = model_obj.load_model_layout()
+        startup_timer.record('load vision model layout (from %s)' % layout_source, t_model)
     
+    if args.tiles or args.follow_view:
+        # following the view moves a single tile unless --tiles is given
+        tile_cols, tile_rows = [int(n) for n in args.tiles.split('x')] if args.tiles else (1, 1)
+        print('Tiles: ' + str(model_obj.set_tiling(cam_params.width, cam_params.height, tile_cols, tile_rows, args.tile_overlap)))
+
     #create the gstreamer pipeline based on model and camera parameters
-    gst_conf = gst_configs.GstBuilder(model_params, cam_params, display_obj) 
+    t_parse = time.perf_counter()
+    gst_conf = gst_configs.GstBuilder(model_params, cam_params, display_obj, backend=args.backend, display_sink=args.display_sink, detect_every=args.detect_every, adaptive_detect_rate=args.target_fps > 0, tiles=model_obj.tiles) 
     gst_conf.build_gst_strings(model_obj)
     # start the pipeline and saves references to appsrc/appsink
     gst_conf.setup_gst_appsrcsink()
+    startup_timer.record('parse pipelines', t_parse)
 
     display_obj.set_gst_info(gst_conf.app_out, gst_conf.gst_caps)
     
-    av_queue = mp.Queue(maxsize=4)
-
     global stop_threads
     stop_threads = False
     # fork an application thread to make KB interrupts easier to catch
-    app_thread = threading.Thread(target=application_thread, args=[gst_conf, model_obj, display_obj, categories, args, av_queue])
+    app_thread = threading.Thread(target=application_thread, args=[gst_conf, model_obj, display_obj, categories, args, kws_channel, startup_timer, cpu_pool])
     app_thread.start()
 
-    #fork a process to allow parallel processing
-    kws_process = mp.Process(target=kws_thread, args=[av_queue, args.audio_device])
-    kws_process.start()
-
     try: 
         while not stop_threads:
             time.sleep(2)
@@ -247,6 +467,7 @@ def main():
     gst_conf.out_pipe.set_state(Gst.State.PAUSED)
     print('paused pipe; waiting gst thread to join')
     app_thread.join()
+    kws_channel.close()
     print('exiting...')
 
 if __name__ == '__main__':